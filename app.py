@@ -1,158 +1,432 @@
 import os
 import time
-import telebot
+import random
+import queue
 import logging
 import asyncio
-from threading import Thread
+import importlib
 
 from dotenv import load_dotenv
-from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
 
+from bootstrap import StartupTimer, bootstrap
+from bybit_http import AsyncHTTP
+from cache import MarketData
 from exchange import BybitExchange
-
-# Configure logging
-logging.basicConfig(filename='bot.log', level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+import log
+from metrics import metrics, monitor_loop_lag, serve, timed
+from notify import Notifier, TradeNotifier
+from ratelimit import RequestScheduler
+from recorder import Recorder, RecordingSession
+from resilience import CircuitOpenError, ExchangeError, ResilientSession, deadline
+from risk import RiskLimitError
+from state import StateStore
+from stream import BybitStream, MarketStream
+
+logger = logging.getLogger(__name__)
 
 load_dotenv()
 
 class BybitBot:
-    def __init__(self):
-        self.exchange = BybitExchange()
+    def __init__(self, exchange=None, store=None, name='main', market_stream=None, clock=time.time):
+        self.exchange = exchange or BybitExchange(name=name)
+        self.name = name
+        # Wall clock of the hold windows, replays pass the recorded one
+        self.clock = clock
+        # State keys of the main account keep their old names, other accounts are prefixed
+        self.key_prefix = '' if name == 'main' else f'{name}:'
+        self.events = self.exchange.events
+        # Optional StateStore: open positions and parameters survive restarts
+        self.store = store
+        # Parameter updates from other threads or the Telegram handlers, applied between ticks
+        self.commands = queue.SimpleQueue()
+        # Optional notify.Notifier for messages to the Telegram chat
+        self.notifier = None
         self.symbols = []
         self.trade_size = 6
         self.stop_loss_percentage = 1
         self.trailing_stop_percentage = 1
         self.position_duration = 10
         self.open_positions = {}
-
-    async def open_initial_positions(self):
+        self.entry_cooldown = 10
+        # symbol -> strategy task, see supervise()
+        self.tasks = {}
+        # Bounds how many symbols talk to the exchange at the same time
+        self.slots = asyncio.Semaphore(int(os.getenv('MAX_CONCURRENCY', 10)))
+        # One step of a symbol, retries included, may not take longer than this
+        self.step_deadline = float(os.getenv('STEP_DEADLINE', 30))
+        # Symbols backing off after exchange errors, the others keep trading
+        self.degraded = set()
+        self.max_backoff = 60
+        # With STREAMING=1 positions and mark prices come from websockets instead of polling,
+        # mark prices through `market_stream` when the accounts of the process share one
+        self.stream = None
+        if os.getenv('STREAMING') == '1':
+            self.stream = BybitStream(self.exchange, self.exchange.api_key, self.exchange.api_secret,
+                                      market_stream=market_stream)
+
+    async def wait_for_update(self, symbol=None, timeout=1):
+        if self.stream is not None:
+            await self.stream.wait_update(symbol, timeout)
+        else:
+            await asyncio.sleep(timeout)
+
+    def submit_parameters(self, user_messages):
+        self.commands.put(dict(user_messages))
+
+    def apply_commands(self):
+        # No awaits here, so every symbol task sees either the old or the new parameters as a whole
+        applied = False
         while True:
-            if len(self.symbols) > 0:
-                try:
-                    for symbol in self.symbols:
-                        all_pos = await self.exchange.get_symbols_pos(symbol)
-                        if len(all_pos) == 0:
-                            await self.exchange.place_orders(symbol, self.trade_size, self.stop_loss_percentage)
-                            self.open_positions[symbol] = {'stop_loss_set': False}
-                        await asyncio.sleep(10)
-                except Exception as e:
-                    print(e)
-
-    async def monitor_positions(self):
+            try:
+                params = self.commands.get_nowait()
+            except queue.Empty:
+                break
+            self.update_parameters(params)
+            applied = True
+        if applied and self.notifier is not None:
+            self.notifier.notify(f"{self.name}: Параметры успешно обновлены!")
+
+    @timed('bot_iteration_seconds')
+    async def supervise_once(self):
+        self.apply_commands()
+        wanted = set(self.symbols) | set(self.open_positions)
+        for symbol, task in list(self.tasks.items()):
+            if task.done():
+                self.tasks.pop(symbol)
+                if not task.cancelled() and task.exception() is not None:
+                    logger.error('%s task failed, restarting: %s', symbol, task.exception())
+            elif symbol not in wanted:
+                task.cancel()
+                self.tasks.pop(symbol)
+        # Sorted, so tasks start in the same order on every run
+        for symbol in sorted(wanted):
+            if symbol not in self.tasks:
+                self.tasks[symbol] = asyncio.create_task(self.run_symbol(symbol))
+        if self.stream is not None:
+            self.stream.set_symbols(wanted)
+        self.degraded &= set(self.tasks)
+        metrics.set('bot_symbol_tasks', len(self.tasks))
+        metrics.set('bot_degraded_symbols', len(self.degraded))
+
+    async def supervise(self):
+        """
+        Keeps exactly one strategy task per symbol: spawns tasks for new symbols,
+        cancels tasks of removed ones and restarts crashed ones.
+        Symbols with an open position stay managed after they are removed from the list.
+        """
         while True:
+            await self.supervise_once()
+            await asyncio.sleep(1)
+
+    async def run_symbol(self, symbol):
+        failures = 0
+        while symbol in self.symbols or symbol in self.open_positions:
             try:
-                for symbol in list(self.open_positions.keys()):
-                    positions = await self.exchange.get_symbols_pos(symbol)
-                    if not self.open_positions[symbol]['stop_loss_set'] and len(positions) == 2:
-                        await self.exchange.set_stop_losses(symbol, self.stop_loss_percentage)
-                        self.open_positions[symbol]['stop_loss_set'] = True
-                    if len(positions) == 1:
-                        await self.exchange.delete_stop_loss(symbol)
-                        await self.exchange.set_stop_losses_trailing_stop(symbol, self.trailing_stop_percentage)
-                        await asyncio.sleep(self.position_duration)
-                        await self.exchange.close_position(symbol, positions[0]['positionIdx'])
-                        self.open_positions.pop(symbol)
-                await asyncio.sleep(1)
+                with deadline(self.step_deadline):
+                    delay = await self.step_symbol(symbol)
+                failures = 0
+                self.degraded.discard(symbol)
+            except RiskLimitError as e:
+                # Limits free up as positions close, retry on the entry cooldown
+                logger.info('%s', e)
+                delay = e.retry_after or self.entry_cooldown
+            except CircuitOpenError as e:
+                logger.info('%s: %s', symbol, e)
+                self.degraded.add(symbol)
+                delay = e.retry_after + random.uniform(0, 1)
+            except ExchangeError as e:
+                failures += 1
+                self.degraded.add(symbol)
+                delay = random.uniform(0.5, 1) * min(self.max_backoff, 2 ** failures)
+                logger.warning('%s: %s, backing off %.1fs', symbol, e, delay)
             except Exception as e:
-                print(e)
-            await asyncio.sleep(1)
+                logger.exception('%s: %s', symbol, e)
+                delay = 1
+            if delay:
+                await asyncio.sleep(delay)
+            else:
+                await self.wait_for_update(symbol)
+
+    @timed('bot_iteration_seconds')
+    async def step_symbol(self, symbol):
+        """
+        One non-blocking step of the symbol's state machine.
+        Returns how long the symbol must sleep, or None to wait for the next position update.
+        """
+        positions = await self.exchange.get_symbols_pos(symbol)
+        state = self.open_positions.get(symbol)
+
+        if state is None:
+            if symbol in self.symbols and len(positions) == 0:
+                async with self.slots:
+                    results = await self.exchange.place_orders(symbol, self.trade_size, self.stop_loss_percentage)
+                if not any(result['code'] == 0 for result in results):
+                    # Both legs rejected, nothing to manage
+                    return self.entry_cooldown
+                self.open_positions[symbol] = {'stop_loss_set': False}
+                self.save_state()
+                # Per-symbol cooldown, other symbols keep trading meanwhile
+                return self.entry_cooldown
+            return None
+
+        if 'close_at' in state:
+            # Hold window of the profitable leg only delays this symbol
+            remaining = state['close_at'] - self.clock()
+            if remaining > 0:
+                return remaining
+            if len(positions) > 0:
+                async with self.slots:
+                    await self.exchange.close_position(symbol, positions[0]['positionIdx'])
+            self.end_trade(symbol)
+            return None
+
+        if not state['stop_loss_set'] and len(positions) == 2:
+            async with self.slots:
+                await self.exchange.set_stop_losses(symbol, self.stop_loss_percentage)
+            state['stop_loss_set'] = True
+            self.save_state()
+
+        if len(positions) == 1:
+            if state['stop_loss_set']:
+                closed_idx = 2 if int(positions[0]['positionIdx']) == 1 else 1
+                self.exchange.events.emit('stop_loss_hit', symbol, positionIdx=closed_idx)
+            async with self.slots:
+                await self.exchange.switch_to_trailing_stop(symbol, self.trailing_stop_percentage)
+            # Wall clock, so the hold window survives a restart
+            state['close_at'] = self.clock() + self.position_duration
+            self.save_state()
+            return self.position_duration
+
+        if len(positions) == 0:
+            # Both legs are gone already, possibly both stopped out during the entry cooldown
+            self.end_trade(symbol)
+        return None
+
+    def end_trade(self, symbol):
+        self.open_positions.pop(symbol)
+        # The next entry starts from plain stop losses, not the trailing stops of this one
+        self.exchange.stops.forget(symbol)
+        self.save_state()
+
+    def save_state(self):
+        if self.store is not None:
+            self.store.put(self.key_prefix + 'open_positions', self.open_positions)
+
+    def get_parameters(self):
+        return {
+            'coins_pair': self.symbols,
+            'trade_size': self.trade_size,
+            'stop_loss': self.stop_loss_percentage,
+            'trailing_stop_percentage': self.trailing_stop_percentage,
+            'position_duration': self.position_duration,
+        }
+
+    @staticmethod
+    def reconcile_positions(open_positions, positions, symbols):
+        """
+        Brings the journaled states of `symbols` in line with a snapshot of the exchange positions.
+        """
+        by_symbol = {}
+        for pos in positions:
+            by_symbol.setdefault(pos['symbol'], []).append(pos)
+        for symbol in symbols:
+            if symbol not in by_symbol:
+                # Closed while nobody was watching
+                open_positions.pop(symbol, None)
+            elif symbol not in open_positions:
+                # Entered right before a crash, before the entry was journaled
+                open_positions[symbol] = {
+                    'stop_loss_set': all(float(pos.get('stopLoss') or 0) > 0 for pos in by_symbol[symbol])}
+        return open_positions
+
+    async def restore(self):
+        """
+        Warm restart: replays the journaled state and reconciles it against one bulk positions fetch.
+        """
+        state = self.store.load()
+        if self.key_prefix + 'params' in state:
+            self.update_parameters(state[self.key_prefix + 'params'], save=False)
+        open_positions = state.get(self.key_prefix + 'open_positions', {})
+        self.reconcile_positions(open_positions, await self.exchange.get_positions(),
+                                 set(open_positions) | set(self.symbols))
+        self.open_positions = open_positions
+        self.save_state()
+        logger.info('%s: restored %d open positions: %s', self.name, len(open_positions), list(open_positions))
 
     async def start(self):
-        await asyncio.gather(self.open_initial_positions(), self.monitor_positions())
+        if self.store is not None:
+            try:
+                await self.restore()
+            except Exception as e:
+                logger.warning('%s: restore failed: %s', self.name, e)
+        tasks = [self.supervise()]
+        # A shared MarketData is loaded and refreshed once by main()
+        if self.exchange.owns_market:
+            try:
+                count = await self.exchange.instruments.load()
+                logger.info('Loaded precisions for %d instruments', count)
+            except Exception as e:
+                logger.warning('Instruments load failed: %s', e)
+            tasks.append(self.exchange.instruments.run())
+        if self.stream is not None:
+            tasks.append(self.stream.run())
+        await asyncio.gather(*tasks)
 
-    def update_parameters(self, user_messages):
+    def update_parameters(self, user_messages, save=True):
         self.symbols = user_messages.get('coins_pair', self.symbols)
-        self.trade_size = user_messages.get('take_profit', self.trade_size)
+        self.trade_size = user_messages.get('trade_size', self.trade_size)
         self.stop_loss_percentage = user_messages.get('stop_loss', self.stop_loss_percentage)
         self.trailing_stop_percentage = user_messages.get('trailing_stop_percentage', self.trailing_stop_percentage)
         self.position_duration = user_messages.get('position_duration', self.position_duration)
-        print(f"Updated parameters:"
-              f"{self.symbols}, {self.trade_size}, {self.stop_loss_percentage}, {self.trailing_stop_percentage}, "
-              f"{self.position_duration}")
+        logger.info('%s: updated parameters: %s, %s, %s, %s, %s', self.name, self.symbols, self.trade_size,
+                    self.stop_loss_percentage, self.trailing_stop_percentage, self.position_duration)
+        if save and self.store is not None:
+            self.store.put(self.key_prefix + 'params', self.get_parameters())
 
 
-class TGTradingBot:
-    def __init__(self, token, monitor):
-        logging.basicConfig(filename='bot.log', level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+def import_telegram():
+    # aiogram alone takes seconds to import, so it is loaded only when Telegram is started, see main()
+    importlib.import_module('aiogram.filters')
+    importlib.import_module('aiogram.types')
+
 
-        self.bot = telebot.TeleBot(token)
-        self.monitor = monitor
+class TGTradingBot:
+    def __init__(self, token, monitors, store=None):
+        from aiogram import Bot, Dispatcher
+        from aiogram.filters import Command
+
+        self.bot = Bot(token)
+        self.dp = Dispatcher()
+        # account name -> BybitBot
+        self.monitors = monitors
         self.user_messages = {}
         self.user_states = {}
-        self.chat_id = 7348443729
-
-        self.bot.message_handler(commands=['start'])(self.handle_start)
-        self.bot.message_handler(commands=['coins_pair'])(self.handle_set_coins)
-        self.bot.message_handler(commands=['stop_loss'])(self.handle_stop_loss)
-        self.bot.message_handler(commands=['trade_size'])(self.handle_set_trade_size)
-        self.bot.message_handler(commands=['trailing_stop_percentage'])(self.handle_set_trailing_stop_percentage)
-        self.bot.message_handler(commands=['position_duration'])(self.handle_set_position_duration)
-        self.bot.message_handler(commands=['stop_bot'])(self.handle_stop_bot)
-
-        self.bot.message_handler(func=lambda message: True)(self.handle_text_message)
-        self.bot.callback_query_handler(func=lambda call: True)(self.callback_query)
+        # Account the parameters are submitted to, or 'all'
+        self.target = 'all'
+        self.store = store
+        if store is not None:
+            state = store.load()
+            self.user_messages = state.get('tg_user_messages', {})
+            self.user_states = {int(chat_id): s for chat_id, s in state.get('tg_user_states', {}).items()}
+            self.target = state.get('tg_target', self.target)
+        if self.target != 'all' and self.target not in monitors:
+            self.target = 'all'
+        self.chat_id = int(os.getenv('TG_CHAT_ID', 7348443729))
+        # Trade alerts and other bot-initiated messages, batched and rate-limited
+        self.notifier = Notifier(self.bot, self.chat_id)
+        # Trade events of every account, coalesced into digests off the trading path
+        window = float(os.getenv('NOTIFY_WINDOW', 2))
+        self.trade_notifiers = [TradeNotifier(monitor.events.subscribe(), self.notifier, window=window,
+                                              prefix=f'[{name}] ' if len(monitors) > 1 else '')
+                                for name, monitor in monitors.items()]
+
+        self.dp.message.register(self.handle_start, Command('start'))
+        self.dp.message.register(self.handle_set_coins, Command('coins_pair'))
+        self.dp.message.register(self.handle_stop_loss, Command('stop_loss'))
+        self.dp.message.register(self.handle_set_trade_size, Command('trade_size'))
+        self.dp.message.register(self.handle_set_trailing_stop_percentage, Command('trailing_stop_percentage'))
+        self.dp.message.register(self.handle_set_position_duration, Command('position_duration'))
+        self.dp.message.register(self.handle_stop_bot, Command('stop_bot'))
+        self.dp.message.register(self.handle_metrics, Command('metrics'))
+        self.dp.message.register(self.handle_account, Command('account'))
+        self.dp.message.register(self.handle_risk, Command('risk'))
+
+        self.dp.message.register(self.handle_text_message)
+        self.dp.callback_query.register(self.callback_query)
 
     def update_user_state(self, chat_id, new_state):
         self.user_states[chat_id] = new_state
+        if self.store is not None:
+            self.store.put('tg_user_states', self.user_states)
+
+    def save_user_messages(self):
+        if self.store is not None:
+            self.store.put('tg_user_messages', self.user_messages)
 
     def get_user_state(self, chat_id):
         return self.user_states.get(chat_id, 'start')
 
-    def handle_start(self, message):
+    async def handle_start(self, message):
         chat_id = message.chat.id
         if chat_id == self.chat_id:
             self.update_user_state(self.chat_id, 'start')
-            self.bot.send_message(self.chat_id, "Указать монеты: /coins_pair; "
+            await self.bot.send_message(self.chat_id, "Указать монеты: /coins_pair; "
                                               "\nстоп лосс: /stop_loss; \ntrailing stop: /trailing_stop_percentage; "
                                               "\nвремя открытой сделки: /position_duration"
                                               "\nУстановить размер депозита на каждую сделку: /trade_size; "
-                                              "\nОстановить бота: /stop_bot",
+                                              "\nОстановить бота: /stop_bot"
+                                              "\nМетрики: /metrics"
+                                              "\nРиск: /risk"
+                                              f"\nАккаунт ({self.target}): /account",
                                   reply_markup=self.get_update_button())
 
-    def handle_set_coins(self, message):
+    async def handle_set_coins(self, message):
         chat_id = message.chat.id
         if chat_id == self.chat_id:
             self.update_user_state(self.chat_id, 'coins_pair')
-            self.bot.send_message(self.chat_id, "Выберите монеты на которых "
+            await self.bot.send_message(self.chat_id, "Выберите монеты на которых "
                                           "будете торговать. Запишите через пробел как в образце"
                                           "\n обязательно используйте только такой формат записи монет"
                                           "\n(например: DOGEUSDT 1000PEPEUSDT BTCUSDT ETHUSDT):")
 
-    def handle_stop_bot(self, message):
+    async def handle_stop_bot(self, message):
         chat_id = message.chat.id
         if chat_id == self.chat_id:
             self.update_user_state(self.chat_id, 'stop_bot')
-            self.bot.send_message(self.chat_id, "Для остановки бота и продолжения мониторинга отправьте "
+            await self.bot.send_message(self.chat_id, "Для остановки бота и продолжения мониторинга отправьте "
                                               "любой текст и нажмите "
                                               "`Обновить параметры`")
 
 
-    def handle_stop_loss(self, message):
+    async def handle_metrics(self, message):
+        chat_id = message.chat.id
+        if chat_id == self.chat_id:
+            await self.bot.send_message(self.chat_id, metrics.summary()[:4000])
+
+    async def handle_risk(self, message):
+        chat_id = message.chat.id
+        if chat_id == self.chat_id:
+            parts = []
+            for name, monitor in self.monitors.items():
+                exchange = getattr(monitor, 'exchange', None)
+                # The coordinator trades nothing itself, see the workers' metrics
+                text = exchange.risk.summary() if exchange is not None else "нет данных"
+                parts.append(f"[{name}]\n{text}" if len(self.monitors) > 1 else text)
+            await self.bot.send_message(self.chat_id, '\n\n'.join(parts)[:4000])
+
+    async def handle_account(self, message):
+        chat_id = message.chat.id
+        if chat_id == self.chat_id:
+            self.update_user_state(self.chat_id, 'account')
+            await self.bot.send_message(self.chat_id, f"Сейчас выбран: {self.target}. "
+                                                      f"Введите аккаунт ({', '.join(self.monitors)}) или all:")
+
+    async def handle_stop_loss(self, message):
         chat_id = message.chat.id
         if chat_id == self.chat_id:
             self.update_user_state(self.chat_id, 'stop_loss')
-            self.bot.send_message(self.chat_id, "Введите стоп лосс (%):")
+            await self.bot.send_message(self.chat_id, "Введите стоп лосс (%):")
 
-    def handle_set_trade_size(self, message):
+    async def handle_set_trade_size(self, message):
         chat_id = message.chat.id
         if chat_id == self.chat_id:
             self.update_user_state(self.chat_id, 'trade_size')
-            self.bot.send_message(self.chat_id, "Введите размер депозита который вы хотите использовать для каждой монеты в USDT:")
+            await self.bot.send_message(self.chat_id, "Введите размер депозита который вы хотите использовать для каждой монеты в USDT:")
 
-    def handle_set_trailing_stop_percentage(self, message):
+    async def handle_set_trailing_stop_percentage(self, message):
         chat_id = message.chat.id
         if chat_id == self.chat_id:
             self.update_user_state(self.chat_id, 'trailing_stop_percentage')
-            self.bot.send_message(self.chat_id, "Введите процент trailing stop(%):")
+            await self.bot.send_message(self.chat_id, "Введите процент trailing stop(%):")
 
-    def handle_set_position_duration(self, message):
+    async def handle_set_position_duration(self, message):
         chat_id = message.chat.id
         if chat_id == self.chat_id:
             self.update_user_state(self.chat_id, 'position_duration')
-            self.bot.send_message(self.chat_id, "Введите время в секундах на которое будет "
+            await self.bot.send_message(self.chat_id, "Введите время в секундах на которое будет "
                                                 "открыто прибыльное направление после закрытия убыточного:")
 
-    def handle_text_message(self, message):
+    async def handle_text_message(self, message):
         chat_id = message.chat.id
         user_state = self.get_user_state(chat_id)
 
@@ -161,71 +435,200 @@ class TGTradingBot:
             if chat_id == self.chat_id:
                 exch_lst = text.split()
                 self.user_messages['coins_pair'] = exch_lst
-                self.bot.send_message(self.chat_id, f"Ваш выбор '{text}' сохранен.")
+                self.save_user_messages()
+                await self.bot.send_message(self.chat_id, f"Ваш выбор '{text}' сохранен.")
 
 
         if user_state == 'stop_bot':
             text = message.text
             if chat_id == self.chat_id:
                 self.user_messages['coins_pair'] = []
-                self.bot.send_message(self.chat_id, f"Теперь нажмите обновить параметры.")
+                self.save_user_messages()
+                await self.bot.send_message(self.chat_id, f"Теперь нажмите обновить параметры.")
+
 
+        if user_state == 'account':
+            text = message.text.strip()
+            if chat_id == self.chat_id:
+                if text != 'all' and text not in self.monitors:
+                    await self.bot.send_message(self.chat_id, f"Нет аккаунта '{text}'.")
+                else:
+                    self.target = text
+                    if self.store is not None:
+                        self.store.put('tg_target', self.target)
+                    await self.bot.send_message(self.chat_id, f"Параметры будут применены к: {text}.")
 
         if user_state == 'stop_loss':
             text = message.text
             if chat_id == self.chat_id:
                 self.user_messages['stop_loss'] = float(text)
-                self.bot.send_message(self.chat_id, f"Ваш выбор '{text}' сохранен.")
+                self.save_user_messages()
+                await self.bot.send_message(self.chat_id, f"Ваш выбор '{text}' сохранен.")
 
         if user_state == 'trade_size':
             text = message.text
             if chat_id == self.chat_id:
                 self.user_messages['trade_size'] = float(text)
-                self.bot.send_message(self.chat_id, f"Ваш выбор '{text}' сохранен.")
+                self.save_user_messages()
+                await self.bot.send_message(self.chat_id, f"Ваш выбор '{text}' сохранен.")
 
         if user_state == 'trailing_stop_percentage':
             text = message.text
             if chat_id == self.chat_id:
                 self.user_messages['trailing_stop_percentage'] = float(text)
-                self.bot.send_message(self.chat_id, f"Ваш выбор '{text}' сохранен.")
+                self.save_user_messages()
+                await self.bot.send_message(self.chat_id, f"Ваш выбор '{text}' сохранен.")
 
         if user_state == 'position_duration':
             text = message.text
             if chat_id == self.chat_id:
                 self.user_messages['position_duration'] = float(text)
-                self.bot.send_message(self.chat_id, f"Ваш выбор '{text}' сохранен.")
+                self.save_user_messages()
+                await self.bot.send_message(self.chat_id, f"Ваш выбор '{text}' сохранен.")
 
     def get_update_button(self):
-        markup = InlineKeyboardMarkup()
-        button = InlineKeyboardButton("Обновить параметры", callback_data="update_parameters")
-        markup.add(button)
-        return markup
+        from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
-    def callback_query(self, call):
-        if call.data == "update_parameters":
-            self.monitor.update_parameters(self.user_messages)
-            self.bot.send_message(call.message.chat.id, "Параметры успешно обновлены!")
+        button = InlineKeyboardButton(text="Обновить параметры", callback_data="update_parameters")
+        return InlineKeyboardMarkup(inline_keyboard=[[button]])
 
-    def run(self):
-        while True:
-            try:
-                self.bot.polling(none_stop=True, interval=0, timeout=20)
-            except ConnectionError as e:
-                logging.error(f"ConnectionError: {e}")
-                time.sleep(15)
-            except Exception as e:
-                logging.exception("Unexpected error: %s", e)
-                time.sleep(15)
-
-
-async def main():
+    async def callback_query(self, call):
+        await call.answer()
+        if call.data == "update_parameters":
+            # Applied by BybitBot between strategy ticks, it confirms through the notifier
+            targets = self.monitors.values() if self.target == 'all' else [self.monitors[self.target]]
+            for monitor in targets:
+                monitor.submit_parameters(self.user_messages)
+
+    async def run(self):
+        await asyncio.gather(self.dp.start_polling(self.bot, handle_signals=False), self.notifier.run(),
+                             *[notifier.run() for notifier in self.trade_notifiers])
+
+
+def load_accounts():
+    """
+    ACCOUNTS=main,sub1 reads the keys from API_MAIN/SECRET_MAIN, API_SUB1/SECRET_SUB1.
+    Without ACCOUNTS there is a single 'main' account on API/SECRET.
+    """
+    names = [name.strip() for name in os.getenv('ACCOUNTS', '').split(',') if name.strip()]
+    if not names:
+        return {'main': (str(os.getenv('API')), str(os.getenv('SECRET')))}
+    return {name: (str(os.getenv(f'API_{name.upper()}')), str(os.getenv(f'SECRET_{name.upper()}')))
+            for name in names}
+
+
+def build_monitors(store, market, recorder=None, market_stream=None):
+    # Every account gets its own session pool and per-key rate limits, market data and the IP budget are shared
+    monitors = {}
+    for name, (api_key, api_secret) in load_accounts().items():
+        exchange = BybitExchange(market=market, api_key=api_key, api_secret=api_secret, name=name, recorder=recorder)
+        monitors[name] = BybitBot(exchange, store, name, market_stream)
+    return monitors
+
+
+async def run_coordinator():
+    # ROLE=coordinator: Telegram and symbol assignment only, trading happens in the workers
+    from cluster import Coordinator, connect
+
+    client = connect()
+    store = StateStore(os.getenv('STATE_DB', 'state.db'))
+    coordinator = Coordinator(client, prefix=os.getenv('REDIS_PREFIX', 'lenin'),
+                              lease=float(os.getenv('WORKER_LEASE', 5)))
+    bot = TGTradingBot(str(os.getenv('TG_TOKEN')), {coordinator.name: coordinator}, store)
+    coordinator.notifier = bot.notifier
+    await serve(port=int(os.getenv('METRICS_PORT', 9100)))
+    try:
+        await asyncio.gather(coordinator.run(), monitor_loop_lag(), store.run(), bot.run())
+    finally:
+        await bot.bot.session.close()
+        store.close()
+        await client.aclose()
+
+
+async def run_worker():
+    # ROLE=worker: trades the symbols the coordinator assigns to this process, on the API/SECRET account
+    from cluster import Worker, connect
+
+    client = connect()
     monitor = BybitBot()
-    bot = TGTradingBot(str(os.getenv('TG_TOKEN')), monitor)
+    worker = Worker(client, monitor, prefix=os.getenv('REDIS_PREFIX', 'lenin'),
+                    lease=float(os.getenv('WORKER_LEASE', 5)))
+    # Several workers may share a host, so metrics are served only on an explicit port
+    if os.getenv('METRICS_PORT'):
+        await serve(port=int(os.getenv('METRICS_PORT')))
+    try:
+        await asyncio.gather(worker.run(), monitor_loop_lag())
+    finally:
+        await worker.close()
+        await monitor.exchange.close()
+        await client.aclose()
 
-    bot_thread = Thread(target=bot.run)
-    bot_thread.start()
 
-    await monitor.start()
+async def main():
+    role = os.getenv('ROLE', 'standalone')
+    if role == 'coordinator':
+        return await run_coordinator()
+    if role == 'worker':
+        return await run_worker()
+    timer = StartupTimer()
+    store = StateStore(os.getenv('STATE_DB', 'state.db'))
+    # RECORD_DIR=... keeps every ticker, position and order ack for recorder.py replays
+    recorder = Recorder(os.getenv('RECORD_DIR')) if os.getenv('RECORD_DIR') else None
+    # Public endpoints only, no keys needed, rate limited like the accounts
+    public_scheduler = RequestScheduler()
+    metrics.register_collector('rate_limiter', public_scheduler.stats, account='public')
+    public = AsyncHTTP(max_in_flight=int(os.getenv('MAX_IN_FLIGHT', 20)), scheduler=public_scheduler)
+    if recorder is not None:
+        public = RecordingSession(public, recorder)
+    market = MarketData(ResilientSession(public),
+                        mark_price_ttl=float(os.getenv('MARK_PRICE_TTL', 5)),
+                        ticker_ttl=float(os.getenv('TICKER_TTL', 1)))
+    # One tickers socket for every account
+    market_stream = MarketStream(market, recorder) if os.getenv('STREAMING') == '1' else None
+    monitors = build_monitors(store, market, recorder, market_stream)
+    bot = None
+    running = []
+    try:
+        with timer.stage('bootstrap'):
+            rejected = await bootstrap(market, monitors, timer)
+        for name in rejected:
+            await monitors.pop(name).exchange.close()
+        if not monitors:
+            raise RuntimeError('No account with valid API keys')
+        await serve(port=int(os.getenv('METRICS_PORT', 9100)))
+        tasks = [market.instruments.run(), monitor_loop_lag(), store.run()]
+        if recorder is not None:
+            tasks.append(recorder.run())
+        if market_stream is not None:
+            tasks.append(market_stream.run())
+        # Trading starts before Telegram, messages sent meanwhile are simply not forwarded
+        running = [asyncio.ensure_future(task) for task in tasks + [monitor.start() for monitor in monitors.values()]]
+        timer.mark('ready')
+        with timer.stage('telegram'):
+            await asyncio.to_thread(import_telegram)
+            bot = TGTradingBot(str(os.getenv('TG_TOKEN')), monitors, store)
+        for monitor in monitors.values():
+            monitor.notifier = bot.notifier
+        timer.mark('total')
+        logger.info(timer.report())
+        timer.publish()
+        bot.notifier.notify(f"Бот запущен, готов к торговле через {timer.stages['ready']:.2f} с")
+        await asyncio.gather(*running, bot.run())
+    finally:
+        for task in running:
+            task.cancel()
+        for monitor in monitors.values():
+            await monitor.exchange.close()
+        await market.session.close()
+        if bot is not None:
+            await bot.bot.session.close()
+        store.close()
+        if recorder is not None:
+            recorder.close()
 
 if __name__ == '__main__':
-    asyncio.run(main())
+    listener = log.setup()
+    try:
+        asyncio.run(main())
+    finally:
+        listener.stop()
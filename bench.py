@@ -0,0 +1,114 @@
+"""
+Offline benchmark: runs BybitBot against the simulated exchange for 1, 10 and 100 symbols.
+
+    python bench.py --duration 30 --latency 0.02 --out bench.json
+    python bench.py --symbols 10 --faults 0.1    # inject network errors, lost responses, 429s and hangs
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+
+from app import BybitBot
+from exchange import BybitExchange
+from metrics import metrics, monitor_loop_lag
+from sim import FaultyBybit, SimulatedBybit, load_path, synthetic_path
+
+
+def histogram_stats(name, method=None):
+    labels = (('method', method),) if method else ()
+    histogram = metrics.histograms.get((name, labels))
+    if histogram is None or histogram.count == 0:
+        return {'n': 0, 'avg_ms': 0.0, 'p95_ms': 0.0, 'max_ms': 0.0}
+    return {
+        'n': histogram.count,
+        'avg_ms': histogram.sum / histogram.count * 1000,
+        'p95_ms': histogram.quantile(0.95) * 1000,
+        'max_ms': histogram.max * 1000,
+    }
+
+
+async def run_case(symbols_count, duration, latency, rate_limit, volatility, path=None, seed=1, faults=0.0):
+    metrics.reset()
+    symbols = [f'SIM{i}USDT' for i in range(symbols_count)]
+    paths = {symbol: list(path) if path else synthetic_path(1.0, volatility, seed=seed + i)
+             for i, symbol in enumerate(symbols)}
+    sim = SimulatedBybit(paths, tick_interval=0.1, latency=latency, rate_limit=rate_limit)
+    session = sim
+    if faults:
+        session = FaultyBybit(sim, error_rate=faults, lost_rate=faults / 2, rate_limit_rate=faults / 2,
+                              hang_rate=faults / 10, hang=5, seed=seed)
+    bot = BybitBot(BybitExchange(session=session))
+    bot.step_deadline = 3
+    bot.symbols = symbols
+    bot.entry_cooldown = 1
+    bot.position_duration = 2
+    bot.stop_loss_percentage = 0.5
+    bot.trailing_stop_percentage = 0.3
+
+    await bot.exchange.instruments.load()
+    tasks = [asyncio.create_task(bot.supervise()), asyncio.create_task(monitor_loop_lag(0.05))]
+    with contextlib.redirect_stdout(io.StringIO()):
+        await asyncio.sleep(duration)
+    for task in tasks + list(bot.tasks.values()):
+        task.cancel()
+    await asyncio.gather(*tasks, *bot.tasks.values(), return_exceptions=True)
+
+    cycles = histogram_stats('bot_iteration_seconds', 'supervise_once')['n'] or 1
+    steps = histogram_stats('bot_iteration_seconds', 'step_symbol')['n'] or 1
+    return {
+        'symbols': symbols_count,
+        'api_calls': sim.api_calls,
+        'api_calls_per_cycle': sim.api_calls / cycles,
+        'api_calls_per_step': sim.api_calls / steps,
+        'calls_by_method': dict(sorted(sim.calls.items())),
+        'entry': histogram_stats('exchange_call_seconds', 'place_orders'),
+        'stop_set': histogram_stats('exchange_call_seconds', 'set_stop_losses'),
+        'trailing_set': histogram_stats('exchange_call_seconds', 'switch_to_trailing_stop'),
+        'loop_lag': histogram_stats('event_loop_lag_seconds'),
+        'triggers': len(sim.triggered),
+        'faults': dict(getattr(session, 'injected', {})),
+        'retries': bot.exchange.session.retries,
+        'failed_calls': bot.exchange.session.failures,
+        'open_legs': len(sim.positions),
+    }
+
+
+def print_report(results):
+    print(f"{'symbols':>8} {'calls':>7} {'calls/cyc':>10} {'entry avg/p95 ms':>18} "
+          f"{'stop avg/p95 ms':>17} {'lag avg/max ms':>16}")
+    for r in results:
+        print(f"{r['symbols']:>8} {r['api_calls']:>7} {r['api_calls_per_cycle']:>10.1f} "
+              f"{r['entry']['avg_ms']:>8.1f}/{r['entry']['p95_ms']:<9.0f} "
+              f"{r['stop_set']['avg_ms']:>7.1f}/{r['stop_set']['p95_ms']:<9.0f} "
+              f"{r['loop_lag']['avg_ms']:>7.2f}/{r['loop_lag']['max_ms']:<8.2f}")
+        if r['faults']:
+            print(f"{'':>8} faults {r['faults']}, retries {r['retries']}, failed calls {r['failed_calls']}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Benchmark BybitBot against a simulated exchange')
+    parser.add_argument('--symbols', type=int, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--duration', type=float, default=20, help='seconds per case')
+    parser.add_argument('--latency', type=float, default=0.02, help='simulated API latency, seconds')
+    parser.add_argument('--rate-limit', type=int, default=None, help='simulated requests per second')
+    parser.add_argument('--volatility', type=float, default=0.002, help='per-tick volatility of synthetic paths')
+    parser.add_argument('--path', help='CSV with recorded mark prices to use for every symbol')
+    parser.add_argument('--faults', type=float, default=0.0, help='share of calls failing with injected faults')
+    parser.add_argument('--out', help='write results as JSON, e.g. to compare against a baseline run')
+    args = parser.parse_args()
+
+    path = load_path(args.path) if args.path else None
+    results = []
+    for count in args.symbols:
+        results.append(await run_case(count, args.duration, args.latency, args.rate_limit, args.volatility, path,
+                                       faults=args.faults))
+    print_report(results)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
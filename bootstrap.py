@@ -0,0 +1,111 @@
+"""
+Startup work the first trades would otherwise pay for one symbol at a time, done up front and concurrently:
+keep-alive connections are opened, the instruments table, mark prices and every account's positions are
+loaded in bulk, API keys are checked and the local clock is compared with the exchange's.
+"""
+import asyncio
+import contextlib
+import logging
+import os
+import time
+
+from metrics import metrics
+from resilience import AuthError
+
+logger = logging.getLogger(__name__)
+
+
+# Requests are signed with the local clock and rejected outside recv_window (5s), warn well before that
+MAX_CLOCK_OFFSET = 1.0
+
+
+class StartupTimer:
+    """
+    Seconds per startup stage. Stages may overlap, `ready` and `total` are measured from the start.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = time.perf_counter() - start
+
+    def mark(self, name):
+        self.stages[name] = time.perf_counter() - self.started
+
+    def report(self):
+        return 'Startup: ' + ', '.join(f'{name} {seconds:.3f}s' for name, seconds in self.stages.items())
+
+    def publish(self):
+        for name, seconds in self.stages.items():
+            metrics.set('startup_seconds', seconds, stage=name)
+
+
+async def server_offset(session):
+    # Exchange clock minus local clock, with the request's round trip split evenly
+    sent = time.time()
+    resp = await session.get_server_time()
+    received = time.time()
+    return int(resp['result']['timeNano']) / 1e9 - (sent + received) / 2
+
+
+async def warm(session, connections):
+    """
+    Opens `connections` keep-alive connections with concurrent server time requests. Returns the clock offset.
+    """
+    offsets = await asyncio.gather(*(server_offset(session) for _ in range(connections)))
+    # The quickest answer has the least queueing in it
+    return min(offsets, key=abs)
+
+
+async def bootstrap(market, monitors, timer, connections=None):
+    """
+    Prepares the shared market data and every account. Returns the names of accounts whose keys were refused,
+    other failures are only logged: the caches load lazily anyway.
+    """
+    connections = connections or int(os.getenv('WARM_CONNECTIONS', 4))
+
+    async def clock():
+        with timer.stage('clock'):
+            offset = await warm(market.session, connections)
+        metrics.set('clock_offset_seconds', offset)
+        if abs(offset) > MAX_CLOCK_OFFSET:
+            logger.warning('Local clock is %.3fs off the exchange, signed requests may be rejected', -offset)
+
+    async def instruments():
+        with timer.stage('instruments'):
+            count = await market.instruments.load()
+        logger.info('Loaded precisions for %d instruments', count)
+
+    async def mark_prices():
+        with timer.stage('mark_prices'):
+            count = await market.load_mark_prices()
+        logger.info('Loaded mark prices for %d symbols', count)
+
+    async def account(name, exchange):
+        with timer.stage(f'account.{name}'):
+            # The positions request is signed, so it also checks the keys
+            _, positions = await asyncio.gather(warm(exchange.session, connections), exchange.get_positions())
+        logger.info('%s: keys valid, %d open positions', name, len(positions))
+
+    names = list(monitors)
+    results = await asyncio.gather(clock(), instruments(), mark_prices(),
+                                   *(account(name, monitors[name].exchange) for name in names),
+                                   return_exceptions=True)
+    for stage, result in zip(('clock', 'instruments', 'mark prices'), results):
+        if isinstance(result, Exception):
+            logger.warning('Bootstrap %s failed: %s', stage, result)
+    rejected = []
+    for name, result in zip(names, results[3:]):
+        if isinstance(result, AuthError):
+            logger.error('%s: API keys rejected: %s', name, result)
+            rejected.append(name)
+        elif isinstance(result, Exception):
+            logger.warning('%s: bootstrap failed: %s', name, result)
+    return rejected
@@ -0,0 +1,157 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import time
+
+import aiohttp
+from pybit import exceptions
+from yarl import URL
+
+from metrics import metrics
+from ratelimit import endpoint_group
+
+
+MAINNET = 'https://api.bybit.com'
+TESTNET = 'https://api-testnet.bybit.com'
+
+# Bybit v5 expects these values as strings in request bodies
+STRING_PARAMS = {'qty', 'price', 'triggerPrice', 'takeProfit', 'stopLoss', 'trailingStop', 'activePrice',
+                 'tpSize', 'slSize', 'tpLimitPrice', 'slLimitPrice'}
+
+
+class AsyncHTTP:
+    """
+    Non-blocking replacement for pybit's unified_trading.HTTP.
+    Same method names and response shape, but every call is awaited on a pooled keep-alive connector.
+    Errors are raised as pybit exceptions so callers handle both transports the same way.
+    """
+
+    def __init__(self, api_key=None, api_secret=None, testnet=False, endpoint=None, recv_window=5000,
+                 max_in_flight=20, pool_size=50, timeout=10, scheduler=None):
+        self.endpoint = endpoint or (TESTNET if testnet else MAINNET)
+        self.api_key = api_key
+        self.api_secret = api_secret
+        self.recv_window = recv_window
+        self.pool_size = pool_size
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self._in_flight = asyncio.Semaphore(max_in_flight)
+        self.scheduler = scheduler
+        self._session = None
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60, ttl_dns_cache=300)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    def _sign(self, timestamp, payload):
+        param_str = f"{timestamp}{self.api_key}{self.recv_window}{payload}"
+        return hmac.new(self.api_secret.encode(), param_str.encode(), hashlib.sha256).hexdigest()
+
+    def _auth_headers(self, payload):
+        timestamp = str(int(time.time() * 1000))
+        return {
+            'X-BAPI-API-KEY': self.api_key,
+            'X-BAPI-SIGN': self._sign(timestamp, payload),
+            'X-BAPI-SIGN-TYPE': '2',
+            'X-BAPI-TIMESTAMP': timestamp,
+            'X-BAPI-RECV-WINDOW': str(self.recv_window),
+        }
+
+    @staticmethod
+    def _prepare(params):
+        prepared = {}
+        for key, value in params.items():
+            if value is None:
+                continue
+            if key in STRING_PARAMS or isinstance(value, float):
+                value = str(value)
+            prepared[key] = value
+        return prepared
+
+    async def _request(self, method, path, params, auth=True):
+        params = self._prepare(params)
+        if method == 'GET':
+            payload = '&'.join(f'{key}={value}' for key, value in params.items())
+            url = URL(f'{self.endpoint}{path}?{payload}' if payload else f'{self.endpoint}{path}', encoded=True)
+            body = None
+        else:
+            payload = json.dumps(params)
+            url = URL(f'{self.endpoint}{path}', encoded=True)
+            body = payload
+
+        group = endpoint_group(path)
+        if self.scheduler is not None:
+            await self.scheduler.acquire(group)
+
+        start = time.perf_counter()
+        async with self._in_flight:
+            # Signed only now: time spent queued above must not count against recv_window
+            headers = {'Content-Type': 'application/json'}
+            if auth:
+                headers.update(self._auth_headers(payload))
+            try:
+                async with self._get_session().request(method, url, data=body, headers=headers) as resp:
+                    text = await resp.text()
+                    if self.scheduler is not None:
+                        self.scheduler.on_response(group, resp.headers, status=resp.status)
+                    if resp.status != 200:
+                        raise exceptions.FailedRequestError(
+                            request=f'{method} {path}: {payload}',
+                            message=text or resp.reason,
+                            status_code=resp.status,
+                            time=time.strftime('%H:%M:%S', time.gmtime()),
+                            resp_headers=dict(resp.headers),
+                        )
+                    data = json.loads(text)
+                    resp_headers = dict(resp.headers)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+                raise exceptions.FailedRequestError(
+                    request=f'{method} {path}: {payload}',
+                    message=str(err) or type(err).__name__,
+                    status_code=None,
+                    time=time.strftime('%H:%M:%S', time.gmtime()),
+                    resp_headers=None,
+                )
+            finally:
+                metrics.observe('bybit_request_seconds', time.perf_counter() - start, endpoint=path)
+
+        metrics.inc('bybit_requests_total', endpoint=path, ret_code=data.get('retCode'))
+        if data.get('retCode') != 0:
+            if self.scheduler is not None and data.get('retCode') in (10006, 10018):
+                self.scheduler.on_response(group, resp_headers, data['retCode'])
+            raise exceptions.InvalidRequestError(
+                request=f'{method} {path}: {payload}',
+                message=data.get('retMsg', ''),
+                status_code=data.get('retCode'),
+                time=time.strftime('%H:%M:%S', time.gmtime()),
+                resp_headers=resp_headers,
+            )
+        return data
+
+    async def get_server_time(self):
+        return await self._request('GET', '/v5/market/time', {}, auth=False)
+
+    async def get_instruments_info(self, **kwargs):
+        return await self._request('GET', '/v5/market/instruments-info', kwargs, auth=False)
+
+    async def get_tickers(self, **kwargs):
+        return await self._request('GET', '/v5/market/tickers', kwargs, auth=False)
+
+    async def get_positions(self, **kwargs):
+        return await self._request('GET', '/v5/position/list', kwargs)
+
+    async def place_order(self, **kwargs):
+        return await self._request('POST', '/v5/order/create', kwargs)
+
+    async def place_batch_order(self, **kwargs):
+        kwargs['request'] = [self._prepare(order) for order in kwargs['request']]
+        return await self._request('POST', '/v5/order/create-batch', kwargs)
+
+    async def set_trading_stop(self, **kwargs):
+        return await self._request('POST', '/v5/position/trading-stop', kwargs)
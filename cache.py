@@ -0,0 +1,181 @@
+import asyncio
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class PositionCache:
+    """
+    Snapshot of every linear USDT position, shared by all exchange methods.
+    One fetch per `ttl` seconds serves every symbol; our own orders invalidate it.
+    """
+
+    def __init__(self, fetch, ttl=1.0, clock=time.monotonic):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.clock = clock
+        self.positions = []
+        self.by_symbol = {}
+        self.updated_at = 0.0
+        self.generation = 0
+        # Set while a websocket stream keeps the snapshot current
+        self.live = False
+        self.hits = 0
+        self.misses = 0
+        self._lock = asyncio.Lock()
+
+    def is_fresh(self):
+        if self.live and self.updated_at:
+            return True
+        return self.clock() - self.updated_at < self.ttl
+
+    async def get_all(self):
+        if self.is_fresh():
+            self.hits += 1
+            return self.positions
+        async with self._lock:
+            # Another coroutine may have refreshed the snapshot while we waited for the lock
+            if self.is_fresh():
+                self.hits += 1
+                return self.positions
+            self.misses += 1
+            generation = self.generation
+            positions = await self.fetch()
+            self.set(positions, fresh=generation == self.generation)
+            return self.positions
+
+    async def get_symbol(self, symbol):
+        await self.get_all()
+        return list(self.by_symbol.get(symbol, []))
+
+    def set(self, positions, fresh=True):
+        by_symbol = {}
+        for pos in positions:
+            by_symbol.setdefault(pos['symbol'], []).append(pos)
+        self.positions = positions
+        self.by_symbol = by_symbol
+        # A snapshot fetched across an invalidation is kept but not trusted as fresh
+        self.updated_at = self.clock() if fresh else 0.0
+
+    def invalidate(self):
+        self.generation += 1
+        self.updated_at = 0.0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / total if total else 0.0,
+        }
+
+
+def decimals(step):
+    # Number of decimal digits in a tick size / qty step string ('0.001' -> 3)
+    if '.' in step:
+        return len(step.rstrip('0').split('.')[1])
+    return 0
+
+
+class InstrumentCache:
+    """
+    Price/qty precision table for the whole linear category.
+    Loaded once in bulk with pagination and refreshed in the background.
+    """
+
+    def __init__(self, fetch, refresh_interval=3600):
+        self.fetch = fetch
+        self.refresh_interval = refresh_interval
+        self.precisions = {}
+        self.loaded_at = 0.0
+
+    async def load(self):
+        precisions = {}
+        cursor = ''
+        while True:
+            result = await self.fetch(category='linear', limit=1000, cursor=cursor)
+            for info in result['list']:
+                precisions[info['symbol']] = self.parse(info)
+            cursor = result.get('nextPageCursor')
+            if not cursor:
+                break
+        self.precisions = precisions
+        self.loaded_at = time.monotonic()
+        return len(precisions)
+
+    @staticmethod
+    def parse(info):
+        return decimals(info['priceFilter']['tickSize']), decimals(info['lotSizeFilter']['qtyStep'])
+
+    async def get(self, symbol):
+        precision = self.precisions.get(symbol)
+        if precision is None:
+            # Symbol listed after the last bulk load
+            info = (await self.fetch(category='linear', symbol=symbol))['list'][0]
+            precision = self.precisions[symbol] = self.parse(info)
+        return precision
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.load()
+            except Exception as err:
+                logger.warning('Instruments refresh failed: %s', err)
+
+
+class MarketData:
+    """
+    Public market data shared by every account of the process: the instruments table and mark prices.
+    Concurrent lookups of the same symbol share one tickers request.
+    """
+
+    def __init__(self, session, mark_price_ttl=5.0, ticker_ttl=1.0, clock=time.monotonic):
+        self.session = session
+        self.clock = clock
+        self.instruments = InstrumentCache(self._fetch_instruments,
+                                           refresh_interval=float(os.getenv("INSTRUMENTS_REFRESH", 3600)))
+        # symbol -> (mark price, monotonic expiry)
+        self.mark_prices = {}
+        self.mark_price_ttl = mark_price_ttl
+        self.ticker_ttl = ticker_ttl
+        # fn(symbol, price) called on every mark price, e.g. RiskEngine.on_price
+        self.listeners = []
+        self._pending = {}
+
+    async def _fetch_instruments(self, **params):
+        return (await self.session.get_instruments_info(**params))['result']
+
+    # Streamed prices stay valid for mark_price_ttl, polled ones for ticker_ttl
+    def set_mark_price(self, symbol, price, ttl=None):
+        self.mark_prices[symbol] = (price, self.clock() + (self.mark_price_ttl if ttl is None else ttl))
+        for listener in self.listeners:
+            listener(symbol, price)
+
+    async def get_mark_price(self, symbol):
+        cached = self.mark_prices.get(symbol)
+        if cached is not None and self.clock() < cached[1]:
+            return cached[0]
+        pending = self._pending.get(symbol)
+        if pending is None:
+            pending = self._pending[symbol] = asyncio.ensure_future(self._fetch_mark_price(symbol))
+            pending.add_done_callback(lambda _: self._pending.pop(symbol, None))
+        return await asyncio.shield(pending)
+
+    async def load_mark_prices(self):
+        # Every linear symbol in one tickers request, e.g. at startup
+        tickers = (await self.session.get_tickers(category='linear'))['result']['list']
+        for ticker in tickers:
+            if ticker.get('markPrice'):
+                self.set_mark_price(ticker['symbol'], float(ticker['markPrice']), self.ticker_ttl)
+        return len(tickers)
+
+    async def _fetch_mark_price(self, symbol):
+        price = float((await self.session.get_tickers(
+            category='linear',
+            symbol=symbol
+        ))['result']['list'][0]['markPrice'])
+        self.set_mark_price(symbol, price, self.ticker_ttl)
+        return price
@@ -0,0 +1,307 @@
+import asyncio
+import json
+import logging
+import os
+import queue
+import socket
+
+import redis.asyncio as redis
+
+from events import EventBus
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+# Redis layout, every key starts with the cluster prefix:
+#   {prefix}:params        JSON parameters as in BybitBot.get_parameters(), written by the coordinator
+#   {prefix}:assign        hash symbol -> worker id, written by the coordinator
+#   {prefix}:positions     hash symbol -> JSON open position state, written by the worker running the symbol
+#   {prefix}:workers       set of worker ids ever seen
+#   {prefix}:worker:{id}   worker lease: JSON list of symbols it runs, expires unless renewed
+#   {prefix}:coordinator   coordinator lease, only its holder rebalances
+#   {prefix}:events        list of trade events from the workers for the coordinator's Telegram digests
+MAX_EVENTS = 1000
+
+
+def connect(url=None):
+    return redis.from_url(url or os.getenv('REDIS_URL', 'redis://localhost:6379/0'), decode_responses=True)
+
+
+def assign_symbols(wanted, assignment, workers, pinned=()):
+    """
+    Sticky assignment: symbols keep their live owner, orphaned and new symbols go to the least loaded worker,
+    then flat symbols (not in `pinned`) move from the busiest worker until loads differ by at most one.
+    """
+    if not workers:
+        return {}
+    result = {symbol: worker for symbol, worker in assignment.items() if symbol in wanted and worker in workers}
+    load = {worker: 0 for worker in workers}
+    for worker in result.values():
+        load[worker] += 1
+    for symbol in sorted(set(wanted) - set(result)):
+        worker = min(sorted(load), key=load.get)
+        result[symbol] = worker
+        load[worker] += 1
+    while True:
+        busiest = max(sorted(load), key=load.get)
+        idlest = min(sorted(load), key=load.get)
+        if load[busiest] - load[idlest] <= 1:
+            break
+        movable = sorted(symbol for symbol, worker in result.items() if worker == busiest and symbol not in pinned)
+        if not movable:
+            break
+        result[movable[0]] = idlest
+        load[busiest] -= 1
+        load[idlest] += 1
+    return result
+
+
+class Coordinator:
+    """
+    Spreads the symbols of the parameters over the live workers. Telegram talks to it like to a BybitBot:
+    submit_parameters() stores the parameters in Redis, trade events of the workers come out of `events`.
+    Several coordinators may run, the one holding the lease does the work.
+    """
+
+    def __init__(self, client, prefix='lenin', lease=5.0, interval=1.0, name='cluster'):
+        self.client = client
+        self.prefix = prefix
+        self.lease = lease
+        self.interval = interval
+        self.name = name
+        self.id = f'{socket.gethostname()}:{os.getpid()}:coordinator'
+        self.commands = queue.SimpleQueue()
+        self.notifier = None
+        self.events = EventBus(audit=False)
+        self.leader = False
+        self.workers = []
+        self.assignment = {}
+        metrics.register_collector('cluster', self.stats)
+
+    def key(self, *parts):
+        return ':'.join((self.prefix,) + parts)
+
+    def submit_parameters(self, user_messages):
+        self.commands.put(dict(user_messages))
+
+    async def apply_commands(self):
+        applied = False
+        while True:
+            try:
+                params = self.commands.get_nowait()
+            except queue.Empty:
+                break
+            current = json.loads(await self.client.get(self.key('params')) or '{}')
+            current.update(params)
+            await self.client.set(self.key('params'), json.dumps(current))
+            applied = True
+        if applied and self.notifier is not None:
+            self.notifier.notify(f"{self.name}: Параметры успешно обновлены!")
+
+    async def acquire_lease(self):
+        key = self.key('coordinator')
+        if await self.client.set(key, self.id, px=int(self.lease * 1000), nx=True):
+            return True
+        if await self.client.get(key) == self.id:
+            await self.client.pexpire(key, int(self.lease * 1000))
+            return True
+        return False
+
+    async def live_workers(self):
+        workers = sorted(await self.client.smembers(self.key('workers')))
+        if not workers:
+            return []
+        leases = await self.client.mget([self.key('worker', worker) for worker in workers])
+        dead = [worker for worker, lease in zip(workers, leases) if lease is None]
+        if dead:
+            await self.client.srem(self.key('workers'), *dead)
+        return [worker for worker, lease in zip(workers, leases) if lease is not None]
+
+    async def rebalance_once(self):
+        self.leader = await self.acquire_lease()
+        if not self.leader:
+            return
+        params = json.loads(await self.client.get(self.key('params')) or '{}')
+        pinned = set(await self.client.hkeys(self.key('positions')))
+        wanted = set(params.get('coins_pair', [])) | pinned
+        self.workers = await self.live_workers()
+        current = await self.client.hgetall(self.key('assign'))
+        self.assignment = assign_symbols(wanted, current, self.workers, pinned)
+        changed = {symbol: worker for symbol, worker in self.assignment.items() if current.get(symbol) != worker}
+        removed = [symbol for symbol in current if symbol not in self.assignment]
+        async with self.client.pipeline(transaction=True) as pipe:
+            if changed:
+                pipe.hset(self.key('assign'), mapping=changed)
+            if removed:
+                pipe.hdel(self.key('assign'), *removed)
+            await pipe.execute()
+        if changed or removed:
+            logger.info('Rebalanced over %d workers: %d moved, %d removed', len(self.workers), len(changed), len(removed))
+
+    async def relay_events(self):
+        while True:
+            item = await self.client.blpop([self.key('events')], timeout=1)
+            if item is None:
+                continue
+            event = json.loads(item[1])
+            self.events.emit(event['kind'], event['symbol'], **event['data'])
+
+    async def run(self):
+        async def loop():
+            while True:
+                try:
+                    await self.apply_commands()
+                    await self.rebalance_once()
+                except Exception as err:
+                    logger.warning('Rebalance failed: %s', err)
+                await asyncio.sleep(self.interval)
+
+        await asyncio.gather(loop(), self.relay_events())
+
+    def stats(self):
+        return {
+            'leader': int(self.leader),
+            'workers': len(self.workers),
+            'symbols': len(self.assignment),
+        }
+
+
+class Worker:
+    """
+    Runs a BybitBot on the symbols the coordinator assigned to this process.
+    The worker also serves as the bot's state store: open position state goes to the shared Redis hash,
+    so whoever takes over a symbol continues its state machine.
+    A symbol is started only when no other live worker still runs it.
+    """
+
+    def __init__(self, client, bot, prefix='lenin', lease=5.0, interval=1.0, worker_id=None):
+        self.client = client
+        self.bot = bot
+        self.prefix = prefix
+        self.lease = lease
+        self.interval = interval
+        self.id = worker_id or f'{socket.gethostname()}:{os.getpid()}'
+        self.params = None
+        self.runnable = set()
+        self.written = {}
+        self._pending = None
+        bot.store = self
+
+    def key(self, *parts):
+        return ':'.join((self.prefix,) + parts)
+
+    # StateStore surface used by BybitBot
+    def put(self, key, value):
+        if key.endswith('open_positions'):
+            self._pending = value
+
+    def load(self):
+        return {}
+
+    def claims(self):
+        return set(self.bot.tasks) | set(self.bot.open_positions)
+
+    async def heartbeat(self):
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.sadd(self.key('workers'), self.id)
+            pipe.set(self.key('worker', self.id), json.dumps(sorted(self.claims())), px=int(self.lease * 1000))
+            await pipe.execute()
+
+    async def flush(self):
+        if self._pending is None:
+            return
+        positions, self._pending = self._pending, None
+        changed = {symbol: json.dumps(state) for symbol, state in positions.items()
+                   if self.written.get(symbol) != json.dumps(state)}
+        gone = [symbol for symbol in self.written if symbol not in positions]
+        async with self.client.pipeline(transaction=True) as pipe:
+            if changed:
+                pipe.hset(self.key('positions'), mapping=changed)
+            if gone:
+                pipe.hdel(self.key('positions'), *gone)
+            await pipe.execute()
+        self.written.update(changed)
+        for symbol in gone:
+            self.written.pop(symbol)
+
+    async def others_claims(self):
+        workers = [worker for worker in await self.client.smembers(self.key('workers')) if worker != self.id]
+        if not workers:
+            return set()
+        claimed = set()
+        for lease in await self.client.mget([self.key('worker', worker) for worker in workers]):
+            if lease is not None:
+                claimed.update(json.loads(lease))
+        return claimed
+
+    async def sync_once(self):
+        await self.flush()
+        await self.heartbeat()
+        raw_params = await self.client.get(self.key('params'))
+        assigned = {symbol for symbol, worker in (await self.client.hgetall(self.key('assign'))).items()
+                    if worker == self.id}
+        runnable = assigned - await self.others_claims()
+        gained = runnable - self.runnable - set(self.bot.open_positions)
+        if gained:
+            states = await self.client.hmget(self.key('positions'), sorted(gained))
+            taken = {}
+            for symbol, state in zip(sorted(gained), states):
+                if state is not None:
+                    # Taken over from a worker that is gone, continue where it stopped
+                    taken[symbol] = json.loads(state)
+                    self.written[symbol] = state
+            # The hash is flushed once per interval: the previous owner may have entered or closed since
+            self.bot.exchange.positions_cache.invalidate()
+            self.bot.reconcile_positions(taken, await self.bot.exchange.get_positions(), gained)
+            self.bot.open_positions.update(taken)
+            # Also drops the hash entries of symbols found flat
+            self.bot.save_state()
+        if raw_params != self.params or runnable != self.runnable:
+            params = json.loads(raw_params or '{}')
+            # Symbols with an open position stay with this worker until they are flat, see BybitBot.run_symbol
+            params['coins_pair'] = [symbol for symbol in params.get('coins_pair', []) if symbol in runnable]
+            self.bot.submit_parameters(params)
+            self.params = raw_params
+            self.runnable = runnable
+
+    async def forward_events(self):
+        subscription = self.bot.exchange.events.subscribe()
+        while True:
+            events = await subscription.get_batch(0.2)
+            payload = [json.dumps({'kind': event.kind, 'symbol': event.symbol, 'data': event.data}, default=str)
+                       for event in events]
+            try:
+                async with self.client.pipeline(transaction=True) as pipe:
+                    pipe.rpush(self.key('events'), *payload)
+                    pipe.ltrim(self.key('events'), -MAX_EVENTS, -1)
+                    await pipe.execute()
+            except Exception as err:
+                logger.warning('Event forwarding failed: %s', err)
+
+    async def sync(self):
+        while True:
+            try:
+                await self.sync_once()
+            except Exception as err:
+                logger.warning('Worker sync failed: %s', err)
+            await asyncio.sleep(self.interval)
+
+    async def close(self):
+        # Let the coordinator hand the symbols over right away instead of waiting for the lease to expire
+        await self.flush()
+        await self.client.delete(self.key('worker', self.id))
+        await self.client.srem(self.key('workers'), self.id)
+
+    async def run(self):
+        tasks = [self.sync(), self.forward_events(), self.bot.supervise()]
+        if self.bot.exchange.owns_market:
+            try:
+                count = await self.bot.exchange.instruments.load()
+                logger.info('Loaded precisions for %d instruments', count)
+            except Exception as e:
+                logger.warning('Instruments load failed: %s', e)
+            tasks.append(self.bot.exchange.instruments.run())
+        if self.bot.stream is not None:
+            tasks.append(self.bot.stream.run())
+        await asyncio.gather(*tasks)
@@ -0,0 +1,71 @@
+import asyncio
+import collections
+import logging
+import time
+
+# Trade audit trail, written to its own file by log.setup()
+audit = logging.getLogger('trade.audit')
+
+
+class TradeEvent:
+    __slots__ = ('kind', 'symbol', 'data', 'time')
+
+    def __init__(self, kind, symbol, data):
+        self.kind = kind
+        self.symbol = symbol
+        self.data = data
+        self.time = time.time()
+
+    def __repr__(self):
+        return f'TradeEvent({self.kind}, {self.symbol}, {self.data})'
+
+
+class Subscription:
+    """
+    Bounded per-consumer queue. A slow consumer loses its oldest events, it never blocks emit().
+    """
+
+    def __init__(self, maxlen=1000):
+        self.queue = collections.deque(maxlen=maxlen)
+        self.dropped = 0
+        self._ready = asyncio.Event()
+
+    def put(self, event):
+        if len(self.queue) == self.queue.maxlen:
+            self.dropped += 1
+        self.queue.append(event)
+        self._ready.set()
+
+    async def get_batch(self, window=0.0):
+        # Waits for the first event, then collects everything that arrives within `window` seconds
+        await self._ready.wait()
+        if window:
+            await asyncio.sleep(window)
+        self._ready.clear()
+        batch = list(self.queue)
+        self.queue.clear()
+        return batch
+
+
+class EventBus:
+    """
+    Structured trade events from BybitExchange and BybitBot: order_placed, order_rejected, fill,
+    stop_loss_set, stop_loss_hit, trailing_stop_set, position_closed, close_failed, entry_blocked.
+    """
+
+    def __init__(self, audit=True):
+        self.subscriptions = []
+        # Off for buses that only relay events already audited elsewhere, e.g. cluster.Coordinator
+        self.audit = audit
+
+    def subscribe(self, maxlen=1000):
+        subscription = Subscription(maxlen)
+        self.subscriptions.append(subscription)
+        return subscription
+
+    def emit(self, kind, symbol, **data):
+        event = TradeEvent(kind, symbol, data)
+        if self.audit:
+            audit.info(kind, extra={'symbol': symbol, 'data': data})
+        for subscription in self.subscriptions:
+            subscription.put(event)
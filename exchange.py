@@ -1,235 +1,323 @@
 import asyncio
+import logging
 import os
+import time
 from typing import Optional
 
 from dotenv import load_dotenv
-from pybit import exceptions
-from pybit.unified_trading import HTTP
 
+from bybit_http import AsyncHTTP
+from cache import MarketData, PositionCache
+from events import EventBus
+from metrics import metrics, timed
+from ratelimit import RequestScheduler
+from reconcile import StopReconciler
+from recorder import RecordingSession
+from resilience import RejectedError, ResilientSession
+from risk import RiskEngine
+
+logger = logging.getLogger(__name__)
+responses = logging.getLogger('exchange.response')
 
 load_dotenv()
 
 
+class EntryBatcher:
+    """
+    Collects entry legs submitted within `window` seconds and places them together,
+    so many symbols entering at once share as few batch requests as the API allows.
+    """
+
+    def __init__(self, place, window=0.05, max_legs=10):
+        self.place = place
+        self.window = window
+        self.max_legs = max_legs
+        self.pending = []
+        self._timer = None
+        # Sends in flight: the loop keeps only weak references to tasks
+        self._tasks = set()
+
+    async def submit(self, legs):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((legs, future))
+        if sum(len(pending_legs) for pending_legs, _ in self.pending) >= self.max_legs:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self.pending = self.pending, []
+        if batch:
+            task = asyncio.ensure_future(self._send(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, batch):
+        try:
+            results = await self.place([leg for legs, _ in batch for leg in legs])
+        except Exception as err:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(err)
+            return
+        i = 0
+        for legs, future in batch:
+            if not future.done():
+                future.set_result(results[i:i + len(legs)])
+            i += len(legs)
+
+
+# Bybit: reduce-only order for a position that is already gone
+POSITION_ZERO = 110017
+
+
 class BybitExchange:
-    def __init__(self):
-        self.session = HTTP(
-            api_key=str(os.getenv("API")),
-            api_secret=str(os.getenv("SECRET")),
+    # Bybit accepts up to 10 linear orders per batch request
+    MAX_BATCH = 10
+
+    def __init__(self, session=None, market=None, api_key=None, api_secret=None, name='main', recorder=None,
+                 clock=time.monotonic):
+        self.name = name
+        # Cache TTLs, risk reservations and stop settle times run on `clock`, replays pass the recorded one
+        self.clock = clock
+        self.api_key = api_key or str(os.getenv("API"))
+        self.api_secret = api_secret or str(os.getenv("SECRET"))
+        # Every session call waits for its endpoint group's rate-limit token here, one budget per account
+        self.scheduler = RequestScheduler()
+        # Any object with the AsyncHTTP surface works, e.g. sim.SimulatedBybit.
+        # Calls raise resilience.ExchangeError subclasses after retries, they never return None
+        session = session or AsyncHTTP(
+            api_key=self.api_key,
+            api_secret=self.api_secret,
+            max_in_flight=int(os.getenv("MAX_IN_FLIGHT", 20)),
+            scheduler=self.scheduler,
         )
+        # Optional recorder.Recorder: every response the bot sees is kept for replay
+        self.recorder = recorder
+        if recorder is not None:
+            session = RecordingSession(session, recorder)
+        self.session = ResilientSession(session, attempts=int(os.getenv("RETRY_ATTEMPTS", 4)), attempt_timeout=float(os.getenv("ATTEMPT_TIMEOUT", 10)))
+        # One positions snapshot per tick serves every symbol and every method
+        self.positions_cache = PositionCache(self._fetch_positions, ttl=float(os.getenv("POSITIONS_TTL", 1)),
+                                             clock=clock)
+        # Instruments table and mark prices, shared between accounts when a MarketData is passed in
+        self.owns_market = market is None
+        self.market = market or MarketData(self.session, mark_price_ttl=float(os.getenv("MARK_PRICE_TTL", 5)),
+                                           ticker_ttl=float(os.getenv("TICKER_TTL", 1)), clock=clock)
+        self.instruments = self.market.instruments
+        # BATCH_ORDERS=0 sends the two entry legs as concurrent single orders instead
+        self.batch_orders = os.getenv("BATCH_ORDERS", "1") != "0"
+        self.entry_batcher = EntryBatcher(self.place_legs, window=float(os.getenv("ENTRY_BATCH_WINDOW", 0.05)),
+                                          max_legs=self.MAX_BATCH)
+        # Structured trade events for notifications, see events.py
+        self.events = EventBus()
+        # Desired vs actual stops, only differing ones reach set_trading_stop
+        self.stops = StopReconciler(self.session, self.positions_cache, self.events, clock=clock)
+        # Exposure of the account, fed by every positions snapshot and mark price; gates new entries
+        self.risk = RiskEngine(self.events, clock=clock)
+        self.market.listeners.append(self.risk.on_price)
+        metrics.register_collector('positions_cache', self.positions_cache.stats, account=name)
+        metrics.register_collector('rate_limiter', self.scheduler.stats, account=name)
+        metrics.register_collector('stop_reconciler', self.stops.stats, account=name)
+        metrics.register_collector('resilience', self.session.stats, account=name)
+        metrics.register_collector('risk', self.risk.stats, account=name)
+
+    async def _fetch_positions(self):
+        positions = (await self.session.get_positions(
+            category='linear',
+            settleCoin='USDT'
+        ))['result']['list']
+        self.risk.sync(positions)
+        return positions
+
+    async def close(self):
+        await self.session.close()
+        if self.owns_market and self.market.session is not self.session:
+            await self.market.session.close()
+
+    @timed('exchange_call_seconds')
+    async def get_mark_price(self, symbol):
+        return await self.market.get_mark_price(symbol)
 
+    @timed('exchange_call_seconds')
     async def get_positions(self):
-        try:
-            positions = self.session.get_positions(
-                category='linear',
-                settleCoin='USDT'
-            )['result']['list']
-            return positions
-        except Exception as err:
-            print(err)
+        return list(await self.positions_cache.get_all())
 
+    @timed('exchange_call_seconds')
     async def get_symbols_pos(self, symbol):
-        try:
-            pos_lst = []
-            positions = self.session.get_positions(
-                category='linear',
-                settleCoin='USDT'
-            )['result']['list']
-            for pos in positions:
-                if pos['symbol'] == symbol:
-                    pos_lst.append(pos)
-            return pos_lst
-        except Exception as err:
-            print(err)
+        return await self.positions_cache.get_symbol(symbol)
 
+    @timed('exchange_call_seconds')
     async def get_positions_symbol(self, elem):
-        try:
-            resp = self.session.get_positions(
-                category='linear',
-                settleCoin='USDT'
-            )['result']['list']
-            symbol_side = {}
-            if len(resp) > 0:
-                for i in resp:
-                    if i['symbol'] == elem:
-                        symbol_side[elem] = i['side']
-            return symbol_side
-        except Exception as err:
-            print(err)
-
-    async def get_rev_side(self, key):
-        try:
-            rev = self.session.get_positions(
-                category='linear',
-                settleCoin='USDT'
-            )['result']['list'][0]
-            rev['rev_side'] = ("Sell", "Buy")[rev['side'] == 'Sell']
-            return rev.get(key)
-        except Exception as err:
-            print(err)
+        symbol_side = {}
+        for i in await self.positions_cache.get_symbol(elem):
+            symbol_side[elem] = i['side']
+        return symbol_side
+
+    @timed('exchange_call_seconds')
+    async def get_rev_side(self, key, symbol=None, position_idx=None):
+        if symbol is None:
+            positions = await self.positions_cache.get_all()
+        else:
+            positions = await self.positions_cache.get_symbol(symbol)
+        if position_idx is not None:
+            positions = [pos for pos in positions if int(pos['positionIdx']) == int(position_idx)]
+        if not positions:
+            return None
+        rev = dict(positions[0])
+        rev['rev_side'] = ("Sell", "Buy")[rev['side'] == 'Sell']
+        return rev.get(key)
 
     # Getting number of decimal digits for price and qty
+    @timed('exchange_call_seconds')
     async def get_precisions(self, symbol):
-        try:
-            instruments_info = self.session.get_instruments_info(
-                category='linear',
-                symbol=symbol
-            )['result']['list'][0]
-            price = instruments_info['priceFilter']['tickSize']
-            if '.' in price:
-                price = len(price.split('.')[1])
-            else:
-                price = 0
-            qty = instruments_info['lotSizeFilter']['qtyStep']
-            if '.' in qty:
-                qty = len(qty.split('.')[1])
-            else:
-                qty = 0
-
-            return price, qty
-        except Exception as err:
-            print(err)
+        return await self.instruments.get(symbol)
 
-    # Placing order with Market price. Placing TP and SL as well
-    async def place_orders(self, symbol, qty, sl):
-        price_precision = (await self.get_precisions(symbol))[0]
-        qty_precision = (await self.get_precisions(symbol))[1]
-        mark_price = self.session.get_tickers(
-            category='linear',
-            symbol=symbol
-        )['result']['list'][0]['markPrice']
-        mark_price = float(mark_price)
-        print(f'Placing buy sell orders for {symbol}. Mark price: {mark_price}')
+    # Both legs of the hedged entry with their stop losses computed up front
+    async def build_entry_orders(self, symbol, qty, sl):
+        price_precision, qty_precision = await self.get_precisions(symbol)
+        mark_price = await self.get_mark_price(symbol)
         order_qty = round(qty / mark_price, qty_precision)
-        await asyncio.sleep(1)
-        try:
-            sl_price = round(mark_price - mark_price * (sl/100), price_precision)
-            resp = self.session.place_order(
-                category='linear',
+        legs = []
+        for side, position_idx, sl_price in (
+                ('Buy', 1, mark_price - mark_price * (sl/100)),
+                ('Sell', 2, mark_price + mark_price * (sl/100))):
+            legs.append(dict(
                 symbol=symbol,
-                side='Buy',
+                side=side,
                 orderType='Market',
                 qty=order_qty,
                 price=mark_price,
-                stopLoss=sl_price,
-                positionIdx=1
-            )
-            print(resp)
-        except Exception as err:
-            print(err)
+                stopLoss=round(sl_price, price_precision),
+                positionIdx=position_idx
+            ))
+        return legs
 
+    # Placing order with Market price. Placing TP and SL as well
+    @timed('exchange_call_seconds')
+    async def place_orders(self, symbol, qty, sl):
+        legs = await self.build_entry_orders(symbol, qty, sl)
+        # Raises risk.RiskLimitError when the entry would break a limit
+        self.risk.admit(symbol, sum(leg['qty'] * leg['price'] for leg in legs))
+        logger.info('Placing buy sell orders for %s. Mark price: %s', symbol, legs[0]['price'])
         try:
-            sl_price = round(mark_price + mark_price * sl, price_precision)
-            resp = self.session.place_order(
-                category='linear',
-                symbol=symbol,
-                side='Sell',
-                orderType='Market',
-                qty=order_qty,
-                price=mark_price,
-                stopLoss=sl_price,
-                positionIdx=2
-            )
-            print(resp)
+            results = await self.entry_batcher.submit(legs)
+        except BaseException:
+            # Cancellation included, the reservation would otherwise hold the notional until it expires
+            self.risk.release(symbol)
+            raise
+        if not any(result['code'] == 0 for result in results):
+            self.risk.release(symbol)
+        for result in results:
+            responses.info('place_order %s: %s', symbol, result)
+            kind = 'order_placed' if result['code'] == 0 else 'order_rejected'
+            self.events.emit(kind, symbol, side=result['side'], qty=legs[0]['qty'], msg=result['msg'])
+        return results
+
+    async def place_legs(self, legs):
+        """
+        Sends order legs through the batch endpoint, at most MAX_BATCH legs per request.
+        Returns one result dict per leg, in order.
+        """
+        chunks = [legs[i:i + self.MAX_BATCH] for i in range(0, len(legs), self.MAX_BATCH)]
+        results = await asyncio.gather(*(self._place_batch(chunk) for chunk in chunks))
+        self.positions_cache.invalidate()
+        return [result for chunk in results for result in chunk]
+
+    async def _place_batch(self, legs):
+        if not self.batch_orders:
+            return await self._place_single(legs)
+        try:
+            resp = await self.session.place_batch_order(category='linear', request=legs)
         except Exception as err:
-            print(err)
+            logger.warning('Batch order failed, falling back to single orders: %s', err)
+            return await self._place_single(legs)
+        acks = resp['result']['list']
+        infos = resp.get('retExtInfo', {}).get('list', [{}] * len(legs))
+        results = []
+        for leg, ack, info in zip(legs, acks, infos):
+            results.append({
+                'symbol': leg['symbol'],
+                'side': leg['side'],
+                'positionIdx': leg['positionIdx'],
+                'orderId': ack.get('orderId'),
+                'code': info.get('code', 0),
+                'msg': info.get('msg', 'OK'),
+            })
+        return results
+
+    # Fallback: legs sent as concurrent single orders
+    async def _place_single(self, legs):
+        resps = await asyncio.gather(
+            *(self.session.place_order(category='linear', **leg) for leg in legs),
+            return_exceptions=True
+        )
+        results = []
+        for leg, resp in zip(legs, resps):
+            result = {'symbol': leg['symbol'], 'side': leg['side'], 'positionIdx': leg['positionIdx']}
+            if isinstance(resp, Exception):
+                result.update(orderId=None, code=getattr(resp, 'status_code', None), msg=str(resp))
+            else:
+                result.update(orderId=resp['result'].get('orderId'), code=resp['retCode'], msg=resp['retMsg'])
+            results.append(result)
+        return results
 
+    @timed('exchange_call_seconds')
     async def set_stop_losses(self, symbol, stop_loss_percentage):
-        k = []
         # Получаем точность цены для символа
         price_precision = (await self.get_precisions(symbol))[0]
 
-        resp = self.session.get_positions(
-            category='linear',
-            settleCoin='USDT'
-        )['result']['list']
-
-        for position in resp:
-            if position['symbol'] == symbol:
-                g = float(position['avgPrice'])
-                s = position['side']
-                k.append([g, s])
-
-        for i in k:
-            if i[1] == 'Buy':
-                sl = round(i[0] - (stop_loss_percentage/100) * i[0], price_precision)
-                print(self.session.set_trading_stop(
-                    category="linear",
-                    symbol=symbol,
-                    stopLoss=str(sl),
-                    slTriggerBy="MarkPrice",
-                    tpslMode="Full",
-                    slOrderType="Market",
-                    positionIdx=1,  # Позиция для покупки
-                ))
-
-            if i[1] == 'Sell':
-                sl = round(i[0] + (stop_loss_percentage/100) * i[0], price_precision)
-                print(self.session.set_trading_stop(
-                    category="linear",
-                    symbol=symbol,
-                    stopLoss=str(sl),
-                    slTriggerBy="MarkPrice",
-                    tpslMode="Full",
-                    slOrderType="Market",
-                    positionIdx=2,  # Позиция для продажи
-                ))
-
+        for position in await self.positions_cache.get_symbol(symbol):
+            avg_price = float(position['avgPrice'])
+            if position['side'] == 'Buy':
+                sl = round(avg_price - (stop_loss_percentage/100) * avg_price, price_precision)
+                self.stops.set_leg(symbol, 1, stopLoss=sl)  # Позиция для покупки
+            if position['side'] == 'Sell':
+                sl = round(avg_price + (stop_loss_percentage/100) * avg_price, price_precision)
+                self.stops.set_leg(symbol, 2, stopLoss=sl)  # Позиция для продажи
+        await self.stops.reconcile(symbol)
+
+    def _want_trailing_stop(self, symbol, positions, current_price, trailing_stop_loss_percentage, price_precision):
+        for position in positions:
+            distance = round((trailing_stop_loss_percentage/100) * current_price, price_precision)
+            self.stops.want(symbol, 1 if position['side'] == 'Buy' else 2, trailingStop=distance)
+
+    @timed('exchange_call_seconds')
     async def set_stop_losses_trailing_stop(self, symbol, trailing_stop_loss_percentage):
-        k = []
         # Получаем точность цены для символа
         price_precision = (await self.get_precisions(symbol))[0]
+        positions = await self.positions_cache.get_symbol(symbol)
+        current_price = await self.get_mark_price(symbol)
+        self._want_trailing_stop(symbol, positions, current_price, trailing_stop_loss_percentage, price_precision)
+        await self.stops.reconcile(symbol)
 
-        resp = self.session.get_positions(
-            category='linear',
-            settleCoin='USDT'
-        )['result']['list']
-
-        current_price = float(self.session.get_tickers(
-            category='linear',
-            symbol=symbol
-        )['result']['list'][0]['markPrice'])
-
-        for position in resp:
-            if position['symbol'] == symbol:
-                g = current_price
-                s = position['side']
-                k.append([g, s])
-
-        for i in k:
-            if i[1] == 'Buy':
-                sl = round((trailing_stop_loss_percentage/100) * i[0], price_precision)
-                print(sl)
-                print(self.session.set_trading_stop(
-                    category="linear",
-                    symbol=symbol,
-                    trailingStop=str(sl),
-                    slTriggerBy="MarkPrice",
-                    tpslMode="Full",
-                    slOrderType="Market",
-                    positionIdx=1,  # Позиция для покупки
-                ))
-
-            if i[1] == 'Sell':
-                sl = round((trailing_stop_loss_percentage/100) * i[0], price_precision)
-                print(sl)
-                print(self.session.set_trading_stop(
-                    category="linear",
-                    symbol=symbol,
-                    trailingStop=str(sl),
-                    slTriggerBy="MarkPrice",
-                    tpslMode="Full",
-                    slOrderType="Market",
-                    positionIdx=2,  # Позиция для продажи
-                ))
-
+    @timed('exchange_call_seconds')
+    async def switch_to_trailing_stop(self, symbol, trailing_stop_loss_percentage):
+        """
+        delete_stop_loss + set_stop_losses_trailing_stop in one set_trading_stop call per leg
+        """
+        price_precision = (await self.get_precisions(symbol))[0]
+        positions = await self.positions_cache.get_symbol(symbol)
+        current_price = await self.get_mark_price(symbol)
+        for position in positions:
+            self.stops.want(symbol, 1 if position['side'] == 'Buy' else 2, stopLoss=0)
+        self._want_trailing_stop(symbol, positions, current_price, trailing_stop_loss_percentage, price_precision)
+        await self.stops.reconcile(symbol)
+
+    @timed('exchange_call_seconds')
     async def close_position(self, elem, pos_id):
         """
-        Полное закрытие текущей позиции
+        Полное закрытие текущей позиции. Raises resilience.ExchangeError if the position may still be open.
         """
         args = dict(
             category='linear',
             symbol=elem,
-            side=await self.get_rev_side('rev_side'),
+            side=await self.get_rev_side('rev_side', elem, pos_id),
             orderType="Market",
             qty=0.0,
             reduceOnly=True,
@@ -237,47 +325,23 @@ class BybitExchange:
             positionIdx=pos_id
         )
         try:
-            self.session.place_order(**args)
-            return 'Success'
-        except Exception as e:
-            return e
-
+            await self.session.place_order(**args)
+        except RejectedError as e:
+            self.positions_cache.invalidate()
+            if e.status_code != POSITION_ZERO:
+                self.events.emit('close_failed', elem, positionIdx=pos_id, error=e)
+                raise
+            # Closed by its stop in the meantime
+        self.positions_cache.invalidate()
+        self.events.emit('position_closed', elem, positionIdx=pos_id)
+        return 'Success'
+
+    @timed('exchange_call_seconds')
     async def delete_stop_loss(self, symbol):
-        k = []
+        for position in await self.positions_cache.get_symbol(symbol):
+            self.stops.want(symbol, 1 if position['side'] == 'Buy' else 2, stopLoss=0)
+        await self.stops.reconcile(symbol)
 
-        resp = self.session.get_positions(
-            category='linear',
-            settleCoin='USDT'
-        )['result']['list']
-
-        for position in resp:
-            if position['symbol'] == symbol:
-                g = float(position['avgPrice'])
-                s = position['side']
-                k.append([g, s])
-
-        for i in k:
-            if i[1] == 'Buy':
-                print(self.session.set_trading_stop(
-                    category="linear",
-                    symbol=symbol,
-                    stopLoss="0",
-                    slTriggerBy="MarkPrice",
-                    tpslMode="Full",
-                    slOrderType="Market",
-                    positionIdx=1,  # Позиция для покупки
-                ))
-
-            if i[1] == 'Sell':
-                print(self.session.set_trading_stop(
-                    category="linear",
-                    symbol=symbol,
-                    stopLoss="0",
-                    slTriggerBy="MarkPrice",
-                    tpslMode="Full",
-                    slOrderType="Market",
-                    positionIdx=2,  # Позиция для продажи
-                ))
 
 
 
@@ -0,0 +1,219 @@
+"""
+Logging for the bot: records are handed to a queue on the calling thread and written by a listener thread,
+so file I/O and gzip never run on the event loop.
+
+    logs/bot.jsonl    everything except the trade audit, one JSON object per line
+    logs/trade.jsonl  the `trade.audit` logger only: orders, fills, stops and closes, never sampled
+
+Files rotate by size, rotated files are gzipped. Noisy loggers can be sampled per module, e.g.
+LOG_SAMPLE="exchange.response=10,stream=5" keeps every 10th / 5th record below WARNING.
+
+    python log.py tail logs/bot.jsonl --level WARNING --logger exchange --grep BTCUSDT -f
+"""
+import argparse
+import collections
+import gzip
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import shutil
+import sys
+import time
+
+
+AUDIT = 'trade.audit'
+DEFAULT_SAMPLE = 'exchange.response=10'
+# Attributes every LogRecord has, anything else came in through `extra`
+RECORD_FIELDS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False, separators=(',', ':'))
+
+
+class SampleFilter(logging.Filter):
+    """
+    Keeps every n-th record below WARNING of the configured loggers (and their children).
+    """
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+        self.counts = dict.fromkeys(rates, 0)
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        for prefix, rate in self.rates.items():
+            if record.name == prefix or record.name.startswith(prefix + '.'):
+                self.counts[prefix] += 1
+                return rate <= 1 or self.counts[prefix] % rate == 1
+        return True
+
+
+class ExcludeFilter(logging.Filter):
+    def filter(self, record):
+        return not (record.name == self.name or record.name.startswith(self.name + '.'))
+
+
+class LoopQueueHandler(logging.handlers.QueueHandler):
+    # Only the message is rendered on the calling thread, the listener does the JSON and the traceback
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def _gzip_rotator(source, dest):
+    with open(source, 'rb') as src, gzip.open(dest, 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(source)
+
+
+def rotating_handler(path, max_bytes, backups):
+    handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups,
+                                                   encoding='utf-8', delay=True)
+    handler.namer = lambda name: name + '.gz'
+    handler.rotator = _gzip_rotator
+    handler.setFormatter(JsonFormatter())
+    return handler
+
+
+def parse_sample(spec):
+    rates = {}
+    for item in spec.split(','):
+        if '=' in item:
+            name, rate = item.split('=', 1)
+            rates[name.strip()] = int(rate)
+    return rates
+
+
+def setup(directory=None, level=None, max_bytes=None, backups=None, sample=None, console=None):
+    """
+    Routes the root logger through a queue. Returns the QueueListener, stop() it on shutdown to drain the queue.
+    """
+    directory = directory or os.getenv('LOG_DIR', 'logs')
+    level = level or os.getenv('LOG_LEVEL', 'INFO')
+    max_bytes = max_bytes or int(os.getenv('LOG_MAX_BYTES', 50 * 1024 * 1024))
+    backups = backups if backups is not None else int(os.getenv('LOG_BACKUPS', 10))
+    sample = parse_sample(sample if sample is not None else os.getenv('LOG_SAMPLE', DEFAULT_SAMPLE))
+    console = console or os.getenv('LOG_CONSOLE', 'INFO')
+    os.makedirs(directory, exist_ok=True)
+
+    main_handler = rotating_handler(os.path.join(directory, 'bot.jsonl'), max_bytes, backups)
+    main_handler.addFilter(ExcludeFilter(AUDIT))
+    audit_handler = rotating_handler(os.path.join(directory, 'trade.jsonl'), max_bytes, backups)
+    audit_handler.addFilter(logging.Filter(AUDIT))
+    console_handler = logging.StreamHandler(sys.stderr)
+    console_handler.setLevel(console)
+    console_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+
+    records = queue.SimpleQueue()
+    queue_handler = LoopQueueHandler(records)
+    queue_handler.addFilter(SampleFilter(sample))
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    # The audit stream is kept whatever the root level is
+    logging.getLogger(AUDIT).setLevel(logging.INFO)
+
+    listener = logging.handlers.QueueListener(records, main_handler, audit_handler, console_handler,
+                                              respect_handler_level=True)
+    listener.start()
+    return listener
+
+
+def read_lines(path):
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as f:
+        yield from f
+
+
+def follow(path):
+    with open(path, encoding='utf-8') as f:
+        f.seek(0, os.SEEK_END)
+        while True:
+            line = f.readline()
+            if line:
+                yield line
+            else:
+                time.sleep(0.5)
+
+
+def matches(entry, args):
+    if logging.getLevelName(entry.get('level', 'INFO')) < logging.getLevelName(args.level):
+        return False
+    if args.logger and not entry.get('logger', '').startswith(args.logger):
+        return False
+    if args.since and entry.get('ts', 0) < time.time() - args.since:
+        return False
+    return not args.grep or args.grep in json.dumps(entry, ensure_ascii=False)
+
+
+def show(entry, raw):
+    if raw:
+        return json.dumps(entry, ensure_ascii=False)
+    extra = {key: value for key, value in entry.items() if key not in ('ts', 'level', 'logger', 'msg', 'exc')}
+    stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry.get('ts', 0)))
+    text = f"{stamp} {entry.get('level', ''):<7} {entry.get('logger', '')}: {entry.get('msg', '')}"
+    if extra:
+        text += ' ' + json.dumps(extra, ensure_ascii=False, default=str)
+    if entry.get('exc'):
+        text += '\n' + entry['exc']
+    return text
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Read the bot JSON logs')
+    commands = parser.add_subparsers(dest='command', required=True)
+    tail = commands.add_parser('tail', help='print and filter log files (.jsonl or rotated .jsonl.N.gz)')
+    tail.add_argument('files', nargs='*', default=[os.path.join(os.getenv('LOG_DIR', 'logs'), 'bot.jsonl')])
+    tail.add_argument('--level', default='DEBUG')
+    tail.add_argument('--logger', help='logger name prefix, e.g. exchange or trade.audit')
+    tail.add_argument('--grep', help='substring anywhere in the record')
+    tail.add_argument('--since', type=float, help='only the last N seconds')
+    tail.add_argument('-n', type=int, default=0, help='only the last N matching records')
+    tail.add_argument('-f', '--follow', action='store_true', help='keep reading the last file')
+    tail.add_argument('--raw', action='store_true', help='print JSON lines as they are')
+    args = parser.parse_args()
+    args.level = args.level.upper()
+
+    selected = collections.deque(maxlen=args.n or None)
+    for path in args.files:
+        for line in read_lines(path):
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if matches(entry, args):
+                selected.append(entry)
+    for entry in selected:
+        print(show(entry, args.raw))
+    if args.follow:
+        for line in follow(args.files[-1]):
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if matches(entry, args):
+                print(show(entry, args.raw), flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+import asyncio
+import bisect
+import functools
+import logging
+import time
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q-th observation
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+
+class Metrics:
+    """
+    In-process registry of histograms, counters and gauges.
+    Rendered in the Prometheus text format by serve() and summarized for Telegram by summary().
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self.collectors = []
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(value)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    # fn() -> {name: value} gauges read at render time, e.g. cache or limiter stats
+    def register_collector(self, prefix, fn, **labels):
+        self.collectors.append((prefix, fn, labels))
+
+    def collect(self):
+        for prefix, fn, labels in list(self.collectors):
+            for name, value in fn().items():
+                self.set(f'{prefix}_{name}', value, **labels)
+
+    def render(self):
+        self.collect()
+        lines = []
+        typed = set()
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            if name not in typed:
+                lines.append(f'# TYPE {name} histogram')
+                typed.add(name)
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{_labels(labels + (("le", bound),))} {cumulative}')
+            lines.append(f'{name}_sum{_labels(labels)} {histogram.sum}')
+            lines.append(f'{name}_count{_labels(labels)} {histogram.count}')
+        for kind, values in (('counter', self.counters), ('gauge', self.gauges)):
+            for (name, labels), value in sorted(values.items()):
+                if name not in typed:
+                    lines.append(f'# TYPE {name} {kind}')
+                    typed.add(name)
+                lines.append(f'{name}{_labels(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        self.collect()
+        lines = []
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            label = ','.join(str(value) for _, value in labels) or name
+            errors = self.counters.get(('calls_total', labels + (('status', 'error'),)), 0)
+            lines.append(f'{label}: n={histogram.count} avg={histogram.sum / histogram.count * 1000:.0f}ms '
+                         f'p95<={histogram.quantile(0.95)}s err={errors}')
+        for (name, labels), value in sorted(self.gauges.items()):
+            lines.append(f'{name}{_labels(labels)}: {value:.4g}' if isinstance(value, float) else f'{name}{_labels(labels)}: {value}')
+        return '\n'.join(lines) or 'No metrics yet'
+
+
+metrics = Metrics()
+
+
+def timed(name):
+    """
+    Times an async function into the `name` histogram and counts calls by status.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            status = 'error'
+            try:
+                result = await func(*args, **kwargs)
+                status = 'ok'
+                return result
+            finally:
+                metrics.observe(name, time.perf_counter() - start, method=func.__name__)
+                metrics.inc('calls_total', method=func.__name__, status=status)
+        return wrapper
+    return decorator
+
+
+async def monitor_loop_lag(interval=0.5):
+    # A coroutine that sleeps `interval` and measures how late it wakes up
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lag = time.perf_counter() - start - interval
+        metrics.observe('event_loop_lag_seconds', lag)
+        metrics.set('event_loop_lag_last_seconds', lag)
+
+
+async def serve(host='127.0.0.1', port=9100):
+    async def handle(request):
+        return web.Response(text=metrics.render(), content_type='text/plain', charset='utf-8')
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info('Metrics on http://%s:%s/metrics', host, port)
@@ -0,0 +1,121 @@
+import asyncio
+import collections
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+# Telegram rejects longer messages
+MAX_MESSAGE = 4096
+
+
+class Notifier:
+    """
+    Outbound Telegram messages off the trading path: notify() only queues the text,
+    run() joins whatever arrives within `batch_window` into one message and sends at most
+    one message per `min_interval` seconds. When the queue is full the oldest texts are dropped.
+    """
+
+    def __init__(self, bot, chat_id, batch_window=0.5, min_interval=1.0, max_queue=1000):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.batch_window = batch_window
+        self.min_interval = min_interval
+        self.queue = collections.deque(maxlen=max_queue)
+        self.dropped = 0
+        self._ready = asyncio.Event()
+        self._last_sent = 0.0
+
+    def notify(self, text):
+        if len(self.queue) == self.queue.maxlen:
+            self.dropped += 1
+        self.queue.append(text)
+        self._ready.set()
+
+    async def run(self):
+        while True:
+            await self._ready.wait()
+            await asyncio.sleep(self.batch_window)
+            self._ready.clear()
+            texts = []
+            while self.queue:
+                texts.append(self.queue.popleft())
+            if not texts:
+                continue
+            for message in self._split('\n'.join(texts)):
+                wait = self._last_sent + self.min_interval - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                try:
+                    await self.bot.send_message(self.chat_id, message)
+                except Exception as err:
+                    logger.warning('Telegram send failed: %s', err)
+                self._last_sent = time.monotonic()
+
+    @staticmethod
+    def _split(text):
+        chunks = []
+        while len(text) > MAX_MESSAGE:
+            cut = text.rfind('\n', 0, MAX_MESSAGE)
+            if cut <= 0:
+                cut = MAX_MESSAGE
+            chunks.append(text[:cut])
+            text = text[cut:].lstrip('\n')
+        chunks.append(text)
+        return chunks
+
+
+EVENT_TITLES = {
+    'order_placed': 'ордер',
+    'order_rejected': 'ордер отклонен',
+    'fill': 'исполнение',
+    'stop_loss_set': 'стоп лосс',
+    'stop_loss_hit': 'сработал стоп лосс',
+    'trailing_stop_set': 'trailing stop',
+    'position_closed': 'позиция закрыта',
+    'close_failed': 'ошибка закрытия позиции',
+    'entry_blocked': 'вход заблокирован лимитом риска',
+}
+
+
+class TradeNotifier:
+    """
+    Turns trade events from events.EventBus into Telegram messages.
+    Events arriving within `window` seconds are coalesced into one digest.
+    """
+
+    def __init__(self, subscription, notifier, window=2.0, max_lines=10, prefix=''):
+        self.subscription = subscription
+        # Marks digests of one account when several share the chat
+        self.prefix = prefix
+        self.notifier = notifier
+        self.window = window
+        self.max_lines = max_lines
+
+    @staticmethod
+    def format_event(event):
+        details = ' '.join(f'{key}={value}' for key, value in event.data.items())
+        return f"{event.symbol}: {EVENT_TITLES.get(event.kind, event.kind)} {details}".rstrip()
+
+    def digest(self, events):
+        if len(events) <= self.max_lines:
+            return '\n'.join(self.format_event(event) for event in events)
+        counts = {}
+        for event in events:
+            per_symbol = counts.setdefault(event.symbol, collections.Counter())
+            per_symbol[EVENT_TITLES.get(event.kind, event.kind)] += 1
+        lines = [f"Сводка: {len(events)} событий по {len(counts)} монетам"]
+        for symbol, per_symbol in sorted(counts.items()):
+            lines.append(f"{symbol}: " + ', '.join(f'{title} x{count}' for title, count in per_symbol.items()))
+        return '\n'.join(lines)
+
+    async def run(self):
+        while True:
+            events = await self.subscription.get_batch(self.window)
+            if events:
+                text = self.digest(events)
+                if self.subscription.dropped:
+                    text += f"\n(пропущено событий: {self.subscription.dropped})"
+                    self.subscription.dropped = 0
+                self.notifier.notify(self.prefix + text)
@@ -0,0 +1,162 @@
+import asyncio
+import heapq
+import itertools
+import time
+
+
+# Bybit v5 request limits per second, see https://bybit-exchange.github.io/docs/v5/rate-limit
+ENDPOINT_GROUPS = {
+    '/v5/order/create': 'order',
+    '/v5/order/create-batch': 'order',
+    '/v5/position/trading-stop': 'stop',
+    '/v5/position/list': 'positions',
+    '/v5/market/tickers': 'market',
+    '/v5/market/instruments-info': 'market',
+    '/v5/market/time': 'market',
+}
+DEFAULT_LIMITS = {'order': 10, 'stop': 10, 'positions': 50, 'market': 100, 'other': 10}
+# Lower value goes first: orders and stops are served ahead of informational reads
+PRIORITIES = {'order': 0, 'stop': 0, 'positions': 1, 'market': 2, 'other': 2}
+# Bybit allows 600 requests per 5 seconds per IP across all endpoints
+IP_LIMIT = 120
+# Pause of the whole IP when Bybit gives no reset time: HTTP 403 is a ban of at least 10 minutes,
+# retCode 10018 an exceeded IP limit
+IP_BAN_PAUSE = 600.0
+IP_LIMIT_PAUSE = 5.0
+
+
+def endpoint_group(path):
+    return ENDPOINT_GROUPS.get(path, 'other')
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def ready(self, now):
+        self.refill(now)
+        return now >= self.blocked_until and self.tokens >= 1
+
+    def take(self):
+        self.tokens -= 1
+
+    def wait_time(self, now):
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+    def block(self, until):
+        self.blocked_until = max(self.blocked_until, until)
+        self.tokens = 0
+
+
+# Bybit counts the IP limit over every key and the public endpoints, so all schedulers of the process share it
+_ip_bucket = None
+
+
+def process_ip_bucket():
+    global _ip_bucket
+    if _ip_bucket is None:
+        _ip_bucket = TokenBucket(IP_LIMIT)
+    return _ip_bucket
+
+
+class RequestScheduler:
+    """
+    Every exchange request waits here for a token of its endpoint group and of the shared IP budget.
+    Waiters are granted strictly by priority, then in arrival order.
+    Buckets follow the X-Bapi-Limit-* headers Bybit returns with each private response.
+    Group buckets belong to one API key (or to the public endpoints), the IP bucket to the whole process.
+    """
+
+    def __init__(self, limits=None, ip_bucket=None):
+        limits = dict(DEFAULT_LIMITS, **(limits or {}))
+        self.buckets = {group: TokenBucket(rate) for group, rate in limits.items()}
+        self.ip_bucket = ip_bucket or process_ip_bucket()
+        self._waiters = []
+        self._seq = itertools.count()
+        self._timer = None
+        self.granted = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    async def acquire(self, group):
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (PRIORITIES.get(group, 2), next(self._seq), group, future, time.monotonic()))
+        self._pump()
+        await future
+
+    def _pump(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        now = time.monotonic()
+        blocked = []
+        next_wait = None
+        while self._waiters:
+            item = heapq.heappop(self._waiters)
+            _, _, group, future, enqueued = item
+            if future.done():
+                continue
+            if not self.ip_bucket.ready(now):
+                # Nobody can go until the shared budget refills
+                blocked.append(item)
+                next_wait = self.ip_bucket.wait_time(now)
+                break
+            bucket = self.buckets[group]
+            if not bucket.ready(now):
+                # Only this group is exhausted, lower priority groups may still go
+                blocked.append(item)
+                wait = bucket.wait_time(now)
+                next_wait = wait if next_wait is None else min(next_wait, wait)
+                continue
+            bucket.take()
+            self.ip_bucket.take()
+            waited = now - enqueued
+            self.granted += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+            future.set_result(None)
+        for item in blocked:
+            heapq.heappush(self._waiters, item)
+        if self._waiters:
+            self._timer = asyncio.get_running_loop().call_later(max(next_wait or 0.0, 0.001), self._pump)
+
+    def on_response(self, group, headers, ret_code=0, status=200):
+        bucket = self.buckets[group]
+        headers = {key.lower(): value for key, value in headers.items()}
+        limit = headers.get('x-bapi-limit')
+        remaining = headers.get('x-bapi-limit-status')
+        reset = headers.get('x-bapi-limit-reset-timestamp')
+
+        def until(pause):
+            if reset:
+                return time.monotonic() + max(0.0, int(reset) / 1000 - time.time())
+            return time.monotonic() + pause
+
+        if limit:
+            bucket.rate = bucket.capacity = float(limit)
+        if remaining is not None:
+            bucket.tokens = min(bucket.tokens, float(remaining))
+        if status == 403 or ret_code == 10018:
+            # The IP is over its limit: every group of every account in the process waits
+            self.ip_bucket.block(until(IP_BAN_PAUSE if status == 403 else IP_LIMIT_PAUSE))
+        # 10006: too many visits
+        elif ret_code == 10006 or remaining == '0':
+            bucket.block(until(1.0))
+
+    def stats(self):
+        return {
+            'queue_depth': len(self._waiters),
+            'granted': self.granted,
+            'avg_wait': self.total_wait / self.granted if self.granted else 0.0,
+            'max_wait': self.max_wait,
+        }
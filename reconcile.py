@@ -0,0 +1,128 @@
+import asyncio
+import logging
+import time
+
+responses = logging.getLogger('exchange.response')
+
+
+# Bybit: "not modified", the stop already has this value
+NOT_MODIFIED = 34040
+
+FIELDS = ('stopLoss', 'trailingStop')
+
+
+def same_price(a, b):
+    return abs(a - b) <= 1e-9 * max(1.0, abs(b))
+
+
+class StopReconciler:
+    """
+    Desired stop loss / trailing stop per (symbol, positionIdx) against what the positions snapshot shows.
+    reconcile() sends one set_trading_stop per leg that differs, with only the differing fields,
+    and all legs of the symbol concurrently.
+    Values we sent are trusted over the snapshot for `settle` seconds, so a stale
+    poll or websocket update does not make us send the same change again.
+    """
+
+    def __init__(self, session, positions_cache, events, settle=5.0, clock=time.monotonic):
+        self.session = session
+        self.clock = clock
+        self.positions_cache = positions_cache
+        self.events = events
+        self.settle = settle
+        self.desired = {}
+        # (symbol, positionIdx) -> (fields we sent, monotonic time)
+        self.sent = {}
+        self.calls = 0
+        self.skipped = 0
+
+    def want(self, symbol, position_idx, **fields):
+        self.desired.setdefault((symbol, int(position_idx)), {}).update(fields)
+
+    def set_leg(self, symbol, position_idx, **fields):
+        # The leg's whole desired state, fields not given are off
+        self.desired[(symbol, int(position_idx))] = dict(dict.fromkeys(FIELDS, 0.0), **fields)
+
+    # Called when the symbol's trade is over, so nothing carries over to the next entry
+    def forget(self, symbol):
+        for key in [key for key in self.desired if key[0] == symbol]:
+            self.desired.pop(key)
+            self.sent.pop(key, None)
+
+    def actual(self, key, position):
+        values = {field: float(position.get(field) or 0) for field in FIELDS}
+        sent = self.sent.get(key)
+        if sent is not None:
+            fields, sent_at = sent
+            if all(same_price(values[field], value) for field, value in fields.items()):
+                # The snapshot caught up with our change
+                self.sent.pop(key)
+            elif self.clock() - sent_at < self.settle:
+                values.update(fields)
+        return values
+
+    def diff(self, key, position):
+        actual = self.actual(key, position)
+        return {field: value for field, value in self.desired.get(key, {}).items()
+                if not same_price(actual[field], value)}
+
+    async def reconcile(self, symbol):
+        """
+        Brings the stops of the symbol's open legs to the desired values. Returns the changes sent.
+        """
+        positions = await self.positions_cache.get_symbol(symbol)
+        open_keys = set()
+        changes = []
+        for position in positions:
+            key = (symbol, int(position['positionIdx']))
+            open_keys.add(key)
+            if key in self.desired:
+                fields = self.diff(key, position)
+                if fields:
+                    changes.append((key, fields))
+                else:
+                    self.skipped += 1
+        # Legs that are gone need no stops
+        for key in [key for key in self.desired if key[0] == symbol and key not in open_keys]:
+            self.desired.pop(key)
+            self.sent.pop(key, None)
+        if not changes:
+            return []
+        results = await asyncio.gather(*(self._apply(key, fields) for key, fields in changes), return_exceptions=True)
+        self.positions_cache.invalidate()
+        # Failed legs stay different from the desired values and are retried by the next call
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+        return changes
+
+    async def _apply(self, key, fields):
+        symbol, position_idx = key
+        self.calls += 1
+        try:
+            resp = await self.session.set_trading_stop(
+                category="linear",
+                symbol=symbol,
+                slTriggerBy="MarkPrice",
+                tpslMode="Full",
+                slOrderType="Market",
+                positionIdx=position_idx,
+                **{field: str(value) for field, value in fields.items()}
+            )
+            responses.info('set_trading_stop %s %s: %s', symbol, position_idx, resp)
+        except Exception as err:
+            if getattr(err, 'status_code', None) != NOT_MODIFIED:
+                raise
+        self.sent[key] = (fields, self.clock())
+        if fields.get('stopLoss'):
+            self.events.emit('stop_loss_set', symbol, positionIdx=position_idx, stopLoss=fields['stopLoss'])
+        if fields.get('trailingStop'):
+            self.events.emit('trailing_stop_set', symbol, positionIdx=position_idx,
+                             trailingStop=fields['trailingStop'])
+
+    def stats(self):
+        return {
+            'calls': self.calls,
+            'skipped': self.skipped,
+            'desired': len(self.desired),
+        }
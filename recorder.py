@@ -0,0 +1,446 @@
+"""
+Recorder and replay of what the bot saw: mark prices, position snapshots and our own order / stop acks.
+
+A recording is a directory of append-only column files, one per table column (`ticks.price.bin`, ...),
+plus `symbols.txt` (symbol id = line number) and a `<table>.idx` sidecar. Every flushed chunk adds one
+index row per symbol in it: (symbol id, first row, row count, first ts, last ts), so reading one symbol
+over a time range touches only the chunks that contain it. Columns are read back memory-mapped with NumPy.
+
+    RECORD_DIR=recordings/2024-06-01 python app.py
+    python recorder.py info recordings/2024-06-01
+    python recorder.py replay recordings/2024-06-01 --speed 0      # as fast as possible, deterministic
+    python recorder.py replay recordings/2024-06-01 --speed 1      # real time
+"""
+import argparse
+import array
+import asyncio
+import bisect
+import json
+import logging
+import os
+import random
+import selectors
+import struct
+import sys
+import threading
+import time
+
+from sim import SimulatedBybit
+
+logger = logging.getLogger(__name__)
+
+
+REST, WS = 0, 1
+ENTRY, STOP = 0, 1
+SIDES = {'Buy': 1, 'Sell': -1}
+# table -> ((column, array typecode), ...), typecodes map to NumPy dtypes below
+TABLES = {
+    'ticks': (('ts', 'd'), ('sym', 'H'), ('source', 'B'), ('price', 'd')),
+    'positions': (('ts', 'd'), ('sym', 'H'), ('source', 'B'), ('idx', 'B'), ('side', 'b'), ('size', 'd'),
+                  ('avg_price', 'd'), ('stop_loss', 'd'), ('trailing_stop', 'd')),
+    'orders': (('ts', 'd'), ('sym', 'H'), ('idx', 'B'), ('side', 'b'), ('kind', 'B'), ('qty', 'd'),
+               ('price', 'd'), ('code', 'i'), ('latency', 'f')),
+}
+DTYPES = {'d': 'f8', 'f': 'f4', 'H': 'u2', 'B': 'u1', 'b': 'i1', 'i': 'i4'}
+INDEX_ROW = struct.Struct('<HQIdd')
+
+
+class Recorder:
+    """
+    Buffers rows in memory (cheap to call from the event loop) and appends them to the column files
+    on flush(), which run() calls from a worker thread every `flush_interval` seconds.
+    """
+
+    def __init__(self, directory, flush_interval=1.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        os.makedirs(directory, exist_ok=True)
+        self.symbols = {}
+        self._new_symbols = []
+        symbols_path = os.path.join(directory, 'symbols.txt')
+        if os.path.exists(symbols_path):
+            with open(symbols_path) as f:
+                for line in f:
+                    self.symbols[line.strip()] = len(self.symbols)
+        self.rows = {table: sum_rows(directory, table) for table in TABLES}
+        # Cut a ragged tail left by a crash, so appended columns stay aligned
+        for table, columns in TABLES.items():
+            for name, code in columns:
+                path = os.path.join(directory, f'{table}.{name}.bin')
+                if os.path.exists(path):
+                    os.truncate(path, self.rows[table] * array.array(code).itemsize)
+        self._buffers = self._empty()
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        with open(os.path.join(directory, 'meta.json'), 'w') as f:
+            json.dump({'byteorder': sys.byteorder, 'tables': TABLES}, f)
+
+    @staticmethod
+    def _empty():
+        return {table: [array.array(code) for _, code in columns] for table, columns in TABLES.items()}
+
+    def symbol_id(self, symbol):
+        sym = self.symbols.get(symbol)
+        if sym is None:
+            with self._lock:
+                sym = self.symbols.get(symbol)
+                if sym is None:
+                    sym = self.symbols[symbol] = len(self.symbols)
+                    self._new_symbols.append(symbol)
+        return sym
+
+    def _append(self, table, values):
+        with self._lock:
+            for column, value in zip(self._buffers[table], values):
+                column.append(value)
+
+    def tick(self, symbol, price, source=REST, ts=None):
+        self._append('ticks', (ts or time.time(), self.symbol_id(symbol), source, float(price)))
+
+    def position(self, pos, source=REST, ts=None):
+        self._append('positions', (
+            ts or time.time(), self.symbol_id(pos['symbol']), source, int(pos.get('positionIdx') or 0),
+            SIDES.get(pos.get('side'), 0), float(pos.get('size') or 0), float(pos.get('avgPrice') or 0),
+            float(pos.get('stopLoss') or 0), float(pos.get('trailingStop') or 0),
+        ))
+
+    def order(self, symbol, idx, side, kind, qty, price, code, latency, ts=None):
+        self._append('orders', (
+            ts or time.time(), self.symbol_id(symbol), int(idx or 0), SIDES.get(side, 0), kind,
+            float(qty or 0), float(price or 0), int(code or 0), latency,
+        ))
+
+    def flush(self):
+        with self._lock:
+            buffers, self._buffers = self._buffers, self._empty()
+            new_symbols, self._new_symbols = self._new_symbols, []
+        with self._write_lock:
+            if new_symbols:
+                with open(os.path.join(self.directory, 'symbols.txt'), 'a') as f:
+                    f.writelines(symbol + '\n' for symbol in new_symbols)
+            for table, columns in buffers.items():
+                count = len(columns[0])
+                if not count:
+                    continue
+                # Columns first, then the index: a reader never sees index rows past the column ends
+                for (name, _), column in zip(TABLES[table], columns):
+                    with open(os.path.join(self.directory, f'{table}.{name}.bin'), 'ab') as f:
+                        column.tofile(f)
+                ts, sym = columns[0], columns[1]
+                spans = {}
+                for i in range(count):
+                    first, last = spans.get(sym[i], (ts[i], ts[i]))
+                    spans[sym[i]] = (min(first, ts[i]), max(last, ts[i]))
+                with open(os.path.join(self.directory, f'{table}.idx'), 'ab') as f:
+                    for symbol_id, (first, last) in sorted(spans.items()):
+                        f.write(INDEX_ROW.pack(symbol_id, self.rows[table], count, first, last))
+                self.rows[table] += count
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await asyncio.to_thread(self.flush)
+            except Exception as err:
+                logger.warning('Recorder flush failed: %s', err)
+
+    def close(self):
+        self.flush()
+
+
+def sum_rows(directory, table):
+    # Rows every column has: a crash between column appends leaves a ragged tail that readers ignore
+    sizes = []
+    for name, code in TABLES[table]:
+        path = os.path.join(directory, f'{table}.{name}.bin')
+        sizes.append(os.path.getsize(path) // array.array(code).itemsize if os.path.exists(path) else 0)
+    return min(sizes)
+
+
+class RecordingSession:
+    """
+    Wraps an AsyncHTTP (or anything with its surface) and records tickers, positions, order and stop acks.
+    """
+
+    def __init__(self, session, recorder):
+        self.session = session
+        self.recorder = recorder
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+    async def get_tickers(self, **kwargs):
+        resp = await self.session.get_tickers(**kwargs)
+        now = time.time()
+        for ticker in resp['result']['list']:
+            if ticker.get('markPrice'):
+                self.recorder.tick(ticker['symbol'], ticker['markPrice'], REST, now)
+        return resp
+
+    async def get_positions(self, **kwargs):
+        resp = await self.session.get_positions(**kwargs)
+        now = time.time()
+        for pos in resp['result']['list']:
+            self.recorder.position(pos, REST, now)
+        return resp
+
+    async def _timed(self, call, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await call(**kwargs), 0, time.perf_counter() - start
+        except Exception as err:
+            return err, getattr(err, 'status_code', None) or -1, time.perf_counter() - start
+
+    async def place_order(self, **kwargs):
+        resp, code, latency = await self._timed(self.session.place_order, **kwargs)
+        self.recorder.order(kwargs.get('symbol'), kwargs.get('positionIdx'), kwargs.get('side'), ENTRY,
+                            kwargs.get('qty'), kwargs.get('price'), code, latency)
+        if isinstance(resp, Exception):
+            raise resp
+        return resp
+
+    async def place_batch_order(self, **kwargs):
+        resp, code, latency = await self._timed(self.session.place_batch_order, **kwargs)
+        infos = [{'code': code}] * len(kwargs['request'])
+        if not isinstance(resp, Exception):
+            infos = resp.get('retExtInfo', {}).get('list', [{}] * len(kwargs['request']))
+        for order, info in zip(kwargs['request'], infos):
+            self.recorder.order(order.get('symbol'), order.get('positionIdx'), order.get('side'), ENTRY,
+                                order.get('qty'), order.get('price'), info.get('code', 0), latency)
+        if isinstance(resp, Exception):
+            raise resp
+        return resp
+
+    async def set_trading_stop(self, **kwargs):
+        resp, code, latency = await self._timed(self.session.set_trading_stop, **kwargs)
+        # price holds the stop loss, or the trailing distance when only that was set
+        self.recorder.order(kwargs.get('symbol'), kwargs.get('positionIdx'), None, STOP, 0,
+                            kwargs.get('stopLoss', kwargs.get('trailingStop')), code, latency)
+        if isinstance(resp, Exception):
+            raise resp
+        return resp
+
+
+class Recording:
+    """
+    Read side. table() maps a whole table, rows() reads one symbol over a time range through the index.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, 'symbols.txt')) as f:
+            self.symbols = [line.strip() for line in f]
+        self.ids = {symbol: i for i, symbol in enumerate(self.symbols)}
+
+    def table(self, name):
+        # NumPy only on the read side, the recording bot does not need it
+        import numpy as np
+        count = sum_rows(self.directory, name)
+        columns = {}
+        for column, code in TABLES[name]:
+            path = os.path.join(self.directory, f'{name}.{column}.bin')
+            if count == 0:
+                columns[column] = np.zeros(0, dtype=DTYPES[code])
+            else:
+                columns[column] = np.memmap(path, dtype=DTYPES[code], mode='r', shape=(count,))
+        return columns
+
+    def index(self, name):
+        path = os.path.join(self.directory, f'{name}.idx')
+        if not os.path.exists(path):
+            return []
+        with open(path, 'rb') as f:
+            data = f.read()
+        return [INDEX_ROW.unpack_from(data, offset) for offset in range(0, len(data), INDEX_ROW.size)]
+
+    def rows(self, name, symbol, start=None, end=None):
+        import numpy as np
+        sym = self.ids[symbol]
+        columns = self.table(name)
+        count = len(columns['ts'])
+        parts = []
+        for symbol_id, first_row, rows, first_ts, last_ts in self.index(name):
+            if symbol_id != sym or first_row + rows > count:
+                continue
+            if (start is not None and last_ts < start) or (end is not None and first_ts > end):
+                continue
+            span = slice(first_row, first_row + rows)
+            mask = columns['sym'][span] == sym
+            if start is not None:
+                mask &= columns['ts'][span] >= start
+            if end is not None:
+                mask &= columns['ts'][span] <= end
+            parts.append({column: values[span][mask] for column, values in columns.items()})
+        if not parts:
+            return {column: values[:0] for column, values in columns.items()}
+        return {column: np.concatenate([part[column] for part in parts]) for column in columns}
+
+    def timeline(self):
+        # Every tick of every symbol in time order: (ts, symbol ids, prices)
+        import numpy as np
+        ticks = self.table('ticks')
+        order = np.argsort(ticks['ts'], kind='stable')
+        return ticks['ts'][order], ticks['sym'][order], ticks['price'][order]
+
+
+class ReplayBybit(SimulatedBybit):
+    """
+    SimulatedBybit driven by the ticks of a recording instead of synthetic paths.
+    The market is at the last tick recorded before `clock` time (started at the first tick, times `speed`),
+    ticks are applied on API calls only. The positions and orders tables are not replayed:
+    positions come from the bot's own orders, compare them with the recorded ones through Recording.rows().
+    """
+
+    def __init__(self, recording, speed=1.0, **kwargs):
+        self.recording = recording
+        self.times, self.syms, self.prices = recording.timeline()
+        self.current = {}
+        self.cursor = 0
+        super().__init__({symbol: [] for symbol in recording.symbols}, speed=speed, **kwargs)
+        self.step_ticks(1)
+
+    @property
+    def done(self):
+        # Past the last recorded tick
+        return not len(self.times) or self.now() > self.times[-1]
+
+    def now(self):
+        return self.times[0] + (self.clock() - self.started) * self.speed if len(self.times) else 0.0
+
+    def mark_price(self, symbol):
+        return self.current.get(symbol, 0.0)
+
+    def step_ticks(self, count):
+        for _ in range(count):
+            if self.cursor >= len(self.times):
+                return
+            symbol = self.recording.symbols[int(self.syms[self.cursor])]
+            self.current[symbol] = float(self.prices[self.cursor])
+            self.cursor += 1
+            for key in [key for key in self.positions if key[0] == symbol]:
+                self._check_triggers(key)
+
+    def advance(self):
+        self.step_ticks(bisect.bisect_right(self.times, self.now()) - self.cursor)
+
+
+class _SkippingSelector(selectors.DefaultSelector):
+    # Where the loop would block until its next timer, moves the virtual clock there instead
+    def __init__(self, loop):
+        super().__init__()
+        self.loop = loop
+
+    def select(self, timeout=None):
+        events = super().select(0)
+        if events or timeout is None:
+            return events or super().select(timeout)
+        self.loop.now += max(timeout, 0.0)
+        return []
+
+
+class VirtualClockLoop(asyncio.SelectorEventLoop):
+    """
+    Event loop on a virtual clock: time only moves when every task waits, straight to the next timer.
+    Sleeps and timeouts cost nothing, and as long as nothing waits for real I/O every run is the same.
+    The clock starts at 0 like time.monotonic(), at epoch values timers would lose precision.
+    """
+
+    def __init__(self):
+        self.now = 0.0
+        super().__init__(_SkippingSelector(self))
+
+    def time(self):
+        return self.now
+
+    def call_at(self, when, callback, *args, context=None):
+        return super().call_at(when, self._fire, when, callback, args, context=context)
+
+    def _fire(self, when, callback, args):
+        # Timers run up to the clock resolution early, without this a sleep shorter than that never ends
+        self.now = max(self.now, when)
+        callback(*args)
+
+
+async def run_replay(recording, speed=1.0, params=None, max_duration=None, clock=None):
+    from app import BybitBot
+    from exchange import BybitExchange
+    from metrics import metrics
+
+    sim = ReplayBybit(recording, speed=speed, clock=clock or time.monotonic)
+    bot = BybitBot(BybitExchange(session=sim, clock=clock or time.monotonic), clock=clock or time.time)
+    bot.update_parameters(dict({'coins_pair': recording.symbols}, **(params or {})), save=False)
+    await bot.exchange.instruments.load()
+    started = time.monotonic()
+    supervisor = asyncio.create_task(bot.supervise())
+    while not sim.done and (max_duration is None or time.monotonic() - started < max_duration):
+        await asyncio.sleep(0.05)
+    tasks = [supervisor] + list(bot.tasks.values())
+    # asyncio.wait_for() before 3.12 may swallow a cancel landing as its call completes, cancel until they end
+    while tasks:
+        for task in tasks:
+            task.cancel()
+        _, tasks = await asyncio.wait(tasks, timeout=1)
+    sim.advance()
+    step = metrics.histograms.get(('bot_iteration_seconds', (('method', 'step_symbol'),)))
+    return {
+        'ticks': sim.cursor,
+        'wall_seconds': time.monotonic() - started,
+        'api_calls': sim.api_calls,
+        'calls_by_method': dict(sorted(sim.calls.items())),
+        'triggers': len(sim.triggered),
+        'realized_pnl': sim.realized_pnl,
+        'step_avg_ms': step.sum / step.count * 1000 if step and step.count else 0.0,
+    }
+
+
+def replay(directory, speed=0.0, params=None, max_duration=None, seed=0):
+    """
+    Runs BybitBot over a recording until its ticks run out. Returns a summary for regression comparisons.
+    speed=0 runs the bot and the market on the recorded clock as fast as possible, with the same result
+    on every run. Any other speed follows the wall clock, so timing varies between runs.
+    """
+    recording = Recording(directory)
+    # Backoff jitter
+    random.seed(seed)
+    if speed:
+        return asyncio.run(run_replay(recording, speed, params, max_duration))
+    loop = VirtualClockLoop()
+    try:
+        return loop.run_until_complete(run_replay(recording, 1.0, params, max_duration, loop.time))
+    finally:
+        loop.close()
+
+
+def info(directory):
+    recording = Recording(directory)
+    lines = [f'{len(recording.symbols)} symbols']
+    for name in TABLES:
+        ts = recording.table(name)['ts']
+        span = f'{time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(ts[0]))} .. ' \
+               f'{time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(ts[-1]))}' if len(ts) else '-'
+        lines.append(f'{name:>10}: {len(ts):>10} rows  {span}')
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inspect and replay market-data recordings')
+    commands = parser.add_subparsers(dest='command', required=True)
+    info_parser = commands.add_parser('info', help='row counts and time span per table')
+    info_parser.add_argument('directory')
+    replay_parser = commands.add_parser('replay', help='run BybitBot over a recording')
+    replay_parser.add_argument('directory')
+    replay_parser.add_argument('--speed', type=float, default=0, help='1 = real time, 0 = as fast as possible')
+    replay_parser.add_argument('--params', default='{}', help='bot parameters as JSON, e.g. {"stop_loss": 0.5}')
+    replay_parser.add_argument('--max-duration', type=float, help='stop after this many wall seconds')
+    replay_parser.add_argument('--seed', type=int, default=0, help='seed of the retry jitter')
+    args = parser.parse_args()
+
+    if args.command == 'info':
+        print(info(args.directory))
+        return
+    result = replay(args.directory, args.speed, json.loads(args.params), args.max_duration, args.seed)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,288 @@
+import asyncio
+import contextlib
+import contextvars
+import logging
+import random
+import time
+import uuid
+
+from pybit import exceptions
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+# Bybit v5 return codes, see https://bybit-exchange.github.io/docs/v5/error
+TRANSIENT_CODES = {10000, 10002, 10016, 10019, 170007, 170146}
+RATE_LIMIT_CODES = {10006, 10018}
+AUTH_CODES = {10003, 10004, 10005, 10007, 10009, 10010, 33004}
+DUPLICATE_ORDER = 110072
+
+
+class ExchangeError(Exception):
+    """
+    Base of the typed errors. Keeps pybit's `status_code` and `message`, the pybit exception is the __cause__.
+    """
+    retryable = False
+
+    def __init__(self, message, status_code=None, endpoint=None):
+        super().__init__(f'{endpoint}: {message} (code {status_code})')
+        self.message = message
+        self.status_code = status_code
+        self.endpoint = endpoint
+
+
+class TransientError(ExchangeError):
+    # Network failures, timeouts, 5xx and server-side hiccups
+    retryable = True
+
+
+class RateLimitError(TransientError):
+    pass
+
+
+class IpBanError(RateLimitError):
+    # HTTP 403: the IP is banned for a while, every retry makes the ban longer
+    retryable = False
+
+
+class AuthError(ExchangeError):
+    pass
+
+
+class RejectedError(ExchangeError):
+    # The exchange understood the request and refused it, sending it again changes nothing
+    pass
+
+
+class DuplicateOrderError(RejectedError):
+    pass
+
+
+class CircuitOpenError(ExchangeError):
+    def __init__(self, endpoint, retry_after):
+        super().__init__(f'circuit open for {retry_after:.1f}s', endpoint=endpoint)
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(TransientError):
+    retryable = False
+
+
+def classify(err, endpoint=None):
+    if isinstance(err, ExchangeError):
+        return err
+    if isinstance(err, exceptions.FailedRequestError):
+        status = err.status_code
+        if status == 403:
+            return IpBanError(err.message, status, endpoint)
+        if status == 429:
+            return RateLimitError(err.message, status, endpoint)
+        if status in (401,):
+            return AuthError(err.message, status, endpoint)
+        if status is None or status >= 500:
+            return TransientError(err.message, status, endpoint)
+        return RejectedError(err.message, status, endpoint)
+    if isinstance(err, exceptions.InvalidRequestError):
+        code = err.status_code
+        if code in RATE_LIMIT_CODES:
+            return RateLimitError(err.message, code, endpoint)
+        if code in TRANSIENT_CODES:
+            return TransientError(err.message, code, endpoint)
+        if code in AUTH_CODES:
+            return AuthError(err.message, code, endpoint)
+        if code == DUPLICATE_ORDER:
+            return DuplicateOrderError(err.message, code, endpoint)
+        return RejectedError(err.message, code, endpoint)
+    if isinstance(err, (asyncio.TimeoutError, ConnectionError, OSError)):
+        return TransientError(str(err) or type(err).__name__, None, endpoint)
+    return None
+
+
+# Monotonic time by which the current task's exchange calls must finish, see deadline()
+_deadline = contextvars.ContextVar('exchange_deadline', default=None)
+
+
+@contextlib.contextmanager
+def deadline(seconds):
+    """
+    Bounds every exchange call made inside the block, retries included. Nested deadlines only shorten it.
+    The value lives in a contextvar, so each asyncio task has its own.
+    """
+    until = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(until if current is None else min(current, until))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining():
+    until = _deadline.get()
+    return None if until is None else until - time.monotonic()
+
+
+class CircuitBreaker:
+    """
+    Opens after `threshold` transient failures in a row and fails calls fast for `reset_timeout` seconds,
+    then lets one probe through: success closes it, failure opens it again.
+    """
+
+    def __init__(self, threshold=5, reset_timeout=10.0):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half_open'
+        return 'open'
+
+    def before_call(self, endpoint):
+        state = self.state
+        if state == 'open' or (state == 'half_open' and self.probing):
+            raise CircuitOpenError(endpoint, max(0.0, self.opened_at + self.reset_timeout - time.monotonic()))
+        if state == 'half_open':
+            self.probing = True
+
+    def on_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def on_failure(self):
+        self.failures += 1
+        self.probing = False
+        if self.failures >= self.threshold or self.opened_at is not None:
+            self.opened_at = time.monotonic()
+
+
+class ResilientSession:
+    """
+    Wraps an AsyncHTTP (or SimulatedBybit) with typed errors, jittered exponential retries of idempotent calls,
+    orderLinkIds that make order retries safe, a circuit breaker per endpoint and the deadline() of the caller.
+    An order retried after a lost response comes back as a duplicate orderLinkId and counts as placed.
+    """
+
+    def __init__(self, session, attempts=4, base_delay=0.1, max_delay=2.0, threshold=5, reset_timeout=10.0,
+                 attempt_timeout=None, link_prefix='lb'):
+        self.session = session
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.attempt_timeout = attempt_timeout
+        self.link_prefix = link_prefix
+        self.breakers = {}
+        self.retries = 0
+        self.failures = 0
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+    def breaker(self, endpoint):
+        breaker = self.breakers.get(endpoint)
+        if breaker is None:
+            breaker = self.breakers[endpoint] = CircuitBreaker(self.threshold, self.reset_timeout)
+        return breaker
+
+    def link_id(self):
+        # Bybit allows up to 36 characters
+        return f'{self.link_prefix}-{uuid.uuid4().hex[:30]}'
+
+    def backoff(self, attempt):
+        # Full jitter
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    # Every wrapped call is idempotent: reads, absolute stop values and orders carrying an orderLinkId
+    async def call(self, endpoint, func, **kwargs):
+        breaker = self.breaker(endpoint)
+        attempt = 0
+        while True:
+            breaker.before_call(endpoint)
+            left = remaining()
+            if left is not None and left <= 0:
+                raise DeadlineExceeded('deadline exceeded', endpoint=endpoint)
+            timeout = self.attempt_timeout if left is None else min(left, self.attempt_timeout or left)
+            try:
+                if timeout is None:
+                    result = await func(**kwargs)
+                else:
+                    result = await asyncio.wait_for(func(**kwargs), timeout)
+            except Exception as err:
+                error = classify(err, endpoint)
+                if error is None:
+                    raise
+                if isinstance(err, asyncio.TimeoutError) and left is not None and timeout >= left:
+                    error = DeadlineExceeded('deadline exceeded', endpoint=endpoint)
+                # A rejection still proves the endpoint is up
+                if isinstance(error, TransientError):
+                    breaker.on_failure()
+                else:
+                    breaker.on_success()
+                attempt += 1
+                delay = self.backoff(attempt)
+                left = remaining()
+                if (not error.retryable or attempt >= self.attempts
+                        or (left is not None and delay >= left)):
+                    self.failures += 1
+                    metrics.inc('exchange_errors_total', endpoint=endpoint, error=type(error).__name__)
+                    raise error from err
+                self.retries += 1
+                logger.info('%s failed (%s), retry %d in %.2fs', endpoint, error, attempt, delay)
+                await asyncio.sleep(delay)
+                continue
+            breaker.on_success()
+            return result
+
+    async def get_server_time(self, **kwargs):
+        return await self.call('get_server_time', self.session.get_server_time, **kwargs)
+
+    async def get_instruments_info(self, **kwargs):
+        return await self.call('get_instruments_info', self.session.get_instruments_info, **kwargs)
+
+    async def get_tickers(self, **kwargs):
+        return await self.call('get_tickers', self.session.get_tickers, **kwargs)
+
+    async def get_positions(self, **kwargs):
+        return await self.call('get_positions', self.session.get_positions, **kwargs)
+
+    async def set_trading_stop(self, **kwargs):
+        return await self.call('set_trading_stop', self.session.set_trading_stop, **kwargs)
+
+    async def place_order(self, **kwargs):
+        kwargs.setdefault('orderLinkId', self.link_id())
+        try:
+            return await self.call('place_order', self.session.place_order, **kwargs)
+        except DuplicateOrderError:
+            # An earlier attempt was placed, only its response got lost
+            return {'retCode': 0, 'retMsg': 'OK', 'result': {'orderId': '', 'orderLinkId': kwargs['orderLinkId']},
+                    'retExtInfo': {}, 'time': int(time.time() * 1000)}
+
+    async def place_batch_order(self, **kwargs):
+        # Set on the caller's dicts, so a fallback to single orders reuses the same ids
+        for order in kwargs['request']:
+            order.setdefault('orderLinkId', self.link_id())
+        resp = await self.call('place_batch_order', self.session.place_batch_order, **kwargs)
+        for info in resp.get('retExtInfo', {}).get('list', []):
+            if info.get('code') == DUPLICATE_ORDER:
+                info.update(code=0, msg='OK')
+        return resp
+
+    async def close(self):
+        await self.session.close()
+
+    def stats(self):
+        return {
+            'retries': self.retries,
+            'failures': self.failures,
+            'open_breakers': sum(breaker.state != 'closed' for breaker in self.breakers.values()),
+        }
@@ -0,0 +1,259 @@
+"""
+Account-level exposure kept up to date incrementally: every position update and every mark price touches only
+its own leg or symbol and moves the totals by the difference, nothing re-scans the open positions.
+"""
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class RiskLimitError(Exception):
+    """
+    An entry refused by RiskEngine.admit(). `retry_after` is set when the entry is only throttled.
+    """
+
+    def __init__(self, symbol, reason, retry_after=None):
+        super().__init__(f'{symbol}: entry blocked by {reason}')
+        self.symbol = symbol
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class SymbolRisk:
+    __slots__ = ('gross', 'net', 'cost', 'margin', 'legs', 'price', 'notional', 'upnl')
+
+    def __init__(self, price):
+        # Sum of leg sizes, signed sum of sizes, signed sum of size * entry price
+        self.gross = 0.0
+        self.net = 0.0
+        self.cost = 0.0
+        self.margin = 0.0
+        self.legs = 0
+        self.price = price
+        # Last values added to the engine totals
+        self.notional = 0.0
+        self.upnl = 0.0
+
+
+def env_limit(name):
+    return float(os.getenv(name) or 0)
+
+
+class RiskEngine:
+    """
+    Running notional, unrealized PnL and initial margin per symbol and for the account.
+    Entries reserve their notional until the position shows up, so concurrent entries cannot overshoot a limit.
+    Above `throttle` of any limit, entries are spaced `throttle_interval` seconds apart. A limit of 0 is off.
+    """
+
+    def __init__(self, events=None, max_notional=None, max_symbol_notional=None, max_margin=None, max_loss=None,
+                 max_symbols=None, throttle=None, throttle_interval=None, settle=10.0, clock=time.monotonic):
+        self.events = events
+        self.clock = clock
+        self.max_notional = env_limit('RISK_MAX_NOTIONAL') if max_notional is None else max_notional
+        self.max_symbol_notional = (env_limit('RISK_MAX_SYMBOL_NOTIONAL') if max_symbol_notional is None
+                                    else max_symbol_notional)
+        self.max_margin = env_limit('RISK_MAX_MARGIN') if max_margin is None else max_margin
+        # Entries stop while the unrealized loss is at least this much
+        self.max_loss = env_limit('RISK_MAX_LOSS') if max_loss is None else max_loss
+        self.max_symbols = int(env_limit('RISK_MAX_SYMBOLS')) if max_symbols is None else max_symbols
+        self.throttle = float(os.getenv('RISK_THROTTLE', 0.8)) if throttle is None else throttle
+        self.throttle_interval = (float(os.getenv('RISK_THROTTLE_INTERVAL', 5)) if throttle_interval is None
+                                  else throttle_interval)
+        # Reservations of entries whose positions did not show up are dropped after this long
+        self.settle = settle
+        # (symbol, positionIdx) -> (signed size, entry price, initial margin)
+        self.legs = {}
+        self.symbols = {}
+        self.notional = 0.0
+        self.upnl = 0.0
+        self.margin = 0.0
+        # symbol -> (notional, margin, monotonic expiry) of entries in flight
+        self.pending = {}
+        self.pending_notional = 0.0
+        self.pending_margin = 0.0
+        self.next_entry = 0.0
+        self.blocked = None
+        self.blocks = 0
+        self.throttled = 0
+
+    def _refresh(self, risk):
+        notional = risk.gross * risk.price
+        upnl = risk.net * risk.price - risk.cost
+        self.notional += notional - risk.notional
+        self.upnl += upnl - risk.upnl
+        risk.notional = notional
+        risk.upnl = upnl
+
+    def on_price(self, symbol, price):
+        risk = self.symbols.get(symbol)
+        if risk is not None:
+            risk.price = price
+            self._refresh(risk)
+
+    def on_position(self, pos):
+        key = (pos['symbol'], int(pos['positionIdx']))
+        size = float(pos.get('size') or 0)
+        leg = None
+        if size > 0:
+            entry = float(pos.get('avgPrice') or 0)
+            margin = float(pos.get('positionIM') or 0) or size * entry / float(pos.get('leverage') or 1)
+            leg = (size if pos['side'] == 'Buy' else -size, entry, margin)
+        old = self.legs.get(key)
+        mark = float(pos.get('markPrice') or 0)
+        if old == leg:
+            if leg is not None and mark:
+                self.on_price(key[0], mark)
+            return
+        risk = self.symbols.get(key[0])
+        if risk is None:
+            if leg is None:
+                return
+            risk = self.symbols[key[0]] = SymbolRisk(mark or leg[1])
+        if old is not None:
+            self._apply(risk, old, -1)
+            self.legs.pop(key)
+        if leg is not None:
+            self._apply(risk, leg, 1)
+            self.legs[key] = leg
+            self.release(key[0])
+        if mark:
+            risk.price = mark
+        if risk.legs:
+            self._refresh(risk)
+        else:
+            self.notional -= risk.notional
+            self.upnl -= risk.upnl
+            self.symbols.pop(key[0])
+
+    def _apply(self, risk, leg, sign):
+        size, entry, margin = leg
+        risk.gross += sign * abs(size)
+        risk.net += sign * size
+        risk.cost += sign * size * entry
+        risk.margin += sign * margin
+        risk.legs += sign
+        self.margin += sign * margin
+
+    def sync(self, positions):
+        """
+        Applies a full positions snapshot: legs missing from it are closed.
+        """
+        seen = set()
+        for pos in positions:
+            self.on_position(pos)
+            seen.add((pos['symbol'], int(pos['positionIdx'])))
+        for symbol, position_idx in [key for key in self.legs if key not in seen]:
+            self.on_position({'symbol': symbol, 'positionIdx': position_idx, 'size': 0})
+        # Drops the float drift of the running sums
+        self.notional = sum(risk.notional for risk in self.symbols.values())
+        self.upnl = sum(risk.upnl for risk in self.symbols.values())
+        self.margin = sum(risk.margin for risk in self.symbols.values())
+
+    def release(self, symbol):
+        pending = self.pending.pop(symbol, None)
+        if pending is not None:
+            self.pending_notional -= pending[0]
+            self.pending_margin -= pending[1]
+
+    def _expire(self, now):
+        for symbol in [symbol for symbol, pending in self.pending.items() if pending[2] <= now]:
+            self.release(symbol)
+
+    def usage(self):
+        # Highest fraction of any limit in use, reservations included
+        ratios = [0.0]
+        if self.max_notional:
+            ratios.append((self.notional + self.pending_notional) / self.max_notional)
+        if self.max_margin:
+            ratios.append((self.margin + self.pending_margin) / self.max_margin)
+        if self.max_loss:
+            ratios.append(-self.upnl / self.max_loss)
+        if self.max_symbols:
+            ratios.append(len(self.symbols.keys() | self.pending.keys()) / self.max_symbols)
+        return max(ratios)
+
+    def breach(self, symbol, notional, margin):
+        if self.max_loss and self.upnl <= -self.max_loss:
+            return 'max_loss'
+        if self.max_notional and self.notional + self.pending_notional + notional > self.max_notional:
+            return 'max_notional'
+        risk = self.symbols.get(symbol)
+        if self.max_symbol_notional and (risk.notional if risk else 0.0) + notional > self.max_symbol_notional:
+            return 'max_symbol_notional'
+        if self.max_margin and self.margin + self.pending_margin + margin > self.max_margin:
+            return 'max_margin'
+        if (self.max_symbols and symbol not in self.symbols and symbol not in self.pending
+                and len(self.symbols.keys() | self.pending.keys()) >= self.max_symbols):
+            return 'max_symbols'
+        return None
+
+    def admit(self, symbol, notional):
+        """
+        Reserves an entry of `notional` USDT (all legs) or raises RiskLimitError.
+        """
+        now = self.clock()
+        self._expire(now)
+        # The leverage is known only once the position exists, 1x overestimates the margin
+        margin = notional
+        reason = self.breach(symbol, notional, margin)
+        if reason is not None:
+            self.blocks += 1
+            if reason != self.blocked:
+                # Only the change is reported, every symbol retries on its own cooldown
+                logger.warning('Entries blocked by %s: %s', reason, self.limits_text())
+                if self.events is not None:
+                    self.events.emit('entry_blocked', symbol, reason=reason)
+            self.blocked = reason
+            raise RiskLimitError(symbol, reason)
+        busy = self.usage() >= self.throttle
+        if busy and now < self.next_entry:
+            self.throttled += 1
+            raise RiskLimitError(symbol, 'throttle', self.next_entry - now)
+        if busy:
+            self.next_entry = now + self.throttle_interval
+        if self.blocked is not None:
+            logger.info('Entries allowed again')
+            self.blocked = None
+        self.release(symbol)
+        self.pending[symbol] = (notional, margin, now + self.settle)
+        self.pending_notional += notional
+        self.pending_margin += margin
+
+    def limits_text(self):
+        def part(name, value, limit):
+            return f'{name} {value:.2f}/{limit:g}' if limit else f'{name} {value:.2f}'
+        parts = [
+            part('notional', self.notional, self.max_notional),
+            part('margin', self.margin, self.max_margin),
+            part('upnl', self.upnl, -self.max_loss),
+            f'symbols {len(self.symbols)}' + (f'/{self.max_symbols}' if self.max_symbols else ''),
+        ]
+        if self.pending:
+            parts.append(f'pending {len(self.pending)} entries {self.pending_notional:.2f}')
+        return ', '.join(parts)
+
+    def summary(self, top=20):
+        lines = [self.limits_text()]
+        if self.blocked is not None:
+            lines.append(f'blocked: {self.blocked}')
+        largest = sorted(self.symbols.items(), key=lambda item: item[1].notional, reverse=True)[:top]
+        for symbol, risk in largest:
+            lines.append(f'{symbol}: notional {risk.notional:.2f} upnl {risk.upnl:.2f} margin {risk.margin:.2f}')
+        if len(self.symbols) > top:
+            lines.append(f'... {len(self.symbols) - top} more')
+        return '\n'.join(lines)
+
+    def stats(self):
+        return {
+            'notional': self.notional,
+            'upnl': self.upnl,
+            'margin': self.margin,
+            'symbols': len(self.symbols),
+            'pending': len(self.pending),
+            'usage': self.usage(),
+            'blocks': self.blocks,
+            'throttled': self.throttled,
+        }
@@ -0,0 +1,312 @@
+import asyncio
+import csv
+import itertools
+import math
+import random
+import time
+
+from pybit import exceptions
+
+
+def synthetic_path(start=1.0, volatility=0.002, steps=100000, seed=None):
+    # Geometric random walk, one price per tick
+    rng = random.Random(seed)
+    prices = [start]
+    for _ in range(steps - 1):
+        prices.append(prices[-1] * math.exp(rng.gauss(0, volatility)))
+    return prices
+
+
+def load_path(path):
+    # Recorded mark prices: CSV with the price in the last column, header optional
+    prices = []
+    with open(path) as f:
+        for row in csv.reader(f):
+            try:
+                prices.append(float(row[-1]))
+            except (ValueError, IndexError):
+                continue
+    return prices
+
+
+class SimulatedBybit:
+    """
+    In-memory Bybit linear market with the same methods and response shape as AsyncHTTP,
+    so BybitExchange (caches, batching, stops) runs unchanged on top of it.
+    Prices follow per-symbol paths, one step per `tick_interval` seconds of `clock` time times `speed`.
+    Market orders fill at the mark price, stop losses and trailing stops trigger on every price step.
+    """
+
+    def __init__(self, paths, tick_interval=0.1, speed=1.0, latency=0.0, rate_limit=None,
+                 tick_size='0.0001', qty_step='1', clock=time.monotonic):
+        self.paths = paths
+        self.clock = clock
+        self.tick_interval = tick_interval
+        self.speed = speed
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.tick_size = tick_size
+        self.qty_step = qty_step
+        self.started = clock()
+        self.step = 0
+        self.positions = {}
+        self.realized_pnl = 0.0
+        self.triggered = []
+        self.calls = {}
+        self.link_ids = set()
+        self._order_ids = itertools.count(1)
+        self._window = (0, 0)
+
+    # Test/bench side
+
+    @property
+    def api_calls(self):
+        return sum(self.calls.values())
+
+    def mark_price(self, symbol):
+        path = self.paths[symbol]
+        return path[min(self.step, len(path) - 1)]
+
+    def advance(self):
+        target = int((self.clock() - self.started) * self.speed / self.tick_interval)
+        while self.step < target:
+            self.step += 1
+            for key in list(self.positions):
+                self._check_triggers(key)
+
+    # Exchange internals
+
+    async def _call(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency() if callable(self.latency) else self.latency)
+        if self.rate_limit is not None:
+            second, count = self._window
+            now = int(self.clock())
+            count = count + 1 if now == second else 1
+            self._window = (now, count)
+            if count > self.rate_limit:
+                raise exceptions.InvalidRequestError(request=name, message='Too many visits!', status_code=10006,
+                                                     time=time.strftime('%H:%M:%S'), resp_headers={})
+        self.advance()
+
+    @staticmethod
+    def _ok(result):
+        return {'retCode': 0, 'retMsg': 'OK', 'result': result, 'retExtInfo': {}, 'time': int(time.time() * 1000)}
+
+    @staticmethod
+    def _error(name, message, code=10001):
+        return exceptions.InvalidRequestError(request=name, message=message, status_code=code,
+                                              time=time.strftime('%H:%M:%S'), resp_headers={})
+
+    def _check_triggers(self, key):
+        pos = self.positions[key]
+        price = self.mark_price(key[0])
+        long = pos['side'] == 'Buy'
+        if pos['trailingStop']:
+            pos['extreme'] = max(pos['extreme'], price) if long else min(pos['extreme'], price)
+            trail = pos['extreme'] - pos['trailingStop'] if long else pos['extreme'] + pos['trailingStop']
+            if (long and price <= trail) or (not long and price >= trail):
+                self._close(key, price, 'trailing_stop')
+                return
+        if pos['stopLoss'] and ((long and price <= pos['stopLoss']) or (not long and price >= pos['stopLoss'])):
+            self._close(key, price, 'stop_loss')
+
+    def _close(self, key, price, reason):
+        pos = self.positions.pop(key)
+        direction = 1 if pos['side'] == 'Buy' else -1
+        self.realized_pnl += direction * (price - pos['avgPrice']) * pos['size']
+        self.triggered.append((key[0], key[1], reason, price))
+
+    def _position_view(self, key, pos):
+        price = self.mark_price(key[0])
+        direction = 1 if pos['side'] == 'Buy' else -1
+        return {
+            'symbol': key[0],
+            'positionIdx': key[1],
+            'side': pos['side'],
+            'size': str(pos['size']),
+            'avgPrice': str(pos['avgPrice']),
+            'markPrice': str(price),
+            'stopLoss': str(pos['stopLoss'] or 0),
+            'trailingStop': str(pos['trailingStop'] or 0),
+            'leverage': '1',
+            'positionValue': str(pos['size'] * pos['avgPrice']),
+            'positionIM': str(pos['size'] * pos['avgPrice']),
+            'unrealisedPnl': str(direction * (price - pos['avgPrice']) * pos['size']),
+        }
+
+    def _fill(self, order):
+        symbol = order['symbol']
+        if symbol not in self.paths:
+            raise self._error('place_order', 'symbol invalid', 10001)
+        link_id = order.get('orderLinkId')
+        if link_id and link_id in self.link_ids:
+            raise self._error('place_order', 'OrderLinkedID is duplicate', 110072)
+        key = (symbol, int(order.get('positionIdx', 0)))
+        price = self.mark_price(symbol)
+        if order.get('reduceOnly'):
+            if key not in self.positions:
+                raise self._error('place_order', 'current position is zero, cannot fix reduce-only order qty', 110017)
+            self._close(key, price, 'close')
+        else:
+            qty = float(order['qty'])
+            if qty <= 0:
+                raise self._error('place_order', 'Qty invalid', 10001)
+            pos = self.positions.get(key)
+            if pos is None:
+                pos = self.positions[key] = {'side': order['side'], 'size': 0.0, 'avgPrice': price,
+                                             'stopLoss': 0.0, 'trailingStop': 0.0, 'extreme': price}
+            pos['avgPrice'] = (pos['avgPrice'] * pos['size'] + price * qty) / (pos['size'] + qty)
+            pos['size'] += qty
+            if order.get('stopLoss'):
+                pos['stopLoss'] = float(order['stopLoss'])
+        if link_id:
+            self.link_ids.add(link_id)
+        return {'orderId': str(next(self._order_ids)), 'orderLinkId': order.get('orderLinkId', '')}
+
+    # AsyncHTTP surface
+
+    async def close(self):
+        pass
+
+    async def get_server_time(self):
+        await self._call('get_server_time')
+        return self._ok({'timeSecond': str(int(time.time())), 'timeNano': str(time.time_ns())})
+
+    async def get_instruments_info(self, category='linear', symbol=None, limit=500, cursor=''):
+        await self._call('get_instruments_info')
+        symbols = [symbol] if symbol else sorted(self.paths)
+        offset = int(cursor or 0)
+        page = symbols[offset:offset + limit]
+        next_cursor = str(offset + limit) if offset + limit < len(symbols) else ''
+        return self._ok({
+            'category': category,
+            'list': [{'symbol': s, 'priceFilter': {'tickSize': self.tick_size},
+                      'lotSizeFilter': {'qtyStep': self.qty_step}} for s in page],
+            'nextPageCursor': next_cursor,
+        })
+
+    async def get_tickers(self, category='linear', symbol=None):
+        await self._call('get_tickers')
+        symbols = [symbol] if symbol else sorted(self.paths)
+        return self._ok({'category': category,
+                         'list': [{'symbol': s, 'markPrice': str(self.mark_price(s))} for s in symbols]})
+
+    async def get_positions(self, category='linear', settleCoin='USDT', symbol=None):
+        await self._call('get_positions')
+        return self._ok({'category': category, 'list': [
+            self._position_view(key, pos) for key, pos in self.positions.items() if symbol in (None, key[0])
+        ]})
+
+    async def place_order(self, category='linear', **order):
+        await self._call('place_order')
+        return self._ok(self._fill(order))
+
+    async def place_batch_order(self, category='linear', request=()):
+        await self._call('place_batch_order')
+        acks, infos = [], []
+        for order in request:
+            try:
+                acks.append(self._fill(order))
+                infos.append({'code': 0, 'msg': 'OK'})
+            except exceptions.InvalidRequestError as err:
+                acks.append({'orderId': '', 'orderLinkId': order.get('orderLinkId', '')})
+                infos.append({'code': err.status_code, 'msg': err.message})
+        resp = self._ok({'list': acks})
+        resp['retExtInfo'] = {'list': infos}
+        return resp
+
+    async def set_trading_stop(self, category='linear', symbol=None, positionIdx=0, **kwargs):
+        await self._call('set_trading_stop')
+        pos = self.positions.get((symbol, int(positionIdx)))
+        if pos is None:
+            raise self._error('set_trading_stop', 'can not set tp/sl/ts for zero position', 10001)
+        if 'stopLoss' in kwargs:
+            pos['stopLoss'] = float(kwargs['stopLoss'])
+        if 'trailingStop' in kwargs:
+            pos['trailingStop'] = float(kwargs['trailingStop'])
+            pos['extreme'] = self.mark_price(symbol)
+        return self._ok({})
+
+
+class FaultyBybit:
+    """
+    Wraps a SimulatedBybit and injects faults into its calls: network errors before the request arrives,
+    responses lost after the exchange applied the request, rate-limit rejections, hangs,
+    and outages of single endpoints given as {method: (start, end)} in seconds since creation.
+    """
+
+    def __init__(self, session, error_rate=0.0, lost_rate=0.0, rate_limit_rate=0.0, hang_rate=0.0, hang=30.0,
+                 outages=None, seed=None):
+        self.session = session
+        self.error_rate = error_rate
+        self.lost_rate = lost_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.hang_rate = hang_rate
+        self.hang = hang
+        self.outages = outages or {}
+        self.rng = random.Random(seed)
+        self.started = time.monotonic()
+        self.injected = {}
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+    def _count(self, fault):
+        self.injected[fault] = self.injected.get(fault, 0) + 1
+
+    @staticmethod
+    def _network_error(name):
+        return exceptions.FailedRequestError(request=name, message='Connection reset by peer', status_code=None,
+                                             time=time.strftime('%H:%M:%S'), resp_headers=None)
+
+    async def _inject(self, name, call, **kwargs):
+        elapsed = time.monotonic() - self.started
+        start, end = self.outages.get(name, (0, 0))
+        if start <= elapsed < end:
+            self._count('outage')
+            raise self._network_error(name)
+        roll = self.rng.random()
+        if roll < self.error_rate:
+            self._count('network')
+            raise self._network_error(name)
+        roll -= self.error_rate
+        if roll < self.rate_limit_rate:
+            self._count('rate_limit')
+            raise exceptions.InvalidRequestError(request=name, message='Too many visits!', status_code=10006,
+                                                 time=time.strftime('%H:%M:%S'), resp_headers={})
+        roll -= self.rate_limit_rate
+        if roll < self.hang_rate:
+            self._count('hang')
+            await asyncio.sleep(self.hang)
+        roll -= self.hang_rate
+        resp = await call(**kwargs)
+        if roll < self.lost_rate:
+            self._count('lost_response')
+            raise self._network_error(name)
+        return resp
+
+    async def close(self):
+        await self.session.close()
+
+    async def get_server_time(self, **kwargs):
+        return await self._inject('get_server_time', self.session.get_server_time, **kwargs)
+
+    async def get_instruments_info(self, **kwargs):
+        return await self._inject('get_instruments_info', self.session.get_instruments_info, **kwargs)
+
+    async def get_tickers(self, **kwargs):
+        return await self._inject('get_tickers', self.session.get_tickers, **kwargs)
+
+    async def get_positions(self, **kwargs):
+        return await self._inject('get_positions', self.session.get_positions, **kwargs)
+
+    async def place_order(self, **kwargs):
+        return await self._inject('place_order', self.session.place_order, **kwargs)
+
+    async def place_batch_order(self, **kwargs):
+        return await self._inject('place_batch_order', self.session.place_batch_order, **kwargs)
+
+    async def set_trading_stop(self, **kwargs):
+        return await self._inject('set_trading_stop', self.session.set_trading_stop, **kwargs)
@@ -0,0 +1,85 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class StateStore:
+    """
+    Crash-safe key/value state in SQLite: changes are appended to a journal,
+    committed in batches (one fsync per batch) and periodically folded into a compacted snapshot.
+    put() only buffers in memory, so it is cheap to call from the trading loop or the Telegram thread.
+    """
+
+    def __init__(self, path='state.db', flush_interval=0.2, compact_every=1000):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.compact_every = compact_every
+        self._pending = []
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=FULL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS journal (seq INTEGER PRIMARY KEY AUTOINCREMENT, '
+                          'key TEXT NOT NULL, value TEXT)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS snapshot (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+        self.journal_size = self.conn.execute('SELECT COUNT(*) FROM journal').fetchone()[0]
+
+    def put(self, key, value):
+        # None deletes the key
+        with self._lock:
+            self._pending.append((key, None if value is None else json.dumps(value)))
+
+    def load(self):
+        with self._db_lock:
+            state = {key: json.loads(value) for key, value in self.conn.execute('SELECT key, value FROM snapshot')}
+            for key, value in self.conn.execute('SELECT key, value FROM journal ORDER BY seq'):
+                if value is None:
+                    state.pop(key, None)
+                else:
+                    state[key] = json.loads(value)
+        return state
+
+    def flush(self):
+        with self._lock:
+            batch, self._pending = self._pending, []
+        if not batch:
+            return
+        with self._db_lock:
+            self.conn.execute('BEGIN')
+            self.conn.executemany('INSERT INTO journal (key, value) VALUES (?, ?)', batch)
+            self.conn.execute('COMMIT')
+        self.journal_size += len(batch)
+
+    def compact(self):
+        self.flush()
+        with self._db_lock:
+            self.conn.execute('BEGIN')
+            # The last journal entry of every key wins
+            self.conn.execute('INSERT OR REPLACE INTO snapshot (key, value) '
+                              'SELECT key, value FROM journal WHERE seq IN (SELECT MAX(seq) FROM journal GROUP BY key) '
+                              'AND value IS NOT NULL')
+            self.conn.execute('DELETE FROM snapshot WHERE key IN (SELECT key FROM journal '
+                              'WHERE seq IN (SELECT MAX(seq) FROM journal GROUP BY key) AND value IS NULL)')
+            self.conn.execute('DELETE FROM journal')
+            self.conn.execute('COMMIT')
+        self.journal_size = 0
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await asyncio.to_thread(self.flush)
+                if self.journal_size >= self.compact_every:
+                    await asyncio.to_thread(self.compact)
+            except Exception as err:
+                logger.warning('State flush failed: %s', err)
+
+    def close(self):
+        self.compact()
+        with self._db_lock:
+            self.conn.close()
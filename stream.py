@@ -0,0 +1,202 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import time
+
+import websockets
+
+from recorder import WS
+
+logger = logging.getLogger(__name__)
+
+
+PRIVATE_URL = 'wss://stream.bybit.com/v5/private'
+PUBLIC_URL = 'wss://stream.bybit.com/v5/public/linear'
+
+
+async def connect_forever(url, session):
+    delay = 1
+    while True:
+        try:
+            async with websockets.connect(url, ping_interval=None) as ws:
+                delay = 1
+                await session(ws)
+        except asyncio.CancelledError:
+            raise
+        except Exception as err:
+            logger.warning('Stream %s disconnected: %s', url, err)
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 30)
+
+
+async def ping(ws, interval):
+    while True:
+        await asyncio.sleep(interval)
+        await ws.send(json.dumps({'op': 'ping'}))
+
+
+class MarketStream:
+    """
+    Public `tickers.*` websocket feeding the mark prices of a MarketData.
+    One per MarketData: accounts sharing it subscribe through set_symbols() and the socket carries the union.
+    """
+
+    def __init__(self, market, recorder=None, url=PUBLIC_URL, ping_interval=20):
+        self.market = market
+        # Optional recorder.Recorder, streamed ticks are kept for replay
+        self.recorder = recorder
+        self.url = url
+        self.ping_interval = ping_interval
+        # owner -> symbols it wants
+        self.wanted = {}
+        self.subscribed = set()
+
+    # Only stores the wanted set: it may be called from another thread, the socket loop applies it
+    def set_symbols(self, symbols, owner=None):
+        self.wanted[owner] = set(symbols)
+
+    @property
+    def symbols(self):
+        return set().union(*list(self.wanted.values()))
+
+    async def run(self):
+        await connect_forever(self.url, self._session)
+
+    async def _session(self, ws):
+        self.subscribed = set()
+        pinger = asyncio.create_task(ping(ws, self.ping_interval))
+        sync = asyncio.create_task(self._sync_subscriptions(ws))
+        try:
+            async for message in ws:
+                self.on_message(json.loads(message))
+        finally:
+            pinger.cancel()
+            sync.cancel()
+
+    async def _sync_subscriptions(self, ws):
+        while True:
+            wanted = self.symbols
+            for op, symbols in (('subscribe', wanted - self.subscribed), ('unsubscribe', self.subscribed - wanted)):
+                symbols = sorted(symbols)
+                # Bybit accepts at most 10 args per request
+                for i in range(0, len(symbols), 10):
+                    args = [f'tickers.{symbol}' for symbol in symbols[i:i + 10]]
+                    await ws.send(json.dumps({'op': op, 'args': args}))
+            self.subscribed = wanted
+            await asyncio.sleep(1)
+
+    def on_message(self, message):
+        topic = message.get('topic', '')
+        if topic.startswith('tickers.'):
+            data = message['data']
+            # Deltas only carry changed fields
+            if data.get('markPrice'):
+                self.market.set_mark_price(data['symbol'], float(data['markPrice']))
+                if self.recorder is not None:
+                    self.recorder.tick(data['symbol'], data['markPrice'], WS)
+
+
+class BybitStream:
+    """
+    Keeps the positions of BybitExchange up to date from the private `position`/`execution` topics,
+    and its mark prices through a MarketStream. After every (re)connect the positions are resynced from REST.
+    Accounts sharing a MarketData pass the one MarketStream run next to them, otherwise the stream runs its own.
+    """
+
+    def __init__(self, exchange, api_key, api_secret, private_url=PRIVATE_URL, public_url=PUBLIC_URL,
+                 ping_interval=20, market_stream=None):
+        self.exchange = exchange
+        self.api_key = api_key
+        self.api_secret = api_secret
+        self.private_url = private_url
+        self.ping_interval = ping_interval
+        self.owns_market_stream = market_stream is None
+        self.market_stream = market_stream or MarketStream(exchange.market, exchange.recorder, public_url,
+                                                           ping_interval)
+        self.positions = {}
+        self.symbols = set()
+        self._events = {}
+
+    # Strategy side: wait until something changes for the symbol (or anything, if symbol is None)
+    async def wait_update(self, symbol=None, timeout=1):
+        event = self._events.setdefault(symbol, asyncio.Event())
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        event.clear()
+
+    def notify(self, symbol):
+        for key in (symbol, None):
+            event = self._events.get(key)
+            if event is not None:
+                event.set()
+
+    def set_symbols(self, symbols):
+        self.symbols = set(symbols)
+        self.market_stream.set_symbols(symbols, owner=self)
+
+    async def run(self):
+        if self.owns_market_stream:
+            await asyncio.gather(self.run_private(), self.market_stream.run())
+        else:
+            await self.run_private()
+
+    async def run_private(self):
+        await connect_forever(self.private_url, self._private_session)
+
+    async def _private_session(self, ws):
+        expires = int((time.time() + 10) * 1000)
+        signature = hmac.new(self.api_secret.encode(), f'GET/realtime{expires}'.encode(), hashlib.sha256).hexdigest()
+        await ws.send(json.dumps({'op': 'auth', 'args': [self.api_key, expires, signature]}))
+        resp = json.loads(await ws.recv())
+        if not resp.get('success'):
+            raise ConnectionError(f'Stream auth failed: {resp}')
+        await ws.send(json.dumps({'op': 'subscribe', 'args': ['position', 'execution']}))
+
+        await self.resync()
+        pinger = asyncio.create_task(ping(ws, self.ping_interval))
+        try:
+            async for message in ws:
+                self.on_private(json.loads(message))
+        finally:
+            pinger.cancel()
+            # Fall back to REST polling until the next resync
+            self.exchange.positions_cache.live = False
+
+    async def resync(self):
+        # Events missed while disconnected are recovered from one REST snapshot
+        positions = await self.exchange._fetch_positions()
+        self.positions = {(pos['symbol'], int(pos['positionIdx'])): pos for pos in positions if float(pos['size']) > 0}
+        self.exchange.positions_cache.set(list(self.positions.values()))
+        self.exchange.positions_cache.live = True
+        for symbol in {pos['symbol'] for pos in positions} | set(self.symbols):
+            self.notify(symbol)
+
+    def on_private(self, message):
+        topic = message.get('topic')
+        if topic == 'position':
+            for pos in message['data']:
+                key = (pos['symbol'], int(pos['positionIdx']))
+                if float(pos.get('size') or 0) > 0:
+                    pos.setdefault('avgPrice', pos.get('entryPrice'))
+                    self.positions[key] = pos
+                else:
+                    self.positions.pop(key, None)
+                self.exchange.risk.on_position(pos)
+                if pos.get('markPrice'):
+                    self.exchange.market.set_mark_price(pos['symbol'], float(pos['markPrice']))
+                if self.exchange.recorder is not None:
+                    self.exchange.recorder.position(pos, WS)
+            self.exchange.positions_cache.set(list(self.positions.values()))
+            for symbol in {pos['symbol'] for pos in message['data']}:
+                self.notify(symbol)
+        elif topic == 'execution':
+            for execution in message['data']:
+                logger.info('Execution %s %s %s @ %s', execution['symbol'], execution['side'],
+                            execution['execQty'], execution['execPrice'])
+                self.exchange.events.emit('fill', execution['symbol'], side=execution['side'],
+                                          qty=execution['execQty'], price=execution['execPrice'])
+                self.notify(execution['symbol'])
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from backtest import simulate
+
+
+def bars(*rows):
+    # (open, high, low) per minute, the close is not used
+    return np.array([(i * 60.0, o, h, l, o) for i, (o, h, l) in enumerate(rows)])
+
+
+def test_stop_inside_a_bar_is_seen():
+    # The closes never move, only the second bar's low touches the long's 1% stop
+    data = bars((100, 100, 100), (100, 100.5, 98.9), (100, 100, 100), (100, 100, 100))
+    result = simulate(data, np.array([[1.0, 5.0, 60.0]]), trade_size=10, cooldown=1000, fee=0)
+    assert result['trades'][0] == 1
+    # Long stopped at -1%, the short is closed flat at the next open
+    assert result['pnl'][0] == pytest.approx(-0.1)
+
+
+def test_trailing_stop_from_high_and_low():
+    # Short leg stopped at 101, the long trails 1% of 101 below the highest high
+    data = bars((100, 101.5, 100), (102, 104, 101), (103, 103.5, 102.9), (103, 103, 103))
+    result = simulate(data, np.array([[1.0, 1.0, 600.0]]), trade_size=10, cooldown=1000, fee=0)
+    exit_price = 104 - 1.01
+    assert result['pnl'][0] == pytest.approx(-0.1 + (exit_price - 100) / 100 * 10)
+
+
+def test_both_stops_in_one_bar_lose_both_legs():
+    data = bars((100, 100, 100), (100, 102, 98), (100, 100, 100))
+    result = simulate(data, np.array([[1.0, 1.0, 60.0]]), trade_size=10, cooldown=1000, fee=0)
+    assert result['pnl'][0] == pytest.approx(-0.2)
+    assert result['wins'][0] == 0
+
+
+def test_ticks():
+    times = np.arange(6, dtype=np.float64)
+    data = np.stack([times, [100, 100.5, 101, 101.5, 101, 100.5]], axis=1)
+    result = simulate(data, np.array([[1.0, 0.4, 100.0]]), trade_size=10, cooldown=1000, fee=0)
+    # Short stopped at 101, the long peaks at 101.5 and trails 0.404 below it
+    assert result['pnl'][0] == pytest.approx(-0.1 + (101.5 - 0.404 - 100) / 100 * 10)
+
+
+def test_unfinished_cycles_are_left_out():
+    grid = np.array([[1.0, 5.0, 600.0]])
+    # No stop is ever hit: the entry fees of the open straddle are not booked
+    data = bars((100, 100, 100), (100, 100.5, 99.5), (100, 100, 100))
+    result = simulate(data, grid, trade_size=10, cooldown=1000, fee=0.00055)
+    assert (result['pnl'][0], result['max_drawdown'][0], result['trades'][0]) == (0, 0, 0)
+    # The short is stopped, but the data ends before the long's hold window does
+    data = bars((100, 100, 100), (100, 101.5, 100), (101, 101, 101))
+    result = simulate(data, grid, trade_size=10, cooldown=1000, fee=0.00055)
+    assert (result['pnl'][0], result['max_drawdown'][0], result['trades'][0]) == (0, 0, 0)
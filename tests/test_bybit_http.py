@@ -0,0 +1,199 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import time
+
+import pytest
+from aiohttp import web
+from pybit import exceptions
+
+from bybit_http import AsyncHTTP
+from ratelimit import IP_LIMIT, RequestScheduler, TokenBucket
+from resilience import IpBanError, classify
+
+
+KEY = 'key'
+SECRET = 'secret'
+
+
+class MockBybit:
+    """
+    Local stand-in for the Bybit v5 REST API: checks signatures and answers with canned bodies.
+    """
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.requests = []
+        # Callable returning the response to every request instead, e.g. a rate-limit answer
+        self.override = None
+        self.app = web.Application()
+        self.app.router.add_route('*', '/{path:.*}', self.handle)
+
+    async def handle(self, request):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+            body = await request.text()
+            self.requests.append(request)
+            if self.override is not None:
+                return self.override()
+            if request.path.startswith('/v5/market/'):
+                # Public endpoints are not signed
+                assert 'X-BAPI-SIGN' not in request.headers
+                return web.json_response({'retCode': 0, 'retMsg': 'OK', 'result': {'list': []}})
+            payload = request.query_string if request.method == 'GET' else body
+            expected = hmac.new(SECRET.encode(), (request.headers['X-BAPI-TIMESTAMP'] + KEY
+                                                  + request.headers['X-BAPI-RECV-WINDOW'] + payload).encode(),
+                                hashlib.sha256).hexdigest()
+            if request.headers.get('X-BAPI-SIGN') != expected:
+                return web.json_response({'retCode': 10004, 'retMsg': 'error sign!', 'result': {}})
+            if request.path == '/v5/order/create' and json.loads(body).get('qty') == '0':
+                return web.json_response({'retCode': 10001, 'retMsg': 'params error', 'result': {}})
+            if request.path == '/v5/position/trading-stop':
+                return web.Response(status=502, text='bad gateway')
+            return web.json_response({'retCode': 0, 'retMsg': 'OK', 'result': {'list': []}})
+        finally:
+            self.in_flight -= 1
+
+    async def __aenter__(self):
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.endpoint = f'http://127.0.0.1:{port}'
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.runner.cleanup()
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_signed_get_and_post():
+    async def scenario():
+        async with MockBybit() as server:
+            http = AsyncHTTP(KEY, SECRET, endpoint=server.endpoint)
+            try:
+                positions = await http.get_positions(category='linear', settleCoin='USDT')
+                order = await http.place_order(category='linear', symbol='BTCUSDT', side='Buy', orderType='Market',
+                                               qty=0.5, positionIdx=1)
+            finally:
+                await http.close()
+            assert positions['retCode'] == 0 and order['retCode'] == 0
+            get, post = server.requests
+            assert get.query_string == 'category=linear&settleCoin=USDT'
+            # Bybit wants numbers as strings in bodies
+            assert json.loads(await post.text())['qty'] == '0.5'
+            assert get.headers['X-BAPI-API-KEY'] == KEY
+
+    run(scenario())
+
+
+def test_wrong_secret_is_an_invalid_request():
+    async def scenario():
+        async with MockBybit() as server:
+            http = AsyncHTTP(KEY, 'other', endpoint=server.endpoint)
+            try:
+                with pytest.raises(exceptions.InvalidRequestError) as err:
+                    await http.get_positions(category='linear')
+            finally:
+                await http.close()
+            assert err.value.status_code == 10004
+
+    run(scenario())
+
+
+def test_error_mapping():
+    async def scenario():
+        async with MockBybit() as server:
+            http = AsyncHTTP(KEY, SECRET, endpoint=server.endpoint)
+            try:
+                with pytest.raises(exceptions.InvalidRequestError) as rejected:
+                    await http.place_order(category='linear', symbol='BTCUSDT', side='Buy', qty='0')
+                with pytest.raises(exceptions.FailedRequestError) as failed:
+                    await http.set_trading_stop(category='linear', symbol='BTCUSDT', stopLoss=1.0)
+            finally:
+                await http.close()
+            assert rejected.value.status_code == 10001
+            assert failed.value.status_code == 502
+        # Nothing listens there any more: transport errors come back as FailedRequestError without a status
+        http = AsyncHTTP(KEY, SECRET, endpoint=server.endpoint, timeout=2)
+        try:
+            with pytest.raises(exceptions.FailedRequestError) as down:
+                await http.get_server_time()
+        finally:
+            await http.close()
+        assert down.value.status_code is None
+
+    run(scenario())
+
+
+def test_in_flight_cap():
+    async def scenario():
+        async with MockBybit(delay=0.05) as server:
+            http = AsyncHTTP(KEY, SECRET, endpoint=server.endpoint, max_in_flight=3)
+            try:
+                await asyncio.gather(*(http.get_tickers(category='linear', symbol=f'S{i}') for i in range(12)))
+            finally:
+                await http.close()
+            assert server.max_in_flight == 3
+            assert len(server.requests) == 12
+
+    run(scenario())
+
+
+def test_signed_after_queueing():
+    async def scenario():
+        async with MockBybit() as server:
+            scheduler = RequestScheduler()
+            # As after a 10006: the positions group waits for its reset
+            scheduler.buckets['positions'].block(time.monotonic() + 0.5)
+            http = AsyncHTTP(KEY, SECRET, endpoint=server.endpoint, scheduler=scheduler)
+            queued_at = time.time()
+            try:
+                await http.get_positions(category='linear')
+            finally:
+                await http.close()
+            signed_at = int(server.requests[0].headers['X-BAPI-TIMESTAMP']) / 1000
+            assert signed_at >= queued_at + 0.45
+
+    run(scenario())
+
+
+def test_ip_limits_block_every_account():
+    async def scenario():
+        async with MockBybit() as server:
+            ip_bucket = TokenBucket(IP_LIMIT)
+            scheduler, other = RequestScheduler(ip_bucket=ip_bucket), RequestScheduler(ip_bucket=ip_bucket)
+            http = AsyncHTTP(KEY, SECRET, endpoint=server.endpoint, scheduler=scheduler)
+            try:
+                # retCode 10018 with a reset time: everyone waits until then
+                reset = int((time.time() + 0.3) * 1000)
+                server.override = lambda: web.json_response(
+                    {'retCode': 10018, 'retMsg': 'ip rate limit', 'result': {}},
+                    headers={'X-Bapi-Limit-Reset-Timestamp': str(reset)})
+                with pytest.raises(exceptions.InvalidRequestError):
+                    await http.get_positions(category='linear')
+                started = time.monotonic()
+                await other.acquire('order')
+                assert time.monotonic() - started >= 0.25
+                # 403 without one: a ban, everyone pauses for minutes and the call is not retried
+                server.override = lambda: web.Response(status=403, text='Forbidden')
+                with pytest.raises(exceptions.FailedRequestError) as banned:
+                    await http.get_tickers(category='linear')
+                assert isinstance(classify(banned.value), IpBanError)
+                assert not classify(banned.value).retryable
+                assert ip_bucket.blocked_until - time.monotonic() > 500
+                with pytest.raises(asyncio.TimeoutError):
+                    await asyncio.wait_for(other.acquire('order'), 0.1)
+            finally:
+                await http.close()
+
+    run(scenario())
@@ -0,0 +1,123 @@
+import asyncio
+import json
+
+from fakeredis import aioredis
+
+from app import BybitBot
+from cluster import Coordinator, Worker, assign_symbols
+from exchange import BybitExchange
+from sim import SimulatedBybit
+
+
+SYMBOLS = ['AUSDT', 'BUSDT', 'CUSDT', 'DUSDT']
+
+
+def make_worker(client, sim, worker_id, lease=5.0):
+    return Worker(client, BybitBot(BybitExchange(session=sim)), lease=lease, worker_id=worker_id)
+
+
+async def make_cluster(symbols=SYMBOLS):
+    client = aioredis.FakeRedis(decode_responses=True)
+    coordinator = Coordinator(client, lease=5.0)
+    coordinator.submit_parameters({'coins_pair': symbols})
+    await coordinator.apply_commands()
+    return client, coordinator
+
+
+async def owners(client):
+    assignment = await client.hgetall('lenin:assign')
+    result = {}
+    for symbol, worker in assignment.items():
+        result.setdefault(worker, set()).add(symbol)
+    return result
+
+
+def test_assign_symbols_is_sticky_and_balanced():
+    result = assign_symbols(SYMBOLS, {'AUSDT': 'w2', 'BUSDT': 'w2', 'CUSDT': 'gone'}, ['w1', 'w2'])
+    assert result['AUSDT'] == 'w2' or result['BUSDT'] == 'w2'
+    assert sorted(result.values()) == ['w1', 'w1', 'w2', 'w2']
+    # Pinned symbols (open positions) never move, even at the cost of balance
+    result = assign_symbols(SYMBOLS, dict.fromkeys(SYMBOLS, 'w1'), ['w1', 'w2'], pinned=set(SYMBOLS))
+    assert set(result.values()) == {'w1'}
+    assert assign_symbols(SYMBOLS, {}, []) == {}
+
+
+def test_rebalance_on_new_worker():
+    async def scenario():
+        client, coordinator = await make_cluster()
+        sim = SimulatedBybit({symbol: [1.0] * 10 for symbol in SYMBOLS})
+        first = make_worker(client, sim, 'w1')
+        await first.heartbeat()
+        await coordinator.rebalance_once()
+        assert await owners(client) == {'w1': set(SYMBOLS)}
+        # AUSDT has an open position and stays where it is
+        await client.hset('lenin:positions', 'AUSDT', json.dumps({'stop_loss_set': True}))
+        second = make_worker(client, sim, 'w2')
+        await second.heartbeat()
+        await coordinator.rebalance_once()
+        result = await owners(client)
+        assert len(result['w1']) == len(result['w2']) == 2
+        assert 'AUSDT' in result['w1']
+
+    asyncio.run(scenario())
+
+
+def test_lease_expiry_hands_symbols_over():
+    async def scenario():
+        client, coordinator = await make_cluster()
+        sim = SimulatedBybit({symbol: [1.0] * 10 for symbol in SYMBOLS})
+        first = make_worker(client, sim, 'w1', lease=0.2)
+        second = make_worker(client, sim, 'w2')
+        await first.sync_once()
+        await second.sync_once()
+        await coordinator.rebalance_once()
+        await first.sync_once()
+        await second.sync_once()
+        assert first.runnable and second.runnable
+        assert not first.runnable & second.runnable
+        # w1 stops renewing its lease
+        await asyncio.sleep(0.3)
+        await coordinator.rebalance_once()
+        assert coordinator.workers == ['w2']
+        assert await client.smembers('lenin:workers') == {'w2'}
+        await second.sync_once()
+        assert second.runnable == set(SYMBOLS)
+
+    asyncio.run(scenario())
+
+
+def test_symbol_waits_for_the_live_owner():
+    async def scenario():
+        client, coordinator = await make_cluster(['AUSDT'])
+        sim = SimulatedBybit({'AUSDT': [1.0] * 10})
+        first = make_worker(client, sim, 'w1')
+        first.bot.open_positions['AUSDT'] = {'stop_loss_set': True}
+        await first.heartbeat()
+        # Assigned elsewhere while w1 still manages its position
+        await client.hset('lenin:assign', 'AUSDT', 'w2')
+        second = make_worker(client, sim, 'w2')
+        await second.sync_once()
+        assert second.runnable == set()
+
+    asyncio.run(scenario())
+
+
+def test_takeover_reconciles_with_the_exchange():
+    async def scenario():
+        client, coordinator = await make_cluster(['AUSDT', 'BUSDT'])
+        sim = SimulatedBybit({'AUSDT': [1.0] * 10, 'BUSDT': [2.0] * 10})
+        # The previous owner entered AUSDT and died before flushing its state,
+        # and BUSDT was closed after its last flush
+        for idx, side in ((1, 'Buy'), (2, 'Sell')):
+            await sim.place_order(symbol='AUSDT', side=side, orderType='Market', qty='3', positionIdx=idx)
+        await client.hset('lenin:positions', 'BUSDT', json.dumps({'stop_loss_set': True, 'close_at': 0}))
+        worker = make_worker(client, sim, 'w2')
+        await worker.sync_once()
+        await coordinator.rebalance_once()
+        await worker.sync_once()
+        assert worker.runnable == {'AUSDT', 'BUSDT'}
+        assert worker.bot.open_positions == {'AUSDT': {'stop_loss_set': False}}
+        await worker.flush()
+        assert set(await client.hkeys('lenin:positions')) == {'AUSDT'}
+
+    asyncio.run(scenario())
@@ -0,0 +1,80 @@
+import asyncio
+
+from exchange import BybitExchange
+from sim import FaultyBybit, SimulatedBybit
+
+
+SYMBOLS = [f'{letter}USDT' for letter in 'ABCDEF']
+
+
+def make_sim():
+    return SimulatedBybit({symbol: [1.0] * 10 for symbol in SYMBOLS})
+
+
+def entry_legs(symbol, qty=3.0):
+    return [{'symbol': symbol, 'side': side, 'orderType': 'Market', 'qty': qty, 'price': 1.0, 'positionIdx': idx}
+            for side, idx in (('Buy', 1), ('Sell', 2))]
+
+
+async def submit_all(exchange, legs_by_symbol):
+    results = await asyncio.gather(*(exchange.entry_batcher.submit(legs) for legs in legs_by_symbol.values()))
+    return dict(zip(legs_by_symbol, results))
+
+
+def test_batches_are_split_at_max_batch():
+    async def scenario():
+        sim = make_sim()
+        exchange = BybitExchange(session=sim)
+        # 12 legs: the first 10 go as soon as they are in, the last 2 after the batch window
+        results = await submit_all(exchange, {symbol: entry_legs(symbol) for symbol in SYMBOLS})
+        assert sim.calls['place_batch_order'] == 2
+        assert sim.calls.get('place_order', 0) == 0
+        for symbol, legs in results.items():
+            assert [(leg['symbol'], leg['positionIdx'], leg['code']) for leg in legs] == [(symbol, 1, 0),
+                                                                                      (symbol, 2, 0)]
+        assert len(sim.positions) == 12
+        assert not exchange.entry_batcher._tasks
+
+    asyncio.run(scenario())
+
+
+def test_leg_errors_reach_their_symbol():
+    async def scenario():
+        sim = make_sim()
+        exchange = BybitExchange(session=sim)
+        legs = {'AUSDT': entry_legs('AUSDT'), 'BUSDT': entry_legs('BUSDT', qty=0), 'CUSDT': entry_legs('CUSDT')}
+        results = await submit_all(exchange, legs)
+        assert sim.calls['place_batch_order'] == 1
+        assert {symbol: [leg['code'] for leg in result] for symbol, result in results.items()} == {
+            'AUSDT': [0, 0], 'BUSDT': [10001, 10001], 'CUSDT': [0, 0]}
+        assert {symbol for symbol, _ in sim.positions} == {'AUSDT', 'CUSDT'}
+
+    asyncio.run(scenario())
+
+
+def test_failed_batch_falls_back_to_single_orders():
+    async def scenario():
+        sim = make_sim()
+        exchange = BybitExchange(session=FaultyBybit(sim, outages={'place_batch_order': (0, 60)}))
+        exchange.session.attempts = 1
+        results = await submit_all(exchange, {'AUSDT': entry_legs('AUSDT'), 'BUSDT': entry_legs('BUSDT')})
+        assert sim.calls.get('place_batch_order', 0) == 0
+        assert sim.calls['place_order'] == 4
+        assert [leg['code'] for result in results.values() for leg in result] == [0, 0, 0, 0]
+        assert len(sim.positions) == 4
+
+    asyncio.run(scenario())
+
+
+def test_batch_orders_off_sends_single_orders(monkeypatch):
+    async def scenario():
+        sim = make_sim()
+        exchange = BybitExchange(session=sim)
+        assert not exchange.batch_orders
+        results = await submit_all(exchange, {'AUSDT': entry_legs('AUSDT')})
+        assert sim.calls.get('place_batch_order', 0) == 0
+        assert sim.calls['place_order'] == 2
+        assert [leg['code'] for leg in results['AUSDT']] == [0, 0]
+
+    monkeypatch.setenv('BATCH_ORDERS', '0')
+    asyncio.run(scenario())
@@ -0,0 +1,53 @@
+import asyncio
+
+from app import BybitBot
+from exchange import BybitExchange
+from sim import SimulatedBybit
+
+
+def make_bot():
+    sim = SimulatedBybit({'AUSDT': [1.0] * 100000})
+    bot = BybitBot(BybitExchange(session=sim))
+    bot.symbols = ['AUSDT']
+    bot.position_duration = 0
+    return sim, bot
+
+
+async def step(bot):
+    await bot.step_symbol('AUSDT')
+    # Every step sees what the previous one did
+    bot.exchange.positions_cache.invalidate()
+
+
+def test_trailing_stop_does_not_carry_over_to_the_next_entry():
+    async def scenario():
+        sim, bot = make_bot()
+        await step(bot)
+        await step(bot)
+        assert bot.open_positions['AUSDT'] == {'stop_loss_set': True}
+        # The short stops out, the long trails until the hold window is over
+        sim.positions.pop(('AUSDT', 2))
+        await step(bot)
+        assert sim.positions[('AUSDT', 1)]['trailingStop'] > 0
+        await step(bot)
+        assert 'AUSDT' not in bot.open_positions
+        assert not bot.exchange.stops.desired
+        # Next cycle: both legs get plain stop losses only
+        await step(bot)
+        await step(bot)
+        assert set(sim.positions) == {('AUSDT', 1), ('AUSDT', 2)}
+        for pos in sim.positions.values():
+            assert pos['stopLoss'] > 0
+            assert pos['trailingStop'] == 0
+
+    asyncio.run(scenario())
+
+
+def test_set_leg_replaces_the_desired_state():
+    _, bot = make_bot()
+    stops = bot.exchange.stops
+    stops.want('AUSDT', 1, stopLoss=0, trailingStop=0.01)
+    stops.set_leg('AUSDT', 1, stopLoss=0.99)
+    assert stops.desired[('AUSDT', 1)] == {'stopLoss': 0.99, 'trailingStop': 0.0}
+    stops.forget('AUSDT')
+    assert stops.desired == {}
@@ -0,0 +1,131 @@
+import asyncio
+
+import pytest
+
+from app import BybitBot
+from exchange import BybitExchange
+from resilience import (CircuitOpenError, DeadlineExceeded, RejectedError, ResilientSession, TransientError,
+                        deadline)
+from sim import FaultyBybit, SimulatedBybit
+
+
+def make_sim():
+    return SimulatedBybit({'AUSDT': [1.0] * 10, 'BUSDT': [2.0] * 10})
+
+
+def leg(symbol, side, idx, qty='3'):
+    return {'symbol': symbol, 'side': side, 'orderType': 'Market', 'qty': qty, 'positionIdx': idx}
+
+
+def test_lost_order_response_is_retried_with_the_same_link_id():
+    async def scenario():
+        sim = make_sim()
+        # Every response is lost, the retry is refused as a duplicate orderLinkId
+        session = ResilientSession(FaultyBybit(sim, lost_rate=1.0), base_delay=0.001)
+        resp = await session.place_order(category='linear', **leg('AUSDT', 'Buy', 1))
+        assert resp['retCode'] == 0
+        assert sim.calls['place_order'] == 2
+        assert sim.link_ids == {resp['result']['orderLinkId']}
+        assert sim.positions[('AUSDT', 1)]['size'] == 3
+
+    asyncio.run(scenario())
+
+
+def test_lost_batch_response_is_retried_with_the_same_link_ids():
+    async def scenario():
+        sim = make_sim()
+        # Seed 1: the first response is lost, the second one arrives
+        faulty = FaultyBybit(sim, lost_rate=0.5, seed=1)
+        session = ResilientSession(faulty, base_delay=0.001)
+        legs = [leg('AUSDT', 'Buy', 1), leg('AUSDT', 'Sell', 2)]
+        resp = await session.place_batch_order(category='linear', request=legs)
+        assert faulty.injected == {'lost_response': 1}
+        assert sim.calls['place_batch_order'] == 2
+        assert [info['code'] for info in resp['retExtInfo']['list']] == [0, 0]
+        assert sim.link_ids == {order['orderLinkId'] for order in legs}
+        assert {key: pos['size'] for key, pos in sim.positions.items()} == {('AUSDT', 1): 3, ('AUSDT', 2): 3}
+
+    asyncio.run(scenario())
+
+
+def test_breaker_opens_and_lets_one_probe_through():
+    async def scenario():
+        faulty = FaultyBybit(make_sim(), error_rate=1.0)
+        session = ResilientSession(faulty, attempts=1, threshold=3, reset_timeout=0.05)
+        for _ in range(3):
+            with pytest.raises(TransientError):
+                await session.get_tickers(category='linear')
+        breaker = session.breaker('get_tickers')
+        assert breaker.state == 'open'
+        with pytest.raises(CircuitOpenError):
+            await session.get_tickers(category='linear')
+        assert faulty.injected['network'] == 3
+        await asyncio.sleep(0.06)
+        assert breaker.state == 'half_open'
+        # Only the probe reaches the exchange, its failure opens the breaker again
+        results = await asyncio.gather(session.get_tickers(category='linear'),
+                                       session.get_tickers(category='linear'), return_exceptions=True)
+        assert sorted(type(result).__name__ for result in results) == ['CircuitOpenError', 'TransientError']
+        assert faulty.injected['network'] == 4
+        assert breaker.state == 'open'
+        # A successful probe closes it
+        faulty.error_rate = 0.0
+        await asyncio.sleep(0.06)
+        await session.get_tickers(category='linear')
+        assert breaker.state == 'closed'
+
+    asyncio.run(scenario())
+
+
+def test_deadline_cuts_retries_short():
+    async def scenario():
+        faulty = FaultyBybit(make_sim(), hang_rate=1.0, hang=30.0)
+        session = ResilientSession(faulty, attempts=10, attempt_timeout=5.0)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        with deadline(0.2):
+            with pytest.raises(DeadlineExceeded):
+                await session.get_positions(category='linear')
+        assert loop.time() - started < 1.0
+        assert faulty.injected == {'hang': 1}
+
+    asyncio.run(scenario())
+
+
+def test_rejections_are_not_retried():
+    async def scenario():
+        sim = make_sim()
+        session = ResilientSession(FaultyBybit(sim), base_delay=0.001)
+        with pytest.raises(RejectedError):
+            await session.place_order(category='linear', **leg('AUSDT', 'Buy', 1, qty='0'))
+        assert sim.calls['place_order'] == 1
+        assert session.retries == 0
+
+    asyncio.run(scenario())
+
+
+def test_failures_degrade_only_their_symbol():
+    async def scenario():
+        sim = make_sim()
+        # Mark price lookups fail, AUSDT does not need one
+        exchange = BybitExchange(session=FaultyBybit(sim, outages={'get_tickers': (0, 60)}))
+        exchange.session.attempts = 1
+        await exchange.instruments.load()
+        exchange.market.set_mark_price('AUSDT', 1.0, ttl=60)
+        bot = BybitBot(exchange)
+        bot.symbols = ['AUSDT', 'BUSDT']
+        tasks = [asyncio.create_task(bot.run_symbol(symbol)) for symbol in bot.symbols]
+        try:
+            for _ in range(100):
+                if 'BUSDT' in bot.degraded and 'AUSDT' in bot.open_positions:
+                    break
+                await asyncio.sleep(0.01)
+            assert bot.degraded == {'BUSDT'}
+            assert 'AUSDT' in bot.open_positions
+            assert 'BUSDT' not in bot.open_positions
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    asyncio.run(scenario())
@@ -0,0 +1,157 @@
+import asyncio
+
+import pytest
+
+from exchange import BybitExchange
+from risk import RiskEngine, RiskLimitError
+from sim import SimulatedBybit
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def position(symbol, side, size, price, mark=None, idx=None, margin=None):
+    pos = {'symbol': symbol, 'side': side, 'size': str(size), 'avgPrice': str(price),
+           'positionIdx': idx or (1 if side == 'Buy' else 2), 'leverage': '1'}
+    if mark is not None:
+        pos['markPrice'] = str(mark)
+    if margin is not None:
+        pos['positionIM'] = str(margin)
+    return pos
+
+
+def make_engine(**limits):
+    clock = Clock()
+    options = dict(max_notional=0, max_symbol_notional=0, max_margin=0, max_loss=0, max_symbols=0,
+                   throttle=1.0, throttle_interval=5.0, settle=10.0)
+    options.update(limits)
+    return RiskEngine(clock=clock, **options), clock
+
+
+def test_position_open_update_and_close():
+    risk, _ = make_engine()
+    risk.on_position(position('AUSDT', 'Buy', 2, 10.0, mark=10.0))
+    assert (risk.notional, risk.upnl, risk.margin) == (20.0, 0.0, 20.0)
+    risk.on_position(position('AUSDT', 'Sell', 1, 10.0, mark=11.0))
+    # Long 2 and short 1 at a mark of 11
+    assert risk.notional == pytest.approx(33.0)
+    assert risk.upnl == pytest.approx(2.0 - 1.0)
+    assert risk.margin == pytest.approx(30.0)
+    # The long grows at a new average price
+    risk.on_position(position('AUSDT', 'Buy', 3, 10.5, mark=11.0))
+    assert risk.notional == pytest.approx(44.0)
+    assert risk.upnl == pytest.approx(3 * 0.5 - 1.0)
+    risk.on_position({'symbol': 'AUSDT', 'positionIdx': 2, 'size': '0'})
+    assert risk.notional == pytest.approx(33.0)
+    assert risk.margin == pytest.approx(31.5)
+    risk.on_position({'symbol': 'AUSDT', 'positionIdx': 1, 'size': '0'})
+    assert (risk.notional, risk.upnl, risk.margin) == (0, 0, 0)
+    assert risk.symbols == {} and risk.legs == {}
+
+
+def test_price_moves_notional_and_upnl():
+    risk, _ = make_engine()
+    risk.on_position(position('AUSDT', 'Buy', 2, 10.0, mark=10.0))
+    risk.on_position(position('BUSDT', 'Sell', 1, 5.0, mark=5.0))
+    risk.on_price('AUSDT', 12.0)
+    assert risk.notional == pytest.approx(29.0)
+    assert risk.upnl == pytest.approx(4.0)
+    risk.on_price('BUSDT', 6.0)
+    assert risk.notional == pytest.approx(30.0)
+    assert risk.upnl == pytest.approx(3.0)
+    # Symbols without a position are ignored
+    risk.on_price('CUSDT', 1.0)
+    assert set(risk.symbols) == {'AUSDT', 'BUSDT'}
+
+
+def test_sync_drops_missing_legs():
+    risk, _ = make_engine()
+    risk.sync([position('AUSDT', 'Buy', 1, 10.0), position('AUSDT', 'Sell', 1, 10.0),
+               position('BUSDT', 'Buy', 1, 5.0)])
+    assert set(risk.legs) == {('AUSDT', 1), ('AUSDT', 2), ('BUSDT', 1)}
+    risk.sync([position('AUSDT', 'Sell', 1, 10.0)])
+    assert set(risk.legs) == {('AUSDT', 2)}
+    assert set(risk.symbols) == {'AUSDT'}
+    assert risk.notional == pytest.approx(10.0)
+    assert risk.margin == pytest.approx(10.0)
+
+
+def test_reservations_are_released_and_expire():
+    risk, clock = make_engine(max_notional=100)
+    risk.admit('AUSDT', 60)
+    assert risk.pending_notional == 60
+    with pytest.raises(RiskLimitError) as err:
+        risk.admit('BUSDT', 60)
+    assert err.value.reason == 'max_notional'
+    risk.release('AUSDT')
+    assert risk.pending == {} and risk.pending_notional == 0
+    risk.admit('BUSDT', 60)
+    # The position showing up replaces the reservation
+    risk.on_position(position('BUSDT', 'Buy', 6, 10.0))
+    assert risk.pending == {}
+    assert risk.notional == pytest.approx(60.0)
+    risk.on_position({'symbol': 'BUSDT', 'positionIdx': 1, 'size': '0'})
+    # A reservation whose position never shows up lapses after `settle` seconds
+    risk.admit('CUSDT', 60)
+    clock.now = 9.9
+    with pytest.raises(RiskLimitError):
+        risk.admit('DUSDT', 60)
+    clock.now = 10.0
+    risk.admit('DUSDT', 60)
+    assert set(risk.pending) == {'DUSDT'}
+
+
+@pytest.mark.parametrize('limits, held, entry, reason', [
+    ({'max_notional': 50}, [position('AUSDT', 'Buy', 4, 10.0)], ('BUSDT', 20), 'max_notional'),
+    ({'max_symbol_notional': 50}, [position('AUSDT', 'Buy', 4, 10.0)], ('AUSDT', 20), 'max_symbol_notional'),
+    ({'max_margin': 30}, [position('AUSDT', 'Buy', 4, 10.0, margin=20)], ('BUSDT', 20), 'max_margin'),
+    ({'max_loss': 5}, [position('AUSDT', 'Buy', 4, 10.0, mark=8.5)], ('BUSDT', 1), 'max_loss'),
+    ({'max_symbols': 1}, [position('AUSDT', 'Buy', 4, 10.0)], ('BUSDT', 1), 'max_symbols'),
+])
+def test_each_limit_blocks_entries(limits, held, entry, reason):
+    risk, _ = make_engine(**limits)
+    risk.sync(held)
+    with pytest.raises(RiskLimitError) as err:
+        risk.admit(*entry)
+    assert err.value.reason == reason
+    assert err.value.retry_after is None
+    assert risk.blocked == reason
+    assert risk.pending == {}
+
+
+def test_throttle_spaces_entries():
+    risk, clock = make_engine(max_notional=100, throttle=0.5, throttle_interval=5.0)
+    risk.admit('AUSDT', 40)
+    # 40% in use: below the throttle, the next entry goes straight through and takes usage to 60%
+    risk.admit('BUSDT', 20)
+    risk.admit('CUSDT', 10)
+    with pytest.raises(RiskLimitError) as err:
+        risk.admit('DUSDT', 10)
+    assert err.value.reason == 'throttle'
+    assert err.value.retry_after == pytest.approx(5.0)
+    assert risk.throttled == 1
+    clock.now = 5.0
+    risk.admit('DUSDT', 10)
+
+
+def test_cancelled_entry_releases_its_reservation():
+    async def scenario():
+        exchange = BybitExchange(session=SimulatedBybit({'AUSDT': [1.0] * 10}))
+        await exchange.instruments.load()
+        exchange.entry_batcher.window = 10.0
+        task = asyncio.create_task(exchange.place_orders('AUSDT', 6.0, 1.0))
+        while not exchange.entry_batcher.pending:
+            await asyncio.sleep(0)
+        assert 'AUSDT' in exchange.risk.pending
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert exchange.risk.pending == {}
+        assert exchange.risk.pending_notional == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,75 @@
+import asyncio
+
+from app import BybitBot
+from exchange import BybitExchange
+from sim import SimulatedBybit
+from state import StateStore
+
+
+def test_load_replays_the_journal_over_the_snapshot(tmp_path):
+    store = StateStore(str(tmp_path / 'state.db'))
+    store.put('a', 1)
+    store.put('b', {'x': [1, 2]})
+    store.put('c', 'gone soon')
+    store.compact()
+    store.put('a', 2)
+    store.put('c', None)
+    store.put('d', True)
+    store.flush()
+    assert store.load() == {'a': 2, 'b': {'x': [1, 2]}, 'd': True}
+
+
+def test_compact_keeps_the_last_value_per_key(tmp_path):
+    store = StateStore(str(tmp_path / 'state.db'))
+    store.put('a', 1)
+    store.put('b', 1)
+    store.compact()
+    for value in range(5):
+        store.put('a', value)
+    store.put('b', None)
+    store.put('c', None)
+    store.compact()
+    assert store.journal_size == 0
+    assert store.conn.execute('SELECT COUNT(*) FROM journal').fetchone()[0] == 0
+    assert dict(store.conn.execute('SELECT key, value FROM snapshot')) == {'a': '4'}
+    assert store.load() == {'a': 4}
+
+
+def test_flushed_state_survives_a_crash(tmp_path):
+    path = str(tmp_path / 'state.db')
+    store = StateStore(path)
+    store.put('a', 1)
+    store.compact()
+    store.put('a', 2)
+    store.put('b', [3])
+    store.flush()
+    # Buffered, never flushed: lost with the process
+    store.put('c', 4)
+    # No close(): the journal was never folded into the snapshot
+    reopened = StateStore(path)
+    assert reopened.journal_size == 2
+    assert reopened.load() == {'a': 2, 'b': [3]}
+
+
+def test_restore_reconciles_the_journal_with_the_exchange(tmp_path):
+    async def scenario():
+        sim = SimulatedBybit({symbol: [1.0] * 10 for symbol in ('AUSDT', 'BUSDT', 'CUSDT')})
+        # BUSDT was closed while the bot was down, CUSDT was entered right before a crash
+        await sim.place_order(symbol='CUSDT', side='Buy', orderType='Market', qty='3', positionIdx=1)
+        await sim.place_order(symbol='AUSDT', side='Buy', orderType='Market', qty='3', positionIdx=1)
+        await sim.set_trading_stop(symbol='AUSDT', positionIdx=1, stopLoss='0.99')
+        store = StateStore(str(tmp_path / 'state.db'))
+        store.put('params', {'coins_pair': ['AUSDT', 'BUSDT', 'CUSDT'], 'trade_size': 7})
+        store.put('open_positions', {'AUSDT': {'stop_loss_set': True, 'close_at': 5.0},
+                                     'BUSDT': {'stop_loss_set': True}})
+        store.flush()
+        bot = BybitBot(BybitExchange(session=sim), store=store)
+        await bot.restore()
+        assert bot.symbols == ['AUSDT', 'BUSDT', 'CUSDT']
+        assert bot.trade_size == 7
+        assert bot.open_positions == {'AUSDT': {'stop_loss_set': True, 'close_at': 5.0},
+                                      'CUSDT': {'stop_loss_set': False}}
+        store.flush()
+        assert store.load()['open_positions'] == bot.open_positions
+
+    asyncio.run(scenario())
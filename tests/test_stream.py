@@ -0,0 +1,165 @@
+import asyncio
+import hashlib
+import hmac
+import json
+
+import pytest
+import websockets
+
+from exchange import BybitExchange
+from sim import SimulatedBybit
+from stream import BybitStream, MarketStream
+
+
+KEY = 'key'
+SECRET = 'secret'
+
+
+class FakePrivateStream:
+    """
+    Local stand-in for wss://stream.bybit.com/v5/private: checks the auth signature, then pushes
+    whatever is put on `outgoing`. None in `outgoing` drops the connection.
+    """
+
+    def __init__(self):
+        self.outgoing = asyncio.Queue()
+        self.connections = 0
+        self.authenticated = 0
+        self.subscribed = []
+
+    async def handler(self, ws, path=None):
+        self.connections += 1
+        auth = json.loads(await ws.recv())
+        key, expires, signature = auth['args']
+        expected = hmac.new(SECRET.encode(), f'GET/realtime{expires}'.encode(), hashlib.sha256).hexdigest()
+        ok = auth['op'] == 'auth' and key == KEY and signature == expected
+        await ws.send(json.dumps({'op': 'auth', 'success': ok}))
+        if not ok:
+            return
+        self.authenticated += 1
+        self.subscribed.append(json.loads(await ws.recv())['args'])
+        closed = asyncio.ensure_future(ws.wait_closed())
+        try:
+            while True:
+                message = asyncio.ensure_future(self.outgoing.get())
+                await asyncio.wait([message, closed], return_when=asyncio.FIRST_COMPLETED)
+                if not message.done():
+                    # The client went away
+                    message.cancel()
+                    return
+                if message.result() is None:
+                    return
+                await ws.send(json.dumps(message.result()))
+        finally:
+            closed.cancel()
+
+    async def __aenter__(self):
+        self.server = await websockets.serve(self.handler, '127.0.0.1', 0)
+        self.url = f"ws://127.0.0.1:{self.server.sockets[0].getsockname()[1]}"
+        return self
+
+    async def __aexit__(self, *exc):
+        self.server.close()
+        await self.server.wait_closed()
+
+
+def position(symbol, idx, side, size, avg='1.0', mark='1.0'):
+    return {'symbol': symbol, 'positionIdx': idx, 'side': side, 'size': size, 'entryPrice': avg, 'markPrice': mark}
+
+
+async def wait_for(predicate, timeout=5):
+    for _ in range(int(timeout / 0.01)):
+        if predicate():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError('condition not reached')
+
+
+async def stop(task):
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+
+
+def make_stream(url, secret=SECRET):
+    sim = SimulatedBybit({'AUSDT': [1.0] * 10, 'BUSDT': [2.0] * 10})
+    exchange = BybitExchange(session=sim)
+    return sim, exchange, BybitStream(exchange, KEY, secret, private_url=url)
+
+
+def test_auth_rejected():
+    async def scenario():
+        async with FakePrivateStream() as server:
+            _, _, stream = make_stream(server.url, secret='wrong')
+            async with websockets.connect(server.url) as ws:
+                with pytest.raises(ConnectionError):
+                    await stream._private_session(ws)
+            assert server.authenticated == 0
+
+    asyncio.run(scenario())
+
+
+def test_position_deltas():
+    async def scenario():
+        async with FakePrivateStream() as server:
+            _, exchange, stream = make_stream(server.url)
+            task = asyncio.create_task(stream.run_private())
+            try:
+                await wait_for(lambda: exchange.positions_cache.live)
+                assert server.subscribed == [['position', 'execution']]
+                waiter = asyncio.create_task(stream.wait_update('AUSDT', timeout=5))
+                await server.outgoing.put({'topic': 'position', 'data': [position('AUSDT', 1, 'Buy', '2'),
+                                                                         position('AUSDT', 2, 'Sell', '2')]})
+                await asyncio.wait_for(waiter, 5)
+                assert len(await exchange.get_symbols_pos('AUSDT')) == 2
+                # entryPrice of the stream is exposed as avgPrice, like REST
+                assert (await exchange.get_symbols_pos('AUSDT'))[0]['avgPrice'] == '1.0'
+                # A leg going to size 0 is gone from the snapshot
+                await server.outgoing.put({'topic': 'position', 'data': [position('AUSDT', 2, '', '0')]})
+                await wait_for(lambda: len(exchange.positions_cache.by_symbol.get('AUSDT', [])) == 1)
+                assert int((await exchange.get_symbols_pos('AUSDT'))[0]['positionIdx']) == 1
+            finally:
+                await stop(task)
+
+    asyncio.run(scenario())
+
+
+def test_resync_after_reconnect():
+    async def scenario():
+        async with FakePrivateStream() as server:
+            sim, exchange, stream = make_stream(server.url)
+            task = asyncio.create_task(stream.run_private())
+            try:
+                await wait_for(lambda: exchange.positions_cache.live)
+                await server.outgoing.put({'topic': 'position', 'data': [position('AUSDT', 1, 'Buy', '2')]})
+                await wait_for(lambda: 'AUSDT' in exchange.positions_cache.by_symbol)
+                # While disconnected the long is closed and a short opens on another symbol
+                sim.positions.clear()
+                await sim.place_order(symbol='BUSDT', side='Sell', orderType='Market', qty='3', positionIdx=2)
+                await server.outgoing.put(None)
+                await wait_for(lambda: not exchange.positions_cache.live)
+                await wait_for(lambda: server.authenticated == 2 and exchange.positions_cache.live)
+                assert set(exchange.positions_cache.by_symbol) == {'BUSDT'}
+                assert set(stream.positions) == {('BUSDT', 2)}
+            finally:
+                await stop(task)
+
+    asyncio.run(scenario())
+
+
+def test_accounts_share_one_market_stream():
+    sim = SimulatedBybit({'AUSDT': [1.0] * 10})
+    first = BybitExchange(session=sim)
+    second = BybitExchange(session=sim, market=first.market)
+    market_stream = MarketStream(first.market)
+    streams = [BybitStream(exchange, KEY, SECRET, market_stream=market_stream) for exchange in (first, second)]
+    streams[0].set_symbols(['AUSDT', 'BUSDT'])
+    streams[1].set_symbols(['BUSDT', 'CUSDT'])
+    assert market_stream.symbols == {'AUSDT', 'BUSDT', 'CUSDT'}
+    streams[0].set_symbols([])
+    assert market_stream.symbols == {'BUSDT', 'CUSDT'}
+    # One tick reaches both accounts
+    market_stream.on_message({'topic': 'tickers.CUSDT', 'data': {'symbol': 'CUSDT', 'markPrice': '3.5'}})
+    assert first.market.mark_prices['CUSDT'][0] == second.market.mark_prices['CUSDT'][0] == 3.5